@@ -0,0 +1,267 @@
+"""End-to-end benchmark of the 3DFin processing.
+
+Synthetic plots are generated (and kept in the work directory for the next runs)
+and processed by StandaloneLASProcessing, each run in a fresh process so that the
+peak memory of a run is not affected by the previous ones. The duration, CPU time
+and peak memory of each stage are read from the timings exported by the processing
+and gathered in a JSON file, which could be compared with the one of a previous
+benchmark (e.g. before a change of the pipeline) with --compare.
+
+Example:
+    python benchmarks/run_benchmark.py --scenario 1M --repeat 3 --output after.json --compare before.json
+
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import platform
+import statistics
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Optional
+
+from synthetic_plot import PlotParameters, SyntheticPlot
+
+# Named plots, from a small plot to a plot that does not fit in memory without
+# tiling or windowed loading.
+SCENARIOS = {
+    "1M": {"n_points": 1_000_000, "n_stems": 20},
+    "10M": {"n_points": 10_000_000, "n_stems": 60},
+    "50M": {"n_points": 50_000_000, "n_stems": 150},
+    "500M": {"n_points": 500_000_000, "n_stems": 400},
+}
+
+# Processing modes: the plot is either processed as an already normalized cloud,
+# or its normalized heights are computed from a DTM generated by the processing.
+MODES = ("normalized", "normalize")
+
+
+def _plot_path(work_dir: Path, parameters: PlotParameters) -> Path:
+    """Get the path of a synthetic plot, named after a digest of its parameters."""
+    digest = hashlib.sha256(json.dumps(parameters.as_dict(), sort_keys=True).encode()).hexdigest()[:12]
+    return work_dir / f"plot_{digest}.las"
+
+
+def _generate_plot(work_dir: Path, parameters: PlotParameters) -> Path:
+    """Generate a synthetic plot, unless it was generated by a previous benchmark."""
+    path = _plot_path(work_dir, parameters)
+    if not path.exists():
+        print(f"Generating {parameters.n_points} points in {path}")
+        # The plot is written under a temporary name, so an interrupted generation is not reused.
+        partial_path = path.with_suffix(".partial.las")
+        SyntheticPlot(parameters).write(partial_path)
+        partial_path.replace(path)
+    return path
+
+
+def _run_processing(config: Any, log_path: Path) -> None:
+    """Process a plot, in a worker process."""
+    from three_d_fin.processing.progress import Progress
+    from three_d_fin.processing.standalone_processing import StandaloneLASProcessing
+
+    fin_processing = StandaloneLASProcessing(config)
+    with log_path.open("w") as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        # The progress bar output is bound on its creation, it is not affected by the redirection.
+        fin_processing.progress = Progress(output=log)
+        fin_processing.process()
+
+
+def _read_stages(timings_path: Path) -> dict[str, dict[str, Any]]:
+    """Read the end event of each stage from a timings file."""
+    stages = {}
+    with timings_path.open() as f:
+        for line in f:
+            event = json.loads(line)
+            if event.pop("event") == "end":
+                stages[event.pop("stage")] = event
+    return stages
+
+
+def _environment() -> dict[str, Any]:
+    """Describe the machine and the software versions, as benchmarks are only comparable on the same ones."""
+    from importlib.metadata import version
+
+    return {
+        "3DFin": version("3DFin"),
+        "dendromatics": version("dendromatics"),
+        "laspy": version("laspy"),
+        "numpy": version("numpy"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": multiprocessing.cpu_count(),
+    }
+
+
+def run_benchmark(
+    parameters: PlotParameters,
+    work_dir: Path,
+    modes: list[str],
+    repeat: int,
+    params_file: Optional[Path] = None,
+    misc: Optional[dict[str, str]] = None,
+) -> dict[str, Any]:
+    """Generate a synthetic plot and time the processing of it.
+
+    Parameters
+    ----------
+    parameters : PlotParameters
+        The parameters of the synthetic plot.
+    work_dir : Path
+        The directory where plots are generated and processed.
+    modes : list[str]
+        The processing modes, see MODES.
+    repeat : int
+        Number of runs per mode.
+    params_file : Optional[Path]
+        The 3DFin parameters file, the default parameters are used if None.
+    misc : Optional[dict[str, str]]
+        Additional misc parameters, e.g. to enable the windowed loading.
+
+    Returns
+    -------
+    results : dict[str, Any]
+        The benchmark results, with the environment, the plot parameters, the
+        stages of each run and a summary of the median durations per mode.
+
+    """
+    from three_d_fin.processing.configuration import FinConfiguration, MiscParameters
+
+    work_dir.mkdir(parents=True, exist_ok=True)
+    plot_path = _generate_plot(work_dir, parameters)
+    config = FinConfiguration.From_config_file(params_file) if params_file is not None else FinConfiguration()
+    runs = []
+    # A fresh process per run, spawned so that it does not inherit the memory of this one.
+    context = multiprocessing.get_context("spawn")
+    for mode in modes:
+        for i in range(repeat):
+            output_dir = work_dir / f"{plot_path.stem}_{mode}_{i}"
+            output_dir.mkdir(exist_ok=True)
+            run_config = FinConfiguration(
+                basic=config.basic,
+                advanced=config.advanced,
+                expert=config.expert,
+                misc=MiscParameters(
+                    **{
+                        **(misc or {}),
+                        "is_normalized": mode == "normalized",
+                        "input_file": plot_path,
+                        "output_dir": output_dir,
+                        "export_timings": True,
+                    }
+                ),
+            )
+            print(f"Running {mode} [{i + 1}/{repeat}], see {output_dir} for the outputs")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                executor.submit(_run_processing, run_config, output_dir / "log.txt").result()
+            stages = _read_stages(output_dir / f"{plot_path.stem}_timings.jsonl")
+            runs.append(
+                {
+                    "mode": mode,
+                    "repeat": i,
+                    "trees_generated": parameters.n_stems,
+                    "trees_detected": stages["process"].get("trees"),
+                    "stages": stages,
+                }
+            )
+
+    summary: dict[str, dict[str, float]] = {}
+    for mode in modes:
+        mode_runs = [run["stages"] for run in runs if run["mode"] == mode]
+        summary[mode] = {
+            stage: statistics.median(stages[stage]["wall_time"] for stages in mode_runs if stage in stages)
+            for stage in mode_runs[0]
+        }
+    return {
+        "environment": _environment(),
+        "plot": parameters.as_dict(),
+        "misc": misc or {},
+        "runs": runs,
+        "summary": summary,
+    }
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any]) -> None:
+    """Print the median duration of each stage against the one of a baseline.
+
+    Parameters
+    ----------
+    results : dict[str, Any]
+        The results of the benchmark, see run_benchmark(...).
+    baseline : dict[str, Any]
+        The results of a previous benchmark.
+
+    """
+    if results["plot"] != baseline["plot"]:
+        print("Warning: the baseline was computed on a different plot")
+    if results["environment"]["platform"] != baseline["environment"]["platform"]:
+        print("Warning: the baseline was computed on a different platform")
+    for mode, stages in results["summary"].items():
+        baseline_stages = baseline["summary"].get(mode, {})
+        print(f"\n{mode}")
+        print(f"{'stage':<24}{'baseline (s)':>14}{'current (s)':>14}{'ratio':>8}")
+        for stage, wall_time in stages.items():
+            if stage in baseline_stages:
+                before = baseline_stages[stage]
+                ratio = f"{wall_time / before:.2f}" if before > 0 else "-"
+                print(f"{stage:<24}{before:>14.3f}{wall_time:>14.3f}{ratio:>8}")
+            else:
+                print(f"{stage:<24}{'-':>14}{wall_time:>14.3f}{'-':>8}")
+
+
+def main() -> int:
+    """Run the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=SCENARIOS.keys(), default="1M", help="named plot (default: 1M)")
+    parser.add_argument("--points", type=float, default=None, help="number of points, overrides the scenario")
+    parser.add_argument("--stems", type=int, default=None, help="number of trees, overrides the scenario")
+    parser.add_argument("--slope", type=float, default=0.1, help="terrain slope in m/m (default: 0.1)")
+    parser.add_argument("--noise", type=float, default=0.005, help="measurement noise in meters (default: 0.005)")
+    parser.add_argument("--density", type=float, default=None, help="points per m^2, sets the plot size")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+    parser.add_argument("--mode", choices=(*MODES, "both"), default="both", help="processing mode (default: both)")
+    parser.add_argument("--repeat", type=int, default=1, help="number of runs per mode (default: 1)")
+    parser.add_argument("--params", type=Path, default=None, help=".ini file with the 3DFin parameters")
+    parser.add_argument(
+        "--misc",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="additional misc parameter, e.g. windowed_loading=true (could be repeated)",
+    )
+    parser.add_argument("--work_dir", type=Path, default=Path("benchmark_data"), help="generated plots and outputs")
+    parser.add_argument("--output", type=Path, default=None, help="JSON file where the results are written")
+    parser.add_argument("--compare", type=Path, default=None, help="JSON results of a previous benchmark")
+    cli_parse = parser.parse_args()
+
+    plot = dict(SCENARIOS[cli_parse.scenario])
+    if cli_parse.points is not None:
+        plot["n_points"] = int(cli_parse.points)
+    if cli_parse.stems is not None:
+        plot["n_stems"] = cli_parse.stems
+    parameters = PlotParameters(
+        **plot, slope=cli_parse.slope, noise=cli_parse.noise, density=cli_parse.density, seed=cli_parse.seed
+    )
+    misc = dict(option.split("=", 1) for option in cli_parse.misc)
+    modes = list(MODES) if cli_parse.mode == "both" else [cli_parse.mode]
+
+    results = run_benchmark(parameters, cli_parse.work_dir, modes, cli_parse.repeat, cli_parse.params, misc)
+    if cli_parse.output is not None:
+        cli_parse.output.write_text(json.dumps(results, indent=2))
+    if cli_parse.compare is not None:
+        compare(results, json.loads(cli_parse.compare.read_text()))
+    else:
+        for mode, stages in results["summary"].items():
+            print(f"\n{mode}")
+            for stage, wall_time in stages.items():
+                print(f"{stage:<24}{wall_time:>10.3f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""Startup time benchmark of the 3DFin command line.
+
+Time the command line up to the point where the processing starts, i.e. without
+the GUI and the algorithm libraries (dendromatics, pandas...) which are imported
+on first use. The interpreter startup time is measured apart and subtracted.
+The benchmark fails (exit code 1) if the median startup time exceeds the target.
+
+Example:
+    python benchmarks/startup.py --repeat 20 --target 0.3
+
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+# Commands timed, in a fresh interpreter each time.
+COMMANDS = {
+    "interpreter": "pass",
+    "cli --help": (
+        "import sys\n"
+        "sys.argv = ['3DFin', 'cli', '--help']\n"
+        "from three_d_fin.processing import launch_application\n"
+        "try:\n"
+        "    launch_application()\n"
+        "except SystemExit:\n"
+        "    pass"
+    ),
+    "processing setup": (
+        "from three_d_fin.processing.configuration import FinConfiguration\n"
+        "from three_d_fin.processing.standalone_processing import StandaloneLASProcessing\n"
+        "StandaloneLASProcessing(FinConfiguration())"
+    ),
+}
+
+
+def time_command(code: str, repeat: int) -> float:
+    """Get the median wall time of a Python code run in a fresh interpreter."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.DEVNULL)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def main() -> int:
+    """Run the startup benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10, help="number of runs per command (default: 10)")
+    parser.add_argument(
+        "--target",
+        type=float,
+        default=0.3,
+        help="maximum startup time in seconds, interpreter startup excluded (default: 0.3)",
+    )
+    cli_parse = parser.parse_args()
+
+    durations = {name: time_command(code, cli_parse.repeat) for name, code in COMMANDS.items()}
+    interpreter = durations.pop("interpreter")
+    print(f"{'interpreter':<20}{interpreter:>8.3f} s")
+    success = True
+    for name, duration in durations.items():
+        startup = duration - interpreter
+        status = "ok" if startup <= cli_parse.target else "too slow"
+        success &= startup <= cli_parse.target
+        print(f"{name:<20}{startup:>8.3f} s  {status}")
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""Deterministic synthetic forest plot generator.
+
+Generate a LAS/LAZ point cloud of a square forest plot made of a sloped terrain,
+tapered stems and ellipsoidal crowns. Points are generated and written chunk by
+chunk, each chunk with its own random generator derived from the seed, so clouds
+of hundreds of millions of points are generated with a bounded memory footprint
+and the same parameters always give the same cloud.
+
+Normalized heights are stored in a Z0 extra field, so the cloud could be processed
+either as normalized or not.
+"""
+
+import argparse
+from pathlib import Path
+from typing import Optional
+
+import laspy
+import numpy as np
+
+# Number of points generated and written at once.
+CHUNK_SIZE = 2_000_000
+
+
+class PlotParameters:
+    """Parameters of a synthetic forest plot."""
+
+    def __init__(
+        self,
+        n_points: int = 1_000_000,
+        n_stems: int = 30,
+        dbh_mean: float = 0.3,
+        dbh_std: float = 0.08,
+        slope: float = 0.1,
+        noise: float = 0.005,
+        density: Optional[float] = None,
+        ground_fraction: float = 0.3,
+        stem_fraction: float = 0.3,
+        outlier_fraction: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        """Init the plot parameters.
+
+        Parameters
+        ----------
+        n_points : int
+            Total number of points of the cloud.
+        n_stems : int
+            Number of trees in the plot.
+        dbh_mean : float
+            Mean diameter at breast height (1.3 m) of the trees, in meters.
+        dbh_std : float
+            Standard deviation of the diameter at breast height, in meters.
+        slope : float
+            Slope of the terrain along the (x) axis, in m/m.
+        noise : float
+            Standard deviation of the measurement noise, in meters.
+        density : Optional[float]
+            Number of points per m^2 of plot, it sets the plot size along with
+            n_points. If None, the plot size is set from the number of stems
+            (about 400 stems/ha).
+        ground_fraction : float
+            Fraction of the points on the ground.
+        stem_fraction : float
+            Fraction of the points on the stems, remaining points are on the crowns.
+        outlier_fraction : float
+            Fraction of the points randomly scattered below the ground (noise).
+        seed : int
+            Seed of the random generators.
+
+        """
+        self.n_points = int(n_points)
+        self.n_stems = n_stems
+        self.dbh_mean = dbh_mean
+        self.dbh_std = dbh_std
+        self.slope = slope
+        self.noise = noise
+        self.ground_fraction = ground_fraction
+        self.stem_fraction = stem_fraction
+        self.outlier_fraction = outlier_fraction
+        self.seed = seed
+        area = self.n_points / density if density is not None else n_stems / 0.04
+        self.side = float(np.sqrt(area))
+
+    def as_dict(self) -> dict[str, float]:
+        """Get the parameters as a JSON serializable dictionary."""
+        return dict(vars(self))
+
+
+class SyntheticPlot:
+    """A synthetic forest plot, trees are drawn from the plot parameters."""
+
+    def __init__(self, parameters: PlotParameters) -> None:
+        """Draw the trees of the plot.
+
+        Parameters
+        ----------
+        parameters : PlotParameters
+            The parameters of the plot.
+
+        """
+        self.parameters = parameters
+        rng = np.random.default_rng([parameters.seed, 0])
+        side = parameters.side
+
+        # Tree locations, with a minimal spacing between trees as far as possible.
+        locations = []
+        min_spacing = min(3.0, side / np.sqrt(parameters.n_stems) / 2.0)
+        for _ in range(parameters.n_stems * 100):
+            if len(locations) == parameters.n_stems:
+                break
+            candidate = rng.uniform(1.0, side - 1.0, 2)
+            if all(np.hypot(*(candidate - location)) >= min_spacing for location in locations):
+                locations.append(candidate)
+        while len(locations) < parameters.n_stems:
+            locations.append(rng.uniform(1.0, side - 1.0, 2))
+        self.locations = np.array(locations).reshape(-1, 2)
+
+        self.dbh = np.maximum(rng.normal(parameters.dbh_mean, parameters.dbh_std, parameters.n_stems), 0.075)
+        # Naslund height-diameter model, with diameters in cm.
+        dbh_cm = self.dbh * 100.0
+        self.heights = 1.3 + (dbh_cm / (1.5 + 0.2 * dbh_cm)) ** 2 * rng.uniform(0.9, 1.1, parameters.n_stems)
+        self.crown_base = self.heights * rng.uniform(0.4, 0.6, parameters.n_stems)
+        self.crown_radius = np.maximum(self.dbh * 15.0, 1.0)
+        self.tilts = rng.normal(0.0, 0.02, (parameters.n_stems, 2))
+
+    def terrain(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Get the elevation of the terrain."""
+        return self.parameters.slope * x + 0.3 * np.sin(x / 5.0) * np.cos(y / 7.0)
+
+    def stem_radius(self, tree: np.ndarray, z0: np.ndarray) -> np.ndarray:
+        """Get the radius of the stems at given normalized heights, stems taper linearly."""
+        taper = (self.heights[tree] - z0) / (self.heights[tree] - 1.3)
+        return np.maximum(self.dbh[tree] / 2.0 * taper, 0.01)
+
+    def _generate_chunk(self, chunk_index: int, n_points: int) -> tuple[np.ndarray, np.ndarray]:
+        """Generate a chunk of points.
+
+        Returns
+        -------
+        xyz : np.ndarray
+            A (n, 3) array with the (x), (y) and (z) coordinates of the points.
+        z0 : np.ndarray
+            The normalized heights of the points.
+
+        """
+        parameters = self.parameters
+        rng = np.random.default_rng([parameters.seed, 1, chunk_index])
+        crown_fraction = max(
+            1.0 - parameters.ground_fraction - parameters.stem_fraction - parameters.outlier_fraction, 0
+        )
+        fractions = np.array(
+            [parameters.ground_fraction, parameters.stem_fraction, crown_fraction, parameters.outlier_fraction]
+        )
+        n_ground, n_stem, n_crown, n_outlier = rng.multinomial(n_points, fractions / fractions.sum())
+
+        # Ground and outliers below it.
+        ground_xy = rng.uniform(0.0, parameters.side, (n_ground + n_outlier, 2))
+        ground_z0 = np.r_[np.zeros(n_ground), -rng.uniform(0.2, 2.0, n_outlier)]
+
+        # Stems, points are distributed among the stems according to their surface, and
+        # are denser near the ground as the upper part of the stems is occluded by the crowns.
+        stem_weights = self.dbh * self.heights
+        stem_tree = rng.choice(parameters.n_stems, n_stem, p=stem_weights / stem_weights.sum())
+        stem_z0 = self.heights[stem_tree] * 0.9 * rng.uniform(0.0, 1.0, n_stem) ** 2
+        angle = rng.uniform(0.0, 2.0 * np.pi, n_stem)
+        radius = self.stem_radius(stem_tree, stem_z0)
+        stem_xy = (
+            self.locations[stem_tree]
+            + self.tilts[stem_tree] * stem_z0[:, np.newaxis]
+            + radius[:, np.newaxis] * np.c_[np.cos(angle), np.sin(angle)]
+        )
+
+        # Crowns, as ellipsoids above the crown base.
+        crown_weights = self.crown_radius**2 * (self.heights - self.crown_base)
+        crown_tree = rng.choice(parameters.n_stems, n_crown, p=crown_weights / crown_weights.sum())
+        direction = rng.normal(size=(n_crown, 3))
+        direction /= np.linalg.norm(direction, axis=1)[:, np.newaxis]
+        scale = rng.uniform(0.0, 1.0, n_crown)[:, np.newaxis] ** (1.0 / 3.0)
+        half_length = (self.heights[crown_tree] - self.crown_base[crown_tree]) / 2.0
+        crown_offset = (
+            direction * scale * np.c_[self.crown_radius[crown_tree], self.crown_radius[crown_tree], half_length]
+        )
+        crown_z0 = self.crown_base[crown_tree] + half_length + crown_offset[:, 2]
+        crown_xy = self.locations[crown_tree] + self.tilts[crown_tree] * crown_z0[:, np.newaxis] + crown_offset[:, 0:2]
+
+        xy = np.vstack((ground_xy, stem_xy, crown_xy))
+        z0 = np.concatenate((ground_z0, stem_z0, crown_z0))
+        ground = self.terrain(xy[:, 0], xy[:, 1])
+        xyz = np.c_[xy, ground + z0] + rng.normal(0.0, parameters.noise, (xy.shape[0], 3))
+        # Heights are normalized against the true terrain, as a perfect DTM would do.
+        z0 = xyz[:, 2] - ground
+        # Points are shuffled, as in a real acquisition they are not sorted by type.
+        order = rng.permutation(xyz.shape[0])
+        return xyz[order], z0[order]
+
+    def write(self, path: Path, point_format: int = 2, version: str = "1.2") -> None:
+        """Write the plot as a LAS/LAZ file, depending on its extension.
+
+        Parameters
+        ----------
+        path : Path
+            The path of the point cloud.
+        point_format : int
+            The LAS point format.
+        version : str
+            The LAS version.
+
+        """
+        header = laspy.LasHeader(point_format=point_format, version=version)
+        header.add_extra_dim(laspy.ExtraBytesParams(name="Z0", type=np.float64))
+        header.scales = np.array([0.001, 0.001, 0.001])
+        header.offsets = np.array([500000.0, 4700000.0, 0.0])
+        with laspy.open(path, mode="w", header=header) as writer:
+            for chunk_index, start in enumerate(range(0, self.parameters.n_points, CHUNK_SIZE)):
+                xyz, z0 = self._generate_chunk(chunk_index, min(CHUNK_SIZE, self.parameters.n_points - start))
+                points = laspy.ScaleAwarePointRecord.zeros(xyz.shape[0], header=header)
+                points.x = xyz[:, 0] + header.offsets[0]
+                points.y = xyz[:, 1] + header.offsets[1]
+                points.z = xyz[:, 2] + 200.0
+                points["Z0"] = z0
+                writer.write_points(points)
+
+
+def main() -> None:
+    """Generate a synthetic plot from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output", type=Path, help="output LAS or LAZ file")
+    parser.add_argument("--points", type=float, default=1e6, help="number of points (default: 1e6)")
+    parser.add_argument("--stems", type=int, default=30, help="number of trees (default: 30)")
+    parser.add_argument("--dbh_mean", type=float, default=0.3, help="mean DBH in meters (default: 0.3)")
+    parser.add_argument("--dbh_std", type=float, default=0.08, help="DBH standard deviation in meters (default: 0.08)")
+    parser.add_argument("--slope", type=float, default=0.1, help="terrain slope in m/m (default: 0.1)")
+    parser.add_argument("--noise", type=float, default=0.005, help="measurement noise in meters (default: 0.005)")
+    parser.add_argument("--density", type=float, default=None, help="points per m^2, sets the plot size")
+    parser.add_argument("--outliers", type=float, default=0.0, help="fraction of points below the ground")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+    cli_parse = parser.parse_args()
+
+    parameters = PlotParameters(
+        n_points=int(cli_parse.points),
+        n_stems=cli_parse.stems,
+        dbh_mean=cli_parse.dbh_mean,
+        dbh_std=cli_parse.dbh_std,
+        slope=cli_parse.slope,
+        noise=cli_parse.noise,
+        density=cli_parse.density,
+        outlier_fraction=cli_parse.outliers,
+        seed=cli_parse.seed,
+    )
+    SyntheticPlot(parameters).write(cli_parse.output)
+
+
+if __name__ == "__main__":
+    main()
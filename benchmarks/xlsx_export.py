@@ -0,0 +1,146 @@
+"""Benchmark of the XLSX export of the tabular results.
+
+The current export (three_d_fin.processing.io.export_tabular_data, writing the
+sheets row by row with the constant memory mode of xlsxwriter) is compared with
+the former one, which built a pandas DataFrame per sheet and wrote them through
+pandas.ExcelWriter (reproduced below, it requires pandas). Result matrices are
+random, of the size of a large plot. Each export runs in a fresh process, its
+median duration and its peak memory, traced by tracemalloc in a separate run,
+are reported.
+
+Example:
+    python benchmarks/xlsx_export.py --trees 5000 --sections 125 --repeat 3
+
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+
+
+def synthetic_results(n_trees: int, n_sections: int) -> dict[str, np.ndarray]:
+    """Get random results of a plot, as given to export_tabular_data(...)."""
+    rng = np.random.default_rng(0)
+    shape = (n_trees, n_sections)
+    return {
+        "X_c": rng.uniform(500000.0, 500100.0, shape),
+        "Y_c": rng.uniform(4700000.0, 4700100.0, shape),
+        "R": rng.uniform(0.05, 0.4, shape),
+        "check_circle": rng.integers(0, 3, shape).astype(np.float64),
+        "sector_perct": rng.uniform(0.0, 100.0, shape),
+        "n_points_in": rng.integers(0, 10, shape).astype(np.float64),
+        "sections": np.arange(n_sections) * 0.2 + 0.3,
+        "outliers": rng.uniform(0.0, 1.0, shape),
+        "dbh_values": rng.uniform(0.1, 0.8, (n_trees, 1)),
+        "tree_locations": rng.uniform(0.0, 100.0, (n_trees, 3)),
+        "tree_heights": rng.uniform(5.0, 30.0, (n_trees, 5)),
+    }
+
+
+def legacy_export(basepath_output: Path, results: dict[str, np.ndarray]):
+    """Write the XLSX file as the former export did, through pandas DataFrames."""
+    import pandas as pd
+
+    def to_pandas(data):
+        if len(data.shape) == 2:
+            return pd.DataFrame(
+                data=data,
+                index=["T" + str(i + 1) for i in range(data.shape[0])],
+                columns=["S" + str(i + 1) for i in range(data.shape[1])],
+            )
+        df = pd.DataFrame(data=data).transpose()
+        df.index = ["Z0"]
+        df.columns = ["S" + str(i + 1) for i in range(data.shape[0])]
+        return df
+
+    n_trees = results["dbh_values"].shape[0]
+    dbh_and_heights = np.c_[
+        results["tree_heights"][:, 3], results["dbh_values"][:, 0], results["tree_locations"][:, 0:2]
+    ]
+    quality = (results["outliers"] < 0.3).astype(np.float64)
+    frames = {
+        "Diameters": to_pandas(results["R"]) * 2,
+        "X": to_pandas(results["X_c"]),
+        "Y": to_pandas(results["Y_c"]),
+        "Q(Overall Quality 0-1)": to_pandas(quality),
+        "Q1(Outlier Probability)": to_pandas(results["outliers"]),
+        "Q2(Sector Occupancy)": to_pandas(results["sector_perct"]),
+        "Q3(Points Inner Circle)": to_pandas(results["n_points_in"]),
+    }
+    frames["Sections"] = to_pandas(results["sections"])
+    frames["Plot Metrics"] = pd.DataFrame(
+        data=dbh_and_heights,
+        index=["T" + str(i + 1) for i in range(n_trees)],
+        columns=["TH", "DBH", "X", "Y"],
+    )
+    writer = pd.ExcelWriter(str(basepath_output) + ".xlsx", engine="xlsxwriter")
+    for sheet_name in frames:
+        pd.Series("Description").to_excel(writer, sheet_name=sheet_name, header=False, index=False)
+    for sheet_name, df in frames.items():
+        df.to_excel(writer, sheet_name=sheet_name, startrow=2, startcol=1)
+    writer.close()
+
+
+def current_export(basepath_output: Path, results: dict[str, np.ndarray]):
+    """Write the XLSX file with export_tabular_data(...)."""
+    from three_d_fin.processing.configuration import FinConfiguration, MiscParameters
+    from three_d_fin.processing.io import export_tabular_data
+
+    config = FinConfiguration(misc=MiscParameters(export_txt=False))
+    export_tabular_data(config, basepath_output, **results, cloud_size=1.0, cloud_shape=10000)
+
+
+def run_export(exporter: str, n_trees: int, n_sections: int, trace: bool) -> float:
+    """Run an export in the current process.
+
+    Get its duration, or its peak memory if traced (tracing slows the export down).
+    """
+    results = synthetic_results(n_trees, n_sections)
+    export = legacy_export if exporter == "legacy" else current_export
+    with tempfile.TemporaryDirectory() as output_dir:
+        if trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+        export(Path(output_dir) / "plot", results)
+        duration = time.perf_counter() - start
+        if trace:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            return peak
+    return duration
+
+
+def run_in_fresh_process(*args) -> float:
+    """Run an export in a fresh process, so that runs do not share caches or memory."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(run_export, *args).result()
+
+
+def main() -> int:
+    """Run the XLSX export benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trees", type=int, default=5000, help="number of trees (default: 5000)")
+    parser.add_argument("--sections", type=int, default=125, help="number of sections (default: 125)")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs per export (default: 3)")
+    cli_parse = parser.parse_args()
+
+    print(f"{'export':<10}{'time (s)':>12}{'peak (MiB)':>14}")
+    for exporter in ("legacy", "current"):
+        durations = [
+            run_in_fresh_process(exporter, cli_parse.trees, cli_parse.sections, False) for _ in range(cli_parse.repeat)
+        ]
+        peak = run_in_fresh_process(exporter, cli_parse.trees, cli_parse.sections, True)
+        print(f"{exporter:<10}{statistics.median(durations):>12.2f}{peak / 1024**2:>14.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -91,7 +91,9 @@ class CloudComparePluginProcessing(FinProcessing):
     def _get_xyz_from_base(self) -> np.ndarray:
         # TODO(RJ) double conversion is only needed for DTM processing,
         # But maybe it's worth generalizing it.
-        return self.base_cloud.points().astype(np.double)
+        xyz = np.zeros((self.base_cloud.size(), 4))
+        xyz[:, 0:3] = self.base_cloud.points()
+        return xyz
 
     def _export_dtm(self, dtm: np.ndarray):
         cloud_dtm = pycc.ccPointCloud(dtm[:, 0], dtm[:, 1], dtm[:, 2])
@@ -112,19 +114,20 @@ class CloudComparePluginProcessing(FinProcessing):
         self.base_group.addChild(cloud_stripe)
         self.cc_instance.addToDB(cloud_stripe)
 
-    def _enrich_base_cloud(self, assigned_cloud: np.ndarray):
+    def _enrich_base_cloud(self, coords: np.ndarray, tree_id: np.ndarray, dist_axes: np.ndarray):
         copy_base_cloud = pycc.ccPointCloud(self.base_cloud.getName())
         copy_base_cloud.copyGlobalShiftAndScale(self.base_cloud)
         copy_base_cloud.reserve(self.base_cloud.size())
 
         # Could be a pycc.ccPointCloud.clone() but we do not want to clone all SFs
-        copy_base_cloud.addPoints(assigned_cloud[:, 0], assigned_cloud[:, 1], assigned_cloud[:, 2])
+        xyz = self._to_global(coords[:, 0:3])
+        copy_base_cloud.addPoints(xyz[:, 0], xyz[:, 1], xyz[:, 2])
 
-        CloudComparePluginProcessing.write_sf(copy_base_cloud, assigned_cloud[:, 5], "dist_axes")
-        CloudComparePluginProcessing.write_sf(copy_base_cloud, assigned_cloud[:, 4], "tree_ID")
+        CloudComparePluginProcessing.write_sf(copy_base_cloud, dist_axes, "dist_axes")
+        CloudComparePluginProcessing.write_sf(copy_base_cloud, tree_id, "tree_ID")
 
-        # Use assigned_cloud z0 anyway
-        CloudComparePluginProcessing.write_sf(copy_base_cloud, assigned_cloud[:, 3], "Z0")
+        # Use computed z0 anyway
+        CloudComparePluginProcessing.write_sf(copy_base_cloud, coords[:, 3], "Z0")
 
         copy_base_cloud.toggleSF()
         copy_base_cloud.setCurrentDisplayedScalarField(0)  # dist_axes
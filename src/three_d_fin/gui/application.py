@@ -28,6 +28,7 @@ from three_d_fin import __about__
 from three_d_fin.gui.expert_dlg import Ui_Dialog
 from three_d_fin.gui.main_window import Ui_MainWindow
 from three_d_fin.processing.abstract_processing import FinProcessing
+from three_d_fin.processing.cancellation import ProcessingCancelled
 from three_d_fin.processing.configuration import FinConfiguration
 
 
@@ -42,6 +43,7 @@ class ApplicationWorker(QObject):
     finished = pyqtSignal()
     error = pyqtSignal(str, str)
     memory_error = pyqtSignal()
+    cancelled = pyqtSignal()
 
     def __init__(self, processing_object: FinProcessing, parent=None):
         """Construct the Worker.
@@ -69,6 +71,8 @@ class ApplicationWorker(QObject):
         """
         try:
             self.processing_object.process()
+        except ProcessingCancelled:
+            self.cancelled.emit()
         except MemoryError:
             self.memory_error.emit()
         except Exception as e:
@@ -101,6 +105,9 @@ class Application(QMainWindow):
 
     cloud_fields: Optional[list[str]]
 
+    # Whether a processing is running, the compute button then cancels it.
+    computing: bool = False
+
     def __init__(
         self,
         processing_object: FinProcessing,
@@ -155,7 +162,7 @@ class Application(QMainWindow):
         # Click on "output dir" button
         self.ui.output_dir_btn.clicked.connect(self._ask_output_dir)
 
-        # Click on compute button
+        # Click on compute button, or cancel button while computing
         self.ui.compute_btn.clicked.connect(self._compute_clicked)
 
         # Connect is_normalized check signal
@@ -227,6 +234,9 @@ class Application(QMainWindow):
                     self.ui.export_txt_rb_1.setChecked(value_param)
                     self.ui.export_txt_rb_2.setChecked(not value_param)
                     self.ui.export_txt_lbl.setToolTip(tooltip_text)
+                elif not hasattr(self.ui, key_param + "_in"):
+                    # Parameters without widget (e.g. tiling) are not exposed in the GUI.
+                    continue
                 else:  # regular "numeric" QTextEdit live here.
                     input_field = getattr(self.ui, key_param + "_in")
                     input_field.setText(str(value_param))
@@ -368,13 +378,20 @@ class Application(QMainWindow):
                     category_dict[key_param] = self.ui.is_noisy_chk.isChecked()
                 elif key_param == "export_txt":
                     category_dict[key_param] = self.ui.export_txt_rb_1.isChecked()
+                elif not hasattr(self.ui, key_param + "_in"):
+                    # Parameters without widget keep their current value.
+                    category_dict[key_param] = getattr(getattr(self.processing_object.config, category_name), key_param)
                 else:
                     category_dict[key_param] = getattr(self.ui, key_param + "_in").text()
             config_dict[category_name] = category_dict
         return config_dict
 
     def _compute_clicked(self) -> None:
-        """Validate I/O entries and run the processing callback."""
+        """Validate I/O entries and run the processing callback, or cancel the running one."""
+        if self.computing:
+            self._cancel_processing()
+            return
+
         params = self._get_parameters()
 
         # Define a local function in order to popup errors.
@@ -412,14 +429,20 @@ class Application(QMainWindow):
                 return
 
         # Handle changes in the GUI when compute is launched/finished
-        def _disable_btn() -> None:
-            self.ui.compute_btn.setDisabled(True)
-            self.ui.compute_btn.setText("Computing...")
+        def _set_cancel_btn() -> None:
+            self.computing = True
+            self.ui.compute_btn.setText("Cancel")
 
         def _enable_btn() -> None:
+            self.computing = False
             self.ui.compute_btn.setDisabled(False)
             self.ui.compute_btn.setText("Compute")
 
+        def _cancelled_handling() -> None:
+            QMessageBox.information(
+                self, "3DFin", "The computation was cancelled, the outputs written so far may be incomplete."
+            )
+
         def _memory_error_handling():
             _enable_btn()
             msg_box = QMessageBox(self)
@@ -452,7 +475,8 @@ class Application(QMainWindow):
 
         # Now we do the processing in itself
         self.thread = QThread()
-        _disable_btn()
+        _set_cancel_btn()
+        self.processing_object.cancellation.reset()
         # Pre processing hook is called from the main thread
         self.processing_object._pre_processing_hook()
         # Create a worker object
@@ -469,10 +493,21 @@ class Application(QMainWindow):
         self.worker.finished.connect(_enable_btn)
         self.worker.error.connect(_error_handling)
         self.worker.memory_error.connect(_memory_error_handling)
+        self.worker.cancelled.connect(_cancelled_handling)
         self.thread.finished.connect(self.thread.deleteLater)
 
         self.thread.start()
 
+    def _cancel_processing(self) -> None:
+        """Request the cancellation of the running processing.
+
+        The processing stops in its thread at the start of its next stage, the
+        compute button is enabled again once it is stopped.
+        """
+        self.processing_object.cancel()
+        self.ui.compute_btn.setDisabled(True)
+        self.ui.compute_btn.setText("Cancelling...")
+
     def _normalize_toggled(self) -> None:
         """Handle the 'is_normalized' checkbox toggle event."""
         self.ui.is_noisy_chk.setEnabled(self.ui.is_normalized_chk.isChecked())
@@ -496,7 +531,8 @@ class Application(QMainWindow):
     def closeEvent(self, a0: QCloseEvent) -> None:
         """Close the application.
 
-        The event loop is exited if it was previously set.
+        The running processing, if any, is cancelled. The event loop is exited if
+        it was previously set.
 
         Parameters
         ----------
@@ -504,6 +540,9 @@ class Application(QMainWindow):
             The close event
 
         """
+        # Do not leave a processing running without any window to follow it.
+        if self.computing:
+            self.processing_object.cancel()
         super().closeEvent(a0)
         if self.event_loop is not None:
             self.event_loop.quit()
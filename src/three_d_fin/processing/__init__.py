@@ -3,9 +3,13 @@ import configparser
 import os
 import sys
 from pathlib import Path
+from typing import TYPE_CHECKING, Optional
 
 from pydantic.v1 import ValidationError
 
+if TYPE_CHECKING:
+    from three_d_fin.processing.configuration import FinConfiguration
+
 
 def launch_application() -> int:
     """Parse the command line and launch the GUI or the CLI application.
@@ -22,15 +26,9 @@ def launch_application() -> int:
         POSIX minimal exit code (0 = SUCCESS, 1 = ERROR)
 
     """
-    import laspy
-    import pydantic
-    from PyQt5 import QtCore
-    from PyQt5.QtWidgets import QApplication
-
+    # Heavy modules (Qt, dendromatics, pandas...) are only imported by the code paths
+    # using them, so the CLI starts fast and runs without a Qt install able to open a display.
     from three_d_fin import __about__
-    from three_d_fin.gui.application import Application
-    from three_d_fin.processing.configuration import FinConfiguration, MiscParameters
-    from three_d_fin.processing.standalone_processing import StandaloneLASProcessing
 
     EXIT_ERROR = 1
     EXIT_SUCCESS = 0
@@ -45,24 +43,161 @@ def launch_application() -> int:
     )
     parser.add_argument("--version", "-v", action="version", version=__about__.__version__)
 
+    # Options shared by the cli and batch subcommands
+    processing_parser = argparse.ArgumentParser(add_help=False)
+    processing_parser.add_argument(
+        "--export_txt",
+        action="store_true",
+        help="Export tabular data in ASCII (space separated) files instead of XLSX",
+    )
+    processing_parser.add_argument("--normalize", action="store_true", help="Normalize the data with CSF algorithm")
+    processing_parser.add_argument(
+        "--denoise",
+        action="store_true",
+        help="Denoise the data, if outliers below ground level are expected",
+    )
+    processing_parser.add_argument(
+        "--dtm",
+        default=None,
+        help="DTM used to normalize the data instead of generating it, either the _dtm.npy file of a previous "
+        "run (the data is then normalized exactly as in that run), a Las or Laz file or an ESRI ASCII grid "
+        "(.asc). Requires --normalize",
+    )
+    processing_parser.add_argument(
+        "--tile_size",
+        type=float,
+        default=None,
+        help="process the cloud by square tiles of this size (in meters), for clouds that do not fit in memory",
+    )
+    processing_parser.add_argument(
+        "--tile_buffer",
+        type=float,
+        default=15.0,
+        help="overlap added around each tile in meters (default: 15)",
+    )
+    processing_parser.add_argument(
+        "--windowed",
+        action="store_true",
+        help="load at full resolution only the points below the stripe and the highest section, "
+        "the points above them (e.g. crowns) are thinned. Cannot be used along with --normalize",
+    )
+    processing_parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="process the coordinates in single precision relative to a local origin, which lowers the memory usage. "
+        "Heights are normalized in double precision, the rest of the algorithm is approximate",
+    )
+    processing_parser.add_argument(
+        "--memory_budget",
+        type=int,
+        default=None,
+        help="memory the processing is allowed to use in MiB (default: memory available on the machine)",
+    )
+    processing_parser.add_argument(
+        "--memory_strategy",
+        choices=("adapt", "approximate", "refuse", "off"),
+        default="adapt",
+        help="when the estimated peak memory exceeds the budget, either switch to windowed loading (adapt), also "
+        "switch to compact coordinates then tiles, which change the results marginally (approximate), refuse to "
+        "process the cloud or ignore the estimation (default: adapt)",
+    )
+    processing_parser.add_argument(
+        "--laz_threads",
+        type=int,
+        default=None,
+        help="number of threads used to decompress and compress LAZ files with the lazrs backend, "
+        "in parallel if greater than 1 (default: backend selected by laspy)",
+    )
+    processing_parser.add_argument(
+        "--individualization_workers",
+        type=int,
+        default=1,
+        help="number of processes assigning the points to the tree axes in parallel, by blocks of the plot "
+        "(default: 1)",
+    )
+    processing_parser.add_argument(
+        "--section_workers",
+        type=int,
+        default=1,
+        help="number of processes fitting the sections of the trees in parallel (default: 1)",
+    )
+    processing_parser.add_argument(
+        "--output_laz",
+        action="store_true",
+        help="write the point cloud outputs as LAZ files instead of LAS files",
+    )
+    processing_parser.add_argument(
+        "--txt_precision",
+        type=int,
+        default=3,
+        help="number of digits after the decimal point in the txt outputs (default: 3)",
+    )
+    processing_parser.add_argument(
+        "--export_npz",
+        action="store_true",
+        help="also write the results as named arrays in a _results.npz file",
+    )
+    processing_parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="write the time, memory and number of points of each stage in a _timings.jsonl file",
+    )
+    processing_parser.add_argument(
+        "--cache_dir",
+        default=None,
+        help="directory where intermediate results are cached, so a run with different parameters "
+        "only recomputes the stages depending on them",
+    )
+    processing_parser.add_argument(
+        "--checkpoints",
+        action="store_true",
+        help="write a checkpoint after each stage in a _checkpoints directory next to the outputs, "
+        "removed once the run completes",
+    )
+    processing_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue an interrupted run from its checkpoints, for the same input and parameters",
+    )
+    processing_parser.add_argument("--version", "-v", action="version", version=__about__.__version__)
+
     # Create a subparser for cli subcommand
     subparsers = parser.add_subparsers(dest="subcommand")
-    cli_subparser = subparsers.add_parser("cli", help="launch the app in command line mode")
+    cli_subparser = subparsers.add_parser(
+        "cli", parents=[processing_parser], help="launch the app in command line mode"
+    )
     cli_subparser.add_argument("input_file", help="Las or Laz input file")
     cli_subparser.add_argument("output_directory", help="output directory where to put the results")
     cli_subparser.add_argument("params_file", help=".ini files with parameters")
     cli_subparser.add_argument(
-        "--export_txt",
+        "--tail",
         action="store_true",
-        help="Export tabular data in ASCII (space separated) files instead of XLSX",
+        help="only export the results again if a previous run cached in --cache_dir differs by export parameters, "
+        "otherwise run the whole algorithm",
     )
-    cli_subparser.add_argument("--normalize", action="store_true", help="Normalize the data with CSF algorithm")
-    cli_subparser.add_argument(
-        "--denoise",
-        action="store_true",
-        help="Denoise the data, if outliers below ground level are expected",
+
+    # Create a subparser for batch subcommand
+    batch_subparser = subparsers.add_parser(
+        "batch", parents=[processing_parser], help="process several plots in parallel in command line mode"
+    )
+    batch_subparser.add_argument(
+        "input", help="directory, glob pattern (quoted) or manifest file (one Las or Laz file per line)"
+    )
+    batch_subparser.add_argument("output_directory", help="output directory where to put the results")
+    batch_subparser.add_argument("params_file", help=".ini files with parameters, shared by all plots")
+    batch_subparser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of plots processed simultaneously (default: number of CPUs)",
+    )
+    batch_subparser.add_argument(
+        "--max_memory",
+        type=int,
+        default=None,
+        help="address space limit of each worker in MiB, which also counts the memory mapped but not resident, "
+        "so it should be set above the memory a plot actually uses. Not enforced on Windows (default: no limit)",
     )
-    cli_subparser.add_argument("--version", "-v", action="version", version=__about__.__version__)
 
     cli_parse = parser.parse_args()
 
@@ -70,9 +205,16 @@ def launch_application() -> int:
     print(__about__.__copyright_info_2__)
     print(__about__.__license_msg__)
 
-    fin_processing = StandaloneLASProcessing(FinConfiguration())
     # No subcommand, launch the GUI
     if cli_parse.subcommand is None:
+        from PyQt5 import QtCore
+        from PyQt5.QtWidgets import QApplication
+
+        from three_d_fin.gui.application import Application
+        from three_d_fin.processing.configuration import FinConfiguration
+        from three_d_fin.processing.standalone_processing import StandaloneLASProcessing
+
+        fin_processing = StandaloneLASProcessing(FinConfiguration())
         # for legacy purpose we look for a configuration file on the cwd
         try:
             config_file_path = Path("3DFinconfig.ini")
@@ -98,30 +240,35 @@ def launch_application() -> int:
 
     # Else, the CLI case
     # First, we read the param file and sanitize the input
-    config_path = Path(cli_parse.params_file)
-    if not config_path.exists() or not config_path.is_file():
-        print("Parameters: File does not exist")
+    valid_params = _read_params_file(Path(cli_parse.params_file))
+    if valid_params is None:
         return EXIT_ERROR
 
-    try:
-        valid_params = FinConfiguration.From_config_file(config_path)
-    except pydantic.ValidationError as v:
-        print(repr(v))  # TODO: minimal display for now
-    except configparser.ParsingError:
-        print("Parameters: invalid .ini file")
+    if cli_parse.dtm is not None and not cli_parse.normalize:
+        print("Parameters: --dtm is only used along with --normalize")
         return EXIT_ERROR
-    except configparser.NoOptionError as error:
-        print(f"Parameters: invalid option '{error.option}' in section '{error.section}'")
+
+    if cli_parse.windowed and cli_parse.normalize:
+        print("Parameters: --windowed requires an already normalized cloud, it cannot be used along with --normalize")
         return EXIT_ERROR
-    except ValueError as error:
-        print(f"Parameters: {error.args[0]}")
+
+    if cli_parse.subcommand == "cli" and cli_parse.tail and cli_parse.cache_dir is None:
+        print("Parameters: --tail requires --cache_dir")
         return EXIT_ERROR
 
+    if cli_parse.subcommand == "batch":
+        if not _check_output_directory(Path(cli_parse.output_directory)):
+            print("Invalid output directory")
+            return EXIT_ERROR
+        return _launch_batch(cli_parse, valid_params)
+
     # Second, we check the validity of the las file
     input_las = Path(cli_parse.input_file)
     if not input_las.exists() or not input_las.is_file():
         print("Input file: file does not exists")
         return EXIT_ERROR
+    import laspy
+
     try:
         laspy.open(input_las, read_evlrs=False)
     except laspy.LaspyException:
@@ -129,33 +276,181 @@ def launch_application() -> int:
         return EXIT_ERROR
 
     # At last, We check the validity of the current output directory
-    output_dir = Path(cli_parse.output_directory)
-    if (
-        not output_dir.exists()
-        or not output_dir.is_dir()
-        or not os.access(
-            output_dir, os.W_OK
-        )  # os.access won't work very well on Windows, we may still have to mess with exceptions
-    ):
+    if not _check_output_directory(Path(cli_parse.output_directory)):
         print("Invalid output directory")
         return EXIT_ERROR
 
+    try:
+        plot_params = _plot_params(cli_parse, valid_params, input_las)
+    except ValidationError as v:
+        print(repr(v))  # TODO: minimal display for now
+        return EXIT_ERROR
+
+    # Run processing
+    from three_d_fin.processing.standalone_processing import StandaloneLASProcessing
+
+    fin_processing = StandaloneLASProcessing(plot_params)
+    if not cli_parse.tail or not fin_processing.process_tail():
+        fin_processing.process()
+    return EXIT_SUCCESS
+
+
+def _read_params_file(config_path: Path) -> Optional["FinConfiguration"]:
+    """Read and validate a parameters file, reporting errors on the console.
+
+    Parameters
+    ----------
+    config_path : Path
+        Path to the .ini parameters file.
+
+    Returns
+    -------
+    config : Optional[FinConfiguration]
+        The validated configuration, None if the file is missing or invalid.
+
+    """
+    import pydantic
+
+    from three_d_fin.processing.configuration import FinConfiguration
+
+    if not config_path.exists() or not config_path.is_file():
+        print("Parameters: File does not exist")
+        return None
+
+    try:
+        return FinConfiguration.From_config_file(config_path)
+    except pydantic.ValidationError as v:
+        print(repr(v))  # TODO: minimal display for now
+    except configparser.ParsingError:
+        print("Parameters: invalid .ini file")
+    except configparser.NoOptionError as error:
+        print(f"Parameters: invalid option '{error.option}' in section '{error.section}'")
+    except ValueError as error:
+        print(f"Parameters: {error.args[0]}")
+    return None
+
+
+def _check_output_directory(output_dir: Path) -> bool:
+    """Check that the output directory exists and is writable.
+
+    Parameters
+    ----------
+    output_dir : Path
+        The output directory.
+
+    Returns
+    -------
+    valid : bool
+        True if the results could be written in the directory.
+
+    """
+    # os.access won't work very well on Windows, we may still have to mess with exceptions
+    return output_dir.exists() and output_dir.is_dir() and os.access(output_dir, os.W_OK)
+
+
+def _plot_params(
+    cli_parse: argparse.Namespace, valid_params: "FinConfiguration", input_file: Path
+) -> "FinConfiguration":
+    """Build the configuration of a single plot from the command line arguments.
+
+    Parameters
+    ----------
+    cli_parse : argparse.Namespace
+        The parsed command line.
+    valid_params : FinConfiguration
+        The configuration read from the parameters file.
+    input_file : Path
+        The point cloud to process.
+
+    Returns
+    -------
+    config : FinConfiguration
+        The configuration with its misc section filled from the command line.
+
+    """
+    from three_d_fin.processing.configuration import FinConfiguration, MiscParameters
+
     # Wrap all in the misc section
     misc = MiscParameters(
         is_normalized=not cli_parse.normalize,
         is_noisy=cli_parse.denoise,
         export_txt=cli_parse.export_txt,
-        input_file=cli_parse.input_file,
+        txt_precision=cli_parse.txt_precision,
+        input_file=input_file,
         output_dir=cli_parse.output_directory,
+        dtm_file=cli_parse.dtm,
+        cache_dir=cli_parse.cache_dir,
+        tile_size=cli_parse.tile_size,
+        tile_buffer=cli_parse.tile_buffer,
+        windowed_loading=cli_parse.windowed,
+        compact_coordinates=cli_parse.compact,
+        laz_threads=cli_parse.laz_threads,
+        individualization_workers=cli_parse.individualization_workers,
+        section_workers=cli_parse.section_workers,
+        output_laz=cli_parse.output_laz,
+        export_timings=cli_parse.timings,
+        export_npz=cli_parse.export_npz,
+        memory_budget=cli_parse.memory_budget,
+        memory_strategy=cli_parse.memory_strategy,
+        checkpoints="resume" if cli_parse.resume else "on" if cli_parse.checkpoints else "off",
     )
     # Seems akward but we do not to enforce mutability on parameter for now
-    final_params: FinConfiguration = FinConfiguration(
+    return FinConfiguration(
         basic=valid_params.basic,
         advanced=valid_params.advanced,
         expert=valid_params.expert,
         misc=misc,
     )
-    # Run processing
-    fin_processing.set_config(final_params)
-    fin_processing.process()
-    return EXIT_SUCCESS
+
+
+def _launch_batch(cli_parse: argparse.Namespace, valid_params: "FinConfiguration") -> int:
+    """Run the batch subcommand.
+
+    Parameters
+    ----------
+    cli_parse : argparse.Namespace
+        The parsed command line.
+    valid_params : FinConfiguration
+        The configuration read from the parameters file, shared by all plots.
+
+    Returns
+    -------
+    exit_code : int
+        POSIX minimal exit code (0 = SUCCESS, 1 = ERROR)
+
+    """
+    from three_d_fin.processing.batch import collect_input_files, run_batch
+
+    EXIT_ERROR = 1
+    EXIT_SUCCESS = 0
+
+    input_files = collect_input_files(cli_parse.input)
+    if len(input_files) == 0:
+        print("Input: no las/laz file found")
+        return EXIT_ERROR
+
+    # Outputs are named after the input file, two plots with the same name would overwrite each other.
+    stems = [input_file.stem for input_file in input_files]
+    duplicates = sorted({stem for stem in stems if stems.count(stem) > 1})
+    if len(duplicates) > 0:
+        print(f"Input: several plots share the same name, their outputs would collide: {', '.join(duplicates)}")
+        return EXIT_ERROR
+
+    configs = []
+    errors = {}
+    for input_file in input_files:
+        try:
+            configs.append(_plot_params(cli_parse, valid_params, input_file))
+        except ValidationError as error:
+            errors[input_file] = str(error)
+            print(f"{input_file}: skipped (invalid parameters)")
+
+    n_workers = cli_parse.workers if cli_parse.workers is not None else os.cpu_count()
+    print(f"Processing {len(configs)} plots with {n_workers} workers")
+    errors.update(run_batch(configs, n_workers, cli_parse.max_memory))
+
+    failed = [input_file for input_file, error in errors.items() if error is not None]
+    print(f"{len(errors) - len(failed)}/{len(errors)} plots successfully processed")
+    for input_file in failed:
+        print(f"    {input_file}: {errors[input_file]}")
+    return EXIT_ERROR if len(failed) > 0 else EXIT_SUCCESS
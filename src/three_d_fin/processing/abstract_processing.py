@@ -1,14 +1,129 @@
+import shutil
 import timeit
 from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any
+from typing import Any, Optional
 
 import numpy as np
 
-import dendromatics as dm
+from three_d_fin.processing.cache import StageCache, array_digest
+from three_d_fin.processing.cancellation import CancellationToken, ProcessingCancelled
 from three_d_fin.processing.configuration import FinConfiguration
-from three_d_fin.processing.io import export_tabular_data
+from three_d_fin.processing.ground import lowest_points
+from three_d_fin.processing.individualization import compute_axes
+from three_d_fin.processing.instrumentation import Instrumentation, JSONLinesSink
+from three_d_fin.processing.io import export_tabular_data, load_dtm
+from three_d_fin.processing.memory import (
+    CloudSummary,
+    MemoryBudgetError,
+    MemoryEstimate,
+    available_memory,
+    estimate_memory,
+    fit_tile_size,
+)
 from three_d_fin.processing.progress import Progress
+from three_d_fin.processing.sections import compute_sections, gather_stems
+
+# Number of points normalized at once.
+NORMALIZATION_CHUNK_SIZE = 1_000_000
+
+# Parameters that do not change the per-tree results: they only affect the drawing of the
+# circles and of the axes, or how and where the outputs are written, see FinProcessing.process_tail(...).
+TAIL_PARAMETERS = {
+    "expert": ("circa", "p_interval", "axis_downstep", "axis_upstep"),
+    "misc": (
+        "export_txt",
+        "txt_precision",
+        "export_npz",
+        "cache_dir",
+        "laz_threads",
+        "individualization_workers",
+        "section_workers",
+        "output_laz",
+        "export_timings",
+        "memory_budget",
+        "memory_strategy",
+        "checkpoints",
+    ),
+}
+
+
+class NoTreeError(ValueError):
+    """Raised when no stem is found in the stripe, e.g. in a clearing."""
+
+
+def _voxelate_columns(
+    coords: np.ndarray, resolution_xy: float, resolution_z: float, n_digits: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Voxelate a point cloud column by column.
+
+    Voxels and indexes are the same as the ones of dendromatics.voxelate(...)
+    with with_n_points=False, but the coordinates are converted to double precision
+    one column at a time instead of requiring a double precision copy of the cloud,
+    and the indexes from the voxels to the points are not computed.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        The point cloud, (x), (y), (z) coordinates are stored in the first,
+        second, third columns respectively. Either float32 or float64.
+    resolution_xy : float
+        (x, y) voxel resolution.
+    resolution_z : float
+        (z) voxel resolution.
+    n_digits : int
+        Number of digits dedicated to each coordinate in the voxel codes.
+
+    Returns
+    -------
+    voxelated_cloud : np.ndarray
+        The (x), (y), (z) coordinates of the voxel centers.
+    vox_to_cloud_ind : np.ndarray
+        The index of the voxel of each point.
+
+    """
+    cloud_min = coords[:, 0:3].min(axis=0).astype(np.float64)
+    # Same operations, in the same order, as dendromatics.voxelate to get the exact same codes.
+    code = np.zeros(coords.shape[0])
+    for column, resolution, factor in (
+        (2, resolution_z, 10 ** (n_digits * 2)),
+        (1, resolution_xy, 10**n_digits),
+        (0, resolution_xy, 1),
+    ):
+        column_code = coords[:, column].astype(np.float64)
+        column_code -= cloud_min[column]
+        column_code /= resolution
+        np.floor(column_code, out=column_code)
+        column_code *= factor
+        code += column_code
+        del column_code
+    unique_code, vox_to_cloud_ind = np.unique(code, return_inverse=True)
+    del code
+
+    z_code = np.floor(unique_code / 10 ** (n_digits * 2))
+    y_code = np.floor((unique_code - z_code * 10 ** (n_digits * 2)) / 10**n_digits)
+    x_code = unique_code - z_code * 10 ** (n_digits * 2) - y_code * 10**n_digits
+    voxelated_cloud = np.empty((unique_code.shape[0], 3))
+    voxelated_cloud[:, 0] = x_code * resolution_xy + cloud_min[0] + resolution_xy / 2
+    voxelated_cloud[:, 1] = y_code * resolution_xy + cloud_min[1] + resolution_xy / 2
+    voxelated_cloud[:, 2] = z_code * resolution_z + cloud_min[2] + resolution_z / 2
+    return voxelated_cloud, vox_to_cloud_ind
+
+
+def _execution_mode(config: FinConfiguration) -> str:
+    """Describe the lower memory executions enabled in the configuration, see FinProcessing.preflight()."""
+    misc = config.misc
+    mode = []
+    if misc.windowed_loading and misc.is_normalized and misc.tile_size is None:
+        mode.append("windowed loading")
+    if misc.compact_coordinates:
+        mode.append("compact coordinates")
+    if misc.tile_size is not None:
+        mode.append(f"tiles of {misc.tile_size:g} m")
+    return ", ".join(mode) if mode else "default"
 
 
 class FinProcessing(ABC):
@@ -20,6 +135,11 @@ class FinProcessing(ABC):
 
     progress: Progress = Progress()
 
+    instrumentation: Instrumentation
+
+    # Checked at the start of each stage and at each progress update, see cancel().
+    cancellation: CancellationToken
+
     config: FinConfiguration
 
     base_cloud: Any
@@ -30,6 +150,20 @@ class FinProcessing(ABC):
 
     area_warning: bool = False
 
+    # Local origin of the plot subtracted from the coordinates in compact mode, see
+    # the compact_coordinates misc parameter. None if coordinates are not compacted.
+    origin: Optional[np.ndarray] = None
+
+    # Number of threads running the exports while the algorithm goes on, exports are
+    # run synchronously if 0 (e.g. if the outputs can only be created from the main thread).
+    export_workers: int = 0
+
+    _export_executor: Optional[ThreadPoolExecutor] = None
+
+    _export_futures: list[Future]
+
+    _timings_sink: Optional[JSONLinesSink] = None
+
     def __init__(self, config: FinConfiguration) -> None:
         """Init the FinProcessing object.
 
@@ -39,8 +173,43 @@ class FinProcessing(ABC):
             Self explanatory, the 3DFin configuration.
 
         """
+        self.instrumentation = Instrumentation()
+        self.set_cancellation_token(CancellationToken())
         self.set_config(config)
 
+    def set_cancellation_token(self, token: CancellationToken) -> None:
+        """Set the token checked by the processing to know if it must stop.
+
+        Parameters
+        ----------
+        token : CancellationToken
+            The token, it could be shared with other processings (e.g. the tiles
+            of a tiled processing).
+
+        """
+        if getattr(self, "cancellation", None) is not None:
+            self.instrumentation.remove_sink(self.cancellation)
+        self.cancellation = token
+        self.instrumentation.add_sink(token)
+
+    def cancel(self) -> None:
+        """Request the cancellation of the running processing.
+
+        It can be called from any thread. The processing stops at the start of its
+        next stage, or at the next progress update of the individualization and of
+        the computation of the sections, with a ProcessingCancelled exception. The
+        token must be reset before the next run, see CancellationToken.reset().
+        """
+        self.cancellation.cancel()
+
+    def _progress_hook(self, count: int = 1, total: int = 1) -> None:
+        """Update the progress bar, stop the processing if it was cancelled.
+
+        It is given to dendromatics functions taking a progress hook.
+        """
+        self.cancellation.check()
+        self.progress.update(count, total)
+
     def set_config(self, config: FinConfiguration) -> None:
         """Set the configuration.
 
@@ -132,18 +301,473 @@ class FinProcessing(ABC):
 
     @abstractmethod
     def _get_xyz_from_base(self) -> np.ndarray:
-        """Extract the x, y, z and z0 coordinates from the base_cloud.
+        """Extract the x, y, z coordinates from the base_cloud.
 
         Returns
         -------
         xyz : np.ndarray
-            A numpy array of shape (n, 3) where n is the number of points in the
-            cloud. (x), (y), (z) coordinates are stored in the first, second,
-            third columns respectively.
+            A float64 numpy array of shape (n, 4) where n is the number of points
+            in the cloud. (x), (y), (z) coordinates are stored in the first, second,
+            third columns respectively. The fourth column is filled with zeros, it
+            is where the normalized heights are computed in place, so that the
+            cloud is never copied to add them.
 
         """
         pass
 
+    def _normalize_heights(self, coords: np.ndarray, dtm: np.ndarray) -> None:
+        """Compute the normalized heights of the points in place.
+
+        Heights are computed chunk by chunk so that the temporary arrays of the
+        DTM neighbours search stay small compared to the cloud.
+
+        Parameters
+        ----------
+        coords : np.ndarray
+            The coordinates extracted by _get_xyz_from_base(...), normalized
+            heights are written in the fourth column.
+        dtm : np.ndarray
+            The (x), (y), (z) coordinates of the DTM points.
+
+        """
+        import dendromatics as dm
+
+        for start in range(0, coords.shape[0], NORMALIZATION_CHUNK_SIZE):
+            chunk = coords[start : start + NORMALIZATION_CHUNK_SIZE]
+            chunk[:, 3] = dm.normalize_heights(chunk, dtm)
+
+    def _reduce_ground(self, points: np.ndarray) -> np.ndarray:
+        """Get the points given to the cloth simulation.
+
+        If the ground_reduction expert parameter is not 0, only the lowest point of
+        each (x, y) cell is kept (see ground.lowest_points(...)), the size of the
+        cells being ground_reduction times the cloth resolution.
+
+        Parameters
+        ----------
+        points : np.ndarray
+            The points, with (x), (y), (z) coordinates in the first three columns.
+
+        Returns
+        -------
+        ground_points : np.ndarray
+            The (x), (y), (z) coordinates of the points given to the cloth simulation.
+
+        """
+        ratio = self.config.expert.ground_reduction
+        if ratio == 0:
+            return points[:, 0:3]
+        ground_points = lowest_points(points, ratio * self.config.basic.res_cloth)
+        print("   Ground reduced to", ground_points.shape[0], "points")
+        return ground_points
+
+    def _to_compact(self, coords: np.ndarray) -> np.ndarray:
+        """Convert the coordinates extracted from the base cloud to compact coordinates.
+
+        The origin attribute is set to the floored minimum of the (x), (y), (z)
+        coordinates, it is subtracted from them and every column is converted to
+        float32. Columns are converted one at a time so that the conversion only
+        needs the memory of the compact array.
+
+        Parameters
+        ----------
+        coords : np.ndarray
+            The coordinates extracted from the base cloud, either by
+            _get_xyz_z0_from_base(...) or by _get_xyz_from_base(...).
+
+        Returns
+        -------
+        compact_coords : np.ndarray
+            The float32 coordinates relative to the origin.
+
+        """
+        self.origin = np.floor(coords[:, 0:3].min(axis=0))
+        compact_coords = np.empty(coords.shape, dtype=np.float32)
+        for column in range(coords.shape[1]):
+            offset = self.origin[column] if column < 3 else 0.0
+            compact_coords[:, column] = coords[:, column] - offset
+        return compact_coords
+
+    def _to_global(self, points: np.ndarray, first_column: int = 0) -> np.ndarray:
+        """Restore the coordinates of the input cloud in an array of points computed in compact mode.
+
+        Parameters
+        ----------
+        points : np.ndarray
+            The points, their (x), (y), (z) coordinates are stored in three consecutive columns.
+        first_column : int
+            The column of the (x) coordinates.
+
+        Returns
+        -------
+        points : np.ndarray
+            A float64 copy of the points with the origin added to their coordinates,
+            or the points themselves if coordinates are not compacted.
+
+        """
+        if self.origin is None:
+            return points
+        points = points.astype(np.float64)
+        points[:, first_column : first_column + 3] += self.origin
+        return points
+
+    def _submit_export(self, export: Callable[..., Any], *args: Any) -> None:
+        """Submit an export to the export threads, or run it if exports are synchronous.
+
+        Exports are independent from each other and from the following stages of the
+        algorithm, they are mostly bound by I/O and compression. The arrays given to
+        an export must not be modified afterward.
+
+        Parameters
+        ----------
+        export : Callable[..., Any]
+            The export method.
+        *args : Any
+            The arguments of the export method.
+
+        """
+        if self.export_workers == 0:
+            self._run_export(export, *args)
+            return
+        if self._export_executor is None:
+            self._export_executor = ThreadPoolExecutor(
+                max_workers=self.export_workers, thread_name_prefix="3DFin_export"
+            )
+            self._export_futures = []
+        self._export_futures.append(self._export_executor.submit(self._run_export, export, *args))
+
+    def _run_export(self, export: Callable[..., Any], *args: Any) -> None:
+        """Run an export as an instrumented stage named after the export method."""
+        stage = export.__name__.lstrip("_")
+        self.instrumentation.start(stage)
+        export(*args)
+        self.instrumentation.end(stage)
+
+    def _discard_exports(self) -> None:
+        """Cancel the exports which are not started yet and wait for the running ones.
+
+        It is used when the processing is interrupted, outputs may thus be incomplete.
+        """
+        if self._export_executor is None:
+            return
+        executor = self._export_executor
+        self._export_executor, self._export_futures = None, []
+        executor.shutdown(cancel_futures=True)
+
+    def _wait_for_exports(self) -> None:
+        """Wait for the submitted exports to complete.
+
+        Any exception raised by an export is raised again here.
+        """
+        if self._export_executor is None:
+            return
+        executor, futures = self._export_executor, self._export_futures
+        self._export_executor, self._export_futures = None, []
+        try:
+            for future in futures:
+                future.result()
+        finally:
+            executor.shutdown()
+
+    def _set_timings_sink(self) -> None:
+        """Set the sink writing the stage measures of the run in the _timings.jsonl file, if requested."""
+        if self._timings_sink is not None:
+            self.instrumentation.remove_sink(self._timings_sink)
+            self._timings_sink = None
+        if self.config.misc is not None and self.config.misc.export_timings:
+            self._timings_sink = JSONLinesSink(Path(str(self.output_basepath) + "_timings.jsonl"))
+            self.instrumentation.add_sink(self._timings_sink)
+
+    def _compute_input_digest(self, coords: np.ndarray) -> str:
+        """Compute a content hash of the input point cloud.
+
+        It is used to key the stage cache. Default implementation hashes the
+        coordinates extracted from the base cloud, implementers could override it
+        with a cheaper way to identify the input (e.g. a file hash).
+
+        Parameters
+        ----------
+        coords : np.ndarray
+            The coordinates extracted from the base cloud, either by
+            _get_xyz_z0_from_base(...) or by _get_xyz_from_base(...).
+
+        Returns
+        -------
+        digest : str
+            Hexadecimal digest of the input point cloud.
+
+        """
+        return array_digest(coords)
+
+    def _get_point_count(self, coords: np.ndarray) -> int:
+        """Get the number of points of the input point cloud.
+
+        Default implementation counts the coordinates extracted from the base cloud,
+        implementers that do not extract every point (e.g. a thinned cloud) should
+        override it.
+
+        Parameters
+        ----------
+        coords : np.ndarray
+            The coordinates extracted from the base cloud, either by
+            _get_xyz_z0_from_base(...) or by _get_xyz_from_base(...).
+
+        Returns
+        -------
+        point_count : int
+            The number of points of the input point cloud.
+
+        """
+        return coords.shape[0]
+
+    def _checkpoint_dir(self) -> Optional[Path]:
+        """Get the directory of the checkpoints of the run.
+
+        Returns
+        -------
+        checkpoint_dir : Optional[Path]
+            The directory, None if checkpoints are disabled or if the stage cache
+            directory is set, the stage cache holding the checkpoints in this case.
+
+        """
+        misc = self.config.misc
+        if misc is None or misc.checkpoints == "off" or misc.cache_dir is not None:
+            return None
+        return Path(str(self.output_basepath) + "_checkpoints")
+
+    def _stage_cache(self) -> StageCache:
+        """Get the stage cache of the run, in the cache directory or in the checkpoint directory."""
+        if self.config.misc is not None and self.config.misc.cache_dir is not None:
+            return StageCache(self.config.misc.cache_dir)
+        return StageCache(self._checkpoint_dir())
+
+    def _get_input_digest(self) -> Optional[str]:
+        """Compute a content hash of the input point cloud without loading it.
+
+        It is used by process_tail(...) to find the results of a previous run in
+        the stage cache. Default implementation returns None, process_tail(...)
+        is then not supported.
+
+        Returns
+        -------
+        digest : Optional[str]
+            Hexadecimal digest of the input point cloud, None if it cannot be
+            computed before the point cloud is loaded.
+
+        """
+        return None
+
+    def _results_key(self, input_digest: str) -> str:
+        """Compute the cache key of the per-tree results.
+
+        The key depends on the input point cloud and on every parameter except the
+        ones that only affect the drawing and the export of the results (see
+        TAIL_PARAMETERS) and the location of the input and of the outputs.
+
+        Parameters
+        ----------
+        input_digest : str
+            The content hash of the input point cloud.
+
+        Returns
+        -------
+        key : str
+            The key of the results.
+
+        """
+        parameters = self.config.dict()
+        for category, names in TAIL_PARAMETERS.items():
+            for name in names:
+                parameters[category].pop(name, None)
+        misc = parameters["misc"]
+        # The input and the DTM are identified by their content.
+        misc.pop("input_file", None)
+        misc.pop("output_dir", None)
+        if misc.get("dtm_file") is not None:
+            misc["dtm_file"] = self._stage_cache().file_digest(misc["dtm_file"])
+        return StageCache.key(input_digest, **parameters)
+
+    @contextmanager
+    def _run_scope(self) -> Iterator[None]:
+        """Restore the configuration set by the user at the end of a run.
+
+        preflight(...) may switch the configuration to a lower memory execution, it
+        only applies to the current run: the next one starts again from the user
+        settings (e.g. the GUI reads the parameters without widgets from config).
+        """
+        config = self.config
+        try:
+            yield
+        finally:
+            if self.config is not config:
+                self.set_config(config)
+
+    def process_tail(self) -> bool:
+        """Draw and export the results of a previous run, without running the algorithm again.
+
+        The per-tree results (tree vector, tree heights, sections, circles and
+        outliers) are saved in the stage cache by process(...). If the results
+        of a run with the same input and the same parameters, apart from the ones
+        that only affect the drawing and the export of the results (see
+        TAIL_PARAMETERS), are found, only the circles, the axes, the tree
+        locations and the tabular data are computed and exported again, along
+        with the configuration file. The other outputs of the previous run are
+        left as they are, the outputs may thus be written in another directory.
+
+        Returns
+        -------
+        done : bool
+            True if the results were exported, False if they were not found (e.g.
+            the cache is disabled or the parameters of the algorithm changed), in
+            which case the full algorithm must be run with process(...).
+
+        """
+        with self._run_scope():
+            return self._process_tail()
+
+    def _process_tail(self) -> bool:
+        """Draw and export the results of a previous run, see process_tail(...)."""
+        if self.config is None:
+            raise Exception("Please set configuration before running any processing")
+        if self.config.misc is None or self.config.misc.cache_dir is None:
+            return False
+        # The previous run may have switched to a lower memory execution, so does this one.
+        self.preflight()
+        input_digest = self._get_input_digest()
+        if input_digest is None:
+            return False
+        cached = self._stage_cache().load("results", self._results_key(input_digest))
+        if cached is None:
+            return False
+
+        self._set_timings_sink()
+        self.instrumentation.start("process")
+        t_t = timeit.default_timer()
+        cloud_size = float(cached.pop("cloud_size"))
+        cloud_shape = int(cached.pop("cloud_shape"))
+        self.area_warning = bool(cached.pop("area_warning"))
+        try:
+            self.instrumentation.start("results")
+            self._draw_and_export_results(**cached, cloud_size=cloud_size, cloud_shape=cloud_shape)
+            self.instrumentation.end("results")
+            self.instrumentation.start("wait_for_exports")
+        except ProcessingCancelled:
+            self._discard_exports()
+            raise
+        self._wait_for_exports()
+        self.instrumentation.end("wait_for_exports")
+        self.config.to_config_file(Path(str(self.output_basepath) + "_config.ini"))
+        self.instrumentation.end("process", trees=cached["X_c"].shape[0])
+
+        print("---------------------------------------------")
+        print("End of process!")
+        print("---------------------------------------------")
+        print("Total time:", "   %.2f" % (timeit.default_timer() - t_t), "s")
+        print("nº of trees:", cached["X_c"].shape[0])
+
+        if self.area_warning:
+            print(
+                "Warning: 3DFin has detected a potential error in the terrain modelling.\n"
+                + 'This usually happens when the "cloth resolution" parameter didn\'t fit well the terrain.\n'
+                + "Learn more about this here https://github.com/3DFin/3DFin_Tutorial"
+            )
+        return True
+
+    def _get_cloud_summary(self) -> Optional[CloudSummary]:
+        """Get the number of points and the extent of the base cloud before it is loaded.
+
+        It is used by preflight(...) to estimate the memory needed by the algorithm.
+        Default implementation returns None, the memory is then not estimated.
+
+        Returns
+        -------
+        cloud : Optional[CloudSummary]
+            The summary of the base cloud, None if it is not known.
+
+        """
+        return None
+
+    def preflight(self) -> Optional[MemoryEstimate]:
+        """Check that the algorithm fits in the memory budget before the base cloud is loaded.
+
+        The peak memory is estimated from the summary of the base cloud and from the
+        configuration, see three_d_fin.processing.memory. If it exceeds the memory
+        budget, depending on the memory strategy of the misc parameters, either the
+        processing is refused or the configuration is switched to the first lower
+        memory execution that fits in the budget: windowed loading (for normalized
+        clouds), which does not change the results, then, only with the 'approximate'
+        strategy, compact coordinates, then tiles. The execution that will be run is
+        logged. process(...) and process_tail(...) restore the configuration set by
+        the user at the end of the run.
+
+        Returns
+        -------
+        estimate : Optional[MemoryEstimate]
+            The memory estimate of the configuration that will be run, None if the
+            memory was not estimated.
+
+        Raises
+        ------
+        MemoryBudgetError
+            If the processing is not expected to fit in the memory budget and it is
+            either refused or no allowed lower memory execution fits.
+
+        """
+        misc = self.config.misc
+        if misc is None or misc.memory_strategy == "off":
+            return None
+        cloud = self._get_cloud_summary()
+        budget = misc.memory_budget * 1024**2 if misc.memory_budget is not None else available_memory()
+        if cloud is None or budget is None:
+            return None
+
+        self.instrumentation.start("preflight", points_in=cloud.point_count)
+        estimate = estimate_memory(cloud, self.config)
+        budget_message = f"the memory budget of {budget / 1024**2:.0f} MiB"
+        print("---------------------------------------------")
+        print("Estimating the memory usage...")
+        print("---------------------------------------------")
+        print("   Estimated peak memory:", estimate, "for", budget_message)
+        if estimate.peak > budget and misc.memory_strategy == "refuse":
+            self.instrumentation.end("preflight", estimated_peak=estimate.peak, budget=budget)
+            raise MemoryBudgetError(f"The processing is expected to use {estimate}, more than {budget_message}")
+
+        # Lower memory executions, from the one that does not change the results to the one that changes them most.
+        updates = []
+        if misc.is_normalized and misc.tile_size is None and not misc.windowed_loading:
+            updates.append({"windowed_loading": True})
+        if misc.memory_strategy == "approximate":
+            if not misc.compact_coordinates:
+                updates.append({"compact_coordinates": True})
+            updates.append({"tile_size": None})
+        config = self.config
+        for update in updates:
+            if estimate.peak <= budget:
+                break
+            if "tile_size" in update:
+                update["tile_size"] = fit_tile_size(cloud, config, budget)
+                if update["tile_size"] is None:
+                    self.instrumentation.end("preflight", estimated_peak=estimate.peak, budget=budget)
+                    raise MemoryBudgetError(
+                        f"The processing is expected to use {estimate}, more than {budget_message}, "
+                        "even with the lowest memory settings"
+                    )
+            config = config.copy(update={"misc": config.misc.copy(update=update)})
+            estimate = estimate_memory(cloud, config)
+            print("   Switching to", ", ".join(f"{key}={value}" for key, value in update.items()), "->", estimate)
+        if estimate.peak > budget:
+            self.instrumentation.end("preflight", estimated_peak=estimate.peak, budget=budget)
+            raise MemoryBudgetError(
+                f"The processing is expected to use {estimate}, more than {budget_message}. The 'approximate' "
+                "memory strategy also switches to compact coordinates and tiles, which change the results marginally"
+            )
+        if config is not self.config:
+            self.set_config(config)
+        mode = _execution_mode(config)
+        print("   Execution:", mode)
+        self.instrumentation.end("preflight", estimated_peak=estimate.peak, budget=budget, mode=mode)
+        return estimate
+
     @abstractmethod
     def _export_dtm(self, dtm: np.ndarray):
         """Export the DTM.
@@ -158,6 +782,24 @@ class FinProcessing(ABC):
         """
         pass
 
+    def _export_normalization_dtm(self, dtm: np.ndarray):
+        """Export the DTM the heights are normalized with, at full precision.
+
+        The exported DTM (see _export_dtm(...)) is completed and resampled, the
+        heights are normalized with the cleaned DTM instead. Given back as the
+        dtm_file misc parameter, it normalizes the heights exactly as this run.
+        Default implementation does nothing.
+
+        Parameters
+        ----------
+        dtm : np.ndarray
+            A numpy array of shape (n, 3) where n is the number of points in the DTM.
+            (x), (y) and (z) coordinates are stored in the first, second,
+            third columns respectively.
+
+        """
+        return
+
     @abstractmethod
     def _export_stripe(self, clust_stripe: np.ndarray):
         """Export the stem extracted from the stripe.
@@ -173,16 +815,19 @@ class FinProcessing(ABC):
         pass
 
     @abstractmethod
-    def _enrich_base_cloud(self, assigned_cloud: np.ndarray):
+    def _enrich_base_cloud(self, coords: np.ndarray, tree_id: np.ndarray, dist_axes: np.ndarray):
         """Enrich the base cloud with the cluster ID and the z0 values and export it.
 
         Parameters
         ----------
-        assigned_cloud : np.ndarray
-            A numpy array of shape (n, 6) where n is the number of points in the cloud.
-            It consists of 6 columns: (x), (y), (z) and z0 coordinates,
-            5th column containing tree ID that each point belongs to and a 6th column containing
-            point distance to closest axis.
+        coords : np.ndarray
+            A numpy array of shape (n, 4) where n is the number of points in the cloud.
+            It consists of 4 columns: (x), (y), (z) and z0 coordinates. In compact mode,
+            coordinates are float32 and relative to the origin attribute, see _to_global(...).
+        tree_id : np.ndarray
+            A vector of n int32 values containing the tree ID that each point belongs to.
+        dist_axes : np.ndarray
+            A vector of n values containing the point distance to the closest axis.
 
         """
         pass
@@ -290,6 +935,150 @@ class FinProcessing(ABC):
             cloud_shape,
         )
 
+    def _draw_and_export_results(
+        self,
+        tree_vector: np.ndarray,
+        tree_heights: np.ndarray,
+        sections: np.ndarray,
+        X_c: np.ndarray,
+        Y_c: np.ndarray,
+        R: np.ndarray,
+        check_circle: np.ndarray,
+        sector_perct: np.ndarray,
+        n_points_in: np.ndarray,
+        outliers: np.ndarray,
+        cloud_size: float,
+        cloud_shape: int,
+    ):
+        """Draw the circles and the axes, locate the trees and export the results.
+
+        It is the last step of the 3DFin algorithm, it only depends on the per-tree
+        results of the previous steps. See process(...) for the description of the outputs.
+
+        Parameters
+        ----------
+        tree_vector : np.ndarray
+            Matrix with as many rows as trees, containing a description of each
+            individualized tree (see dendromatics.individualize_trees).
+        tree_heights : np.ndarray
+            Matrix containing the heights of individualized trees.
+        sections : np.ndarray
+            Vector containing the heights of the sections.
+        X_c : np.ndarray
+            Matrix containing the (x) coordinates of the center of the sections.
+        Y_c : np.ndarray
+            Matrix containing the (y) coordinates of the center of the sections.
+        R : np.ndarray
+            Matrix containing the radius of the sections.
+        check_circle : np.ndarray
+            Matrix containing the 'check' status of the sections.
+        sector_perct : np.ndarray
+            Matrix containing the sector occupancy of the sections.
+        n_points_in : np.ndarray
+            Matrix containing the number of points within the inner circle of the sections.
+        outliers : np.ndarray
+            Matrix containing the 'outlier probability' of the sections.
+        cloud_size : float
+            Number of points of the cloud, in millions.
+        cloud_shape : int
+            Area of the cloud, in m^2.
+
+        """
+        import dendromatics as dm
+
+        print("  ")
+        print("---------------------------------------------")
+        print("6.-Drawing circles and axes...")
+        print("---------------------------------------------")
+
+        t_las2 = timeit.default_timer()
+
+        circles_coords = dm.generate_circles_cloud(
+            X_c,
+            Y_c,
+            R,
+            sections,
+            check_circle,
+            sector_perct,
+            n_points_in,
+            tree_vector,
+            outliers,
+            self.config.expert.minimum_diameter / 2.0,
+            self.config.advanced.maximum_diameter / 2.0,
+            self.config.expert.point_threshold,
+            self.config.expert.number_sectors,
+            self.config.expert.m_number_sectors,
+            self.config.expert.circa,
+        )
+
+        # Export circles
+        self._submit_export(self._export_circles, circles_coords)
+
+        axes, tilt = dm.generate_axis_cloud(
+            tree_vector,
+            self.config.expert.axis_downstep,
+            self.config.expert.axis_upstep,
+            self.config.basic.lower_limit,
+            self.config.basic.upper_limit,
+            self.config.expert.p_interval,
+        )
+
+        # Export axes
+        self._submit_export(self._export_axes, axes, tilt)
+
+        dbh_values, tree_locations = dm.tree_locator(
+            sections,
+            X_c,
+            Y_c,
+            tree_vector,
+            sector_perct,
+            R,
+            outliers,
+            n_points_in,
+            self.config.expert.point_threshold,
+            X_field=0,
+            Y_field=1,
+            Z_field=2,
+        )
+
+        # Export tree locations
+        self._submit_export(self._export_tree_locations, tree_locations, dbh_values)
+
+        # -------------------------------------------------------------------------------------------------------------
+        # Exporting results
+        # -------------------------------------------------------------------------------------------------------------
+
+        self._submit_export(
+            self._export_tabular_data,
+            self.config,
+            self.output_basepath,
+            X_c,
+            Y_c,
+            R,
+            check_circle,
+            sector_perct,
+            n_points_in,
+            sections,
+            outliers,
+            dbh_values,
+            tree_locations,
+            tree_heights,
+            cloud_size,
+            cloud_shape,
+        )
+        elapsed_las2 = timeit.default_timer() - t_las2
+        print("Total time:", "   %.2f" % elapsed_las2, "s")
+
+    def _process_tiled(self):
+        """Run the 3DFin algorithm tile by tile.
+
+        Called by process(...) instead of the regular algorithm when a tile size
+        is set in the misc parameters. Tiled processing requires to stream the point
+        cloud from its provider, it is thus left to implementers. Default
+        implementation raises a NotImplementedError.
+        """
+        raise NotImplementedError("Tiled processing is not supported in this context")
+
     def process(self):
         """3DFin main algorithm.
 
@@ -368,9 +1157,52 @@ class FinProcessing(ABC):
         •	_export_stripe(...) -> the stems obtained from the stripe during step 1.
         •	_export_tree_locations(...) -> the tree locators coordinates.
         •	_export_tree_height(...) -> the highest point from each tree.
+
+        If a tile size is set in the misc parameters, the point cloud is processed tile by tile
+        by _process_tiled(...) instead, see its implementations for more details.
+
+        The processing could be stopped from another thread with cancel(...), a
+        ProcessingCancelled exception is then raised.
+
+        If checkpoints are enabled in the misc parameters, the result of each stage
+        is kept in the stage cache (see three_d_fin.processing.cache) of the checkpoint
+        directory until the run completes. When resuming, the stages whose checkpoint
+        matches the input and the parameters are loaded instead of being computed.
         """
         if self.config is None:
             raise Exception("Please set configuration before running any processing")
+        checkpoint_dir = self._checkpoint_dir()
+        if checkpoint_dir is not None and checkpoint_dir.is_dir():
+            if self.config.misc.checkpoints == "resume":
+                stages = sorted({path.stem.rsplit("_", 1)[0] for path in checkpoint_dir.glob("*.npz")})
+                print("Resuming from the checkpoints of", ", ".join(stages) if stages else "no stage")
+            else:
+                # Checkpoints of a previous run are only reused when resuming.
+                shutil.rmtree(checkpoint_dir)
+        with self._run_scope():
+            try:
+                self._process()
+            except ProcessingCancelled:
+                self._discard_exports()
+                raise
+        if checkpoint_dir is not None:
+            shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+    def _process(self):
+        """Run the 3DFin algorithm, see process(...)."""
+        # dendromatics (and its scikit-learn, CSF... dependencies) are only imported when
+        # the algorithm is run, they are not needed to set it up.
+        import dendromatics as dm
+
+        self._set_timings_sink()
+        self.instrumentation.start("process")
+        self.origin = None
+        self.preflight()
+
+        if self.config.misc is not None and self.config.misc.tile_size is not None:
+            self._process_tiled()
+            self.instrumentation.end("process")
+            return
 
         # -------------------------------------------------------------------------------------------------
         # NON MODIFIABLE. These parameters should never be modified by the user.
@@ -386,116 +1218,230 @@ class FinProcessing(ABC):
         t_t = timeit.default_timer()
 
         # load the base_cloud if needed
+        self.instrumentation.start("load")
         self._load_base_cloud()
 
+        # Stage results are cached if a cache directory is set, each stage key is derived
+        # from the key of its input and from the parameters the stage depends on.
+        cache = self._stage_cache()
+
         if config.misc.is_normalized:
             coords = self._get_xyz_z0_from_base()
+            self.instrumentation.end("load", points_out=coords.shape[0])
+            input_digest = self._compute_input_digest(coords) if cache.enabled else ""
+            input_key = cache.key(
+                input_digest,
+                is_normalized=True,
+                z0_name=config.basic.z0_name,
+                compact_coordinates=config.misc.compact_coordinates,
+            )
+            if config.misc.compact_coordinates:
+                coords = self._to_compact(coords)
             # Number of points and area occuped by the plot.
             print("---------------------------------------------")
             print("Analyzing cloud size...")
             print("---------------------------------------------")
 
-            _, _, voxelated_ground = dm.voxelate(
-                coords[coords[:, 3] < 0.5, 0:3],
-                1,
-                2000,
-                n_digits,
-                with_n_points=False,
-                silent=False,
-            )
-            cloud_size = coords.shape[0] / 1000000
-            cloud_shape = voxelated_ground.shape[0]
+            self.instrumentation.start("cloud_shape", points_in=coords.shape[0])
+            cached = cache.load("cloud_shape", input_key)
+            if cached is None:
+                # dendromatics voxel codes overflow single precision, compact coordinates are
+                # converted back to double precision before being voxelated.
+                _, _, voxelated_ground = dm.voxelate(
+                    np.asarray(coords[coords[:, 3] < 0.5, 0:3], dtype=np.float64),
+                    1,
+                    2000,
+                    n_digits,
+                    with_n_points=False,
+                    silent=False,
+                )
+                cloud_shape = voxelated_ground.shape[0]
+                cache.save("cloud_shape", input_key, cloud_shape=cloud_shape)
+            else:
+                cloud_shape = int(cached["cloud_shape"])
+            self.instrumentation.end("cloud_shape", cached=cached is not None, area=cloud_shape)
+            cloud_size = self._get_point_count(coords) / 1000000
             print("   This cloud has", "{:.2f}".format(cloud_size), "million points")
             print("   Its area is ", cloud_shape, "m^2")
 
             print("---------------------------------------------")
             print("Cloud is already normalized...")
             print("---------------------------------------------")
+            stripe_input_key = input_key
 
         else:
             coords = self._get_xyz_from_base()
+            self.instrumentation.end("load", points_out=coords.shape[0])
+            input_digest = self._compute_input_digest(coords) if cache.enabled else ""
+            input_key = cache.key(
+                input_digest,
+                is_normalized=False,
+                compact_coordinates=config.misc.compact_coordinates,
+            )
 
             # Number of points and area occuped by the plot.
             print("---------------------------------------------")
             print("Analyzing cloud size...")
             print("---------------------------------------------")
 
-            _, _, voxelated_ground = dm.voxelate(coords, 1, 2000, n_digits, with_n_points=False, silent=False)
-            cloud_size = coords.shape[0] / 1000000
-            cloud_shape = voxelated_ground.shape[0]
+            self.instrumentation.start("cloud_shape", points_in=coords.shape[0])
+            cached = cache.load("cloud_shape", input_key)
+            if cached is None:
+                _, _, voxelated_ground = dm.voxelate(coords, 1, 2000, n_digits, with_n_points=False, silent=False)
+                cloud_shape = voxelated_ground.shape[0]
+                del voxelated_ground
+                cache.save("cloud_shape", input_key, cloud_shape=cloud_shape)
+            else:
+                cloud_shape = int(cached["cloud_shape"])
+            self.instrumentation.end("cloud_shape", cached=cached is not None, area=cloud_shape)
+            cloud_size = self._get_point_count(coords) / 1000000
             print("   This cloud has", "{:.2f}".format(cloud_size), "million points")
             print("   Its area is ", cloud_shape, "m^2")
-            del voxelated_ground
 
             print("---------------------------------------------")
             print("Cloud is not normalized...")
             print("---------------------------------------------")
 
-            if config.misc.is_noisy:
+            self.instrumentation.start("dtm", points_in=coords.shape[0])
+            if config.misc.dtm_file is not None:
                 print("---------------------------------------------")
-                print("And there is noise. Reducing it...")
+                print("Loading the Digital Terrain Model...")
                 print("---------------------------------------------")
                 t = timeit.default_timer()
-                # Noise elimination
-                clean_points = dm.clean_ground(
-                    coords,
-                    config.expert.res_ground,
-                    config.expert.min_points_ground,
+                # A DTM is supplied, there is no need to generate it.
+                dtm = load_dtm(config.misc.dtm_file)
+                dtm_key = cache.key(
+                    input_key,
+                    dtm_file=cache.file_digest(config.misc.dtm_file) if cache.enabled else "",
                 )
 
-                elapsed = timeit.default_timer() - t
-                print("        ", "%.2f" % elapsed, "s: denoising")
-
-                print("---------------------------------------------")
-                print("Generating a Digital Terrain Model...")
-                print("---------------------------------------------")
-                t = timeit.default_timer()
-                # Extracting ground points and DTM ## MAYBE ADD VOXELIZATION HERE
-                cloth_nodes = dm.generate_dtm(clean_points)
+                # export DTM, as a generated one is
+                self._submit_export(self._export_dtm, dm.complete_dtm(dtm))
+                self._submit_export(self._export_normalization_dtm, dtm)
 
                 elapsed = timeit.default_timer() - t
-                print("        ", "%.2f" % elapsed, "s: generating the DTM")
+                print("        ", "%.2f" % elapsed, "s: loading the DTM")
 
             else:
-                print("---------------------------------------------")
-                print("Generating a Digital Terrain Model...")
-                print("---------------------------------------------")
-                t = timeit.default_timer()
-                # Extracting ground points and DTM
-                cloth_nodes = dm.generate_dtm(coords, cloth_resolution=config.basic.res_cloth)
-
-                elapsed = timeit.default_timer() - t
-                print("        ", "%.2f" % elapsed, "s: generating the DTM")
-
-            print("---------------------------------------------")
-            print("Cleaning and exporting the Digital Terrain Model...")
-            print("---------------------------------------------")
-            t = timeit.default_timer()
-            # Cleaning the DTM
-            dtm = dm.clean_cloth(cloth_nodes)
-
-            # Completing the DTM
-            completed_dtm = dm.complete_dtm(dtm)
-
-            # export DTM
-            self._export_dtm(completed_dtm)
-
-            elapsed = timeit.default_timer() - t
-            print("        ", "%.2f" % elapsed, "s: exporting the DTM")
+                dtm_key = cache.key(
+                    input_key,
+                    is_noisy=config.misc.is_noisy,
+                    res_cloth=config.basic.res_cloth,
+                    res_ground=config.expert.res_ground,
+                    min_points_ground=config.expert.min_points_ground,
+                    ground_reduction=config.expert.ground_reduction,
+                )
+                cached = cache.load("dtm", dtm_key)
+                if cached is not None:
+                    dtm = cached["dtm"]
+                    completed_dtm = cached["completed_dtm"]
+                    self._submit_export(self._export_dtm, completed_dtm)
+                    self._submit_export(self._export_normalization_dtm, dtm)
+                else:
+                    if config.misc.is_noisy:
+                        print("---------------------------------------------")
+                        print("And there is noise. Reducing it...")
+                        print("---------------------------------------------")
+                        t = timeit.default_timer()
+                        # Noise elimination
+                        clean_points = dm.clean_ground(
+                            coords[:, 0:3],
+                            config.expert.res_ground,
+                            config.expert.min_points_ground,
+                        )
+
+                        elapsed = timeit.default_timer() - t
+                        print("        ", "%.2f" % elapsed, "s: denoising")
+
+                        print("---------------------------------------------")
+                        print("Generating a Digital Terrain Model...")
+                        print("---------------------------------------------")
+                        t = timeit.default_timer()
+                        # Extracting ground points and DTM
+                        cloth_nodes = dm.generate_dtm(self._reduce_ground(clean_points))
+
+                        elapsed = timeit.default_timer() - t
+                        print("        ", "%.2f" % elapsed, "s: generating the DTM")
+
+                    else:
+                        print("---------------------------------------------")
+                        print("Generating a Digital Terrain Model...")
+                        print("---------------------------------------------")
+                        t = timeit.default_timer()
+                        # Extracting ground points and DTM
+                        cloth_nodes = dm.generate_dtm(
+                            self._reduce_ground(coords), cloth_resolution=config.basic.res_cloth
+                        )
+
+                        elapsed = timeit.default_timer() - t
+                        print("        ", "%.2f" % elapsed, "s: generating the DTM")
+
+                    print("---------------------------------------------")
+                    print("Cleaning and exporting the Digital Terrain Model...")
+                    print("---------------------------------------------")
+                    t = timeit.default_timer()
+                    # Cleaning the DTM
+                    dtm = dm.clean_cloth(cloth_nodes)
+
+                    # Completing the DTM
+                    completed_dtm = dm.complete_dtm(dtm)
+
+                    cache.save("dtm", dtm_key, dtm=dtm, completed_dtm=completed_dtm)
+
+                    # export DTM
+                    self._submit_export(self._export_dtm, completed_dtm)
+                    self._submit_export(self._export_normalization_dtm, dtm)
+
+                    elapsed = timeit.default_timer() - t
+                    print("        ", "%.2f" % elapsed, "s: exporting the DTM")
+            self.instrumentation.end("dtm", points_out=dtm.shape[0])
 
             # Normalizing the point cloud
             print("---------------------------------------------")
             print("Normalizing the point cloud and running the algorithm...")
             print("---------------------------------------------")
             t = timeit.default_timer()
-            z0_values = dm.normalize_heights(coords, dtm)
-            coords = np.append(coords, np.expand_dims(z0_values, axis=1), 1)
-
-            # Check that the normalization is correct.
-            self.area_warning, area_discrepancy = dm.check_normalization_discrepancy(coords[:, [0, 1, 3]], cloud_shape)
+            # The normalization only depends on the DTM.
+            normalization_key = dtm_key
+            self.instrumentation.start("normalization", points_in=coords.shape[0])
+            cached = cache.load("normalization", normalization_key)
+            if cached is None:
+                self._normalize_heights(coords, dtm)
+
+                # Check that the normalization is correct. Only the points close to the ground
+                # are checked, they are selected beforehand (with a margin around the default
+                # slice of check_normalization_discrepancy) instead of copying the whole cloud.
+                ground = (coords[:, 3] >= -0.2) & (coords[:, 3] <= 0.25)
+                self.area_warning, area_discrepancy = dm.check_normalization_discrepancy(
+                    np.asarray(coords[ground][:, [0, 1, 3]], dtype=np.float64), cloud_shape
+                )
+                del ground
+                cache.save(
+                    "normalization",
+                    normalization_key,
+                    z0_values=coords[:, 3],
+                    area_warning=self.area_warning,
+                    area_discrepancy=area_discrepancy,
+                )
+            else:
+                coords[:, 3] = cached["z0_values"]
+                self.area_warning = bool(cached["area_warning"])
+                area_discrepancy = float(cached["area_discrepancy"])
+            self.instrumentation.end(
+                "normalization",
+                points_out=coords.shape[0],
+                cached=cached is not None,
+                area_discrepancy=area_discrepancy,
+            )
 
             elapsed = timeit.default_timer() - t
             print("        ", "%.2f" % elapsed, "s: Normalizing the point cloud")
+
+            # The DTM and the normalized heights are computed before compacting the coordinates,
+            # as the cloth simulation and the DTM neighbours of the points are sensitive to their
+            # translation and precision.
+            if config.misc.compact_coordinates:
+                coords = self._to_compact(coords)
             print(
                 "         => Normalization area discrepancy:",
                 "%.2f" % area_discrepancy,
@@ -503,49 +1449,132 @@ class FinProcessing(ABC):
             )
             elapsed = timeit.default_timer() - t_t
             print("        ", "%.2f" % elapsed, "s: Total preprocessing time")
+            stripe_input_key = normalization_key
 
         print("---------------------------------------------")
         print("1.-Extracting the stripe and peeling the stems...")
         print("---------------------------------------------")
 
-        stripe = coords[
-            (coords[:, 3] > config.basic.lower_limit) & (coords[:, 3] < config.basic.upper_limit),
-            0:4,
-        ]
-        clust_stripe = dm.verticality_clustering(
-            stripe,
-            config.expert.verticality_scale_stripe,
-            config.expert.verticality_thresh_stripe,
-            config.expert.number_of_points,
-            config.basic.number_of_iterations,
-            config.expert.res_xy_stripe,
-            config.expert.res_z_stripe,
-            n_digits,
+        stripe_key = cache.key(
+            stripe_input_key,
+            lower_limit=config.basic.lower_limit,
+            upper_limit=config.basic.upper_limit,
+            verticality_scale_stripe=config.expert.verticality_scale_stripe,
+            verticality_thresh_stripe=config.expert.verticality_thresh_stripe,
+            number_of_points=config.expert.number_of_points,
+            number_of_iterations=config.basic.number_of_iterations,
+            res_xy_stripe=config.expert.res_xy_stripe,
+            res_z_stripe=config.expert.res_z_stripe,
         )
+        self.instrumentation.start("stripe", points_in=coords.shape[0])
+        cached = cache.load("stripe", stripe_key)
+        if cached is None:
+            stripe = np.asarray(
+                coords[
+                    (coords[:, 3] > config.basic.lower_limit) & (coords[:, 3] < config.basic.upper_limit),
+                    0:4,
+                ],
+                dtype=np.float64,
+            )
+            if stripe.shape[0] == 0:
+                raise NoTreeError("No point was found in the stripe.")
+            try:
+                clust_stripe = dm.verticality_clustering(
+                    stripe,
+                    config.expert.verticality_scale_stripe,
+                    config.expert.verticality_thresh_stripe,
+                    config.expert.number_of_points,
+                    config.basic.number_of_iterations,
+                    config.expert.res_xy_stripe,
+                    config.expert.res_z_stripe,
+                    n_digits,
+                )
+            except ValueError as error:
+                # dendromatics raises a ValueError when no point of the stripe is vertical enough.
+                raise NoTreeError(str(error)) from error
+            if clust_stripe.shape[0] == 0:
+                raise NoTreeError("No vertical cluster was found in the stripe.")
+            cache.save("stripe", stripe_key, clust_stripe=clust_stripe)
+        else:
+            clust_stripe = cached["clust_stripe"]
+        self.instrumentation.end("stripe", points_out=clust_stripe.shape[0], cached=cached is not None)
 
         print("---------------------------------------------")
         print("2.-Computing distances to axes and individualizating trees...")
         print("---------------------------------------------")
 
-        assigned_cloud, tree_vector, tree_heights = dm.individualize_trees(
-            coords,
-            clust_stripe,
-            config.expert.res_z,
-            config.expert.res_xy,
-            config.basic.lower_limit,
-            config.basic.upper_limit,
-            config.expert.height_range,
-            config.expert.maximum_d,
-            config.expert.minimum_points,
-            config.expert.distance_to_axis,
-            config.expert.maximum_dev,
-            config.expert.res_heights,
-            n_digits,
-            X_field,
-            Y_field,
-            Z_field,
-            tree_id_field=-1,
-            progress_hook=self.progress.update,
+        individualization_key = cache.key(
+            stripe_key,
+            res_z=config.expert.res_z,
+            res_xy=config.expert.res_xy,
+            height_range=config.expert.height_range,
+            maximum_d=config.expert.maximum_d,
+            minimum_points=config.expert.minimum_points,
+            distance_to_axis=config.expert.distance_to_axis,
+            maximum_dev=config.expert.maximum_dev,
+            res_heights=config.expert.res_heights,
+        )
+        self.instrumentation.start("individualization", points_in=coords.shape[0])
+        cached = cache.load("individualization", individualization_key)
+        if cached is None:
+            # Same steps as dendromatics.individualize_trees, but the tree ID and the distance
+            # to the axis of the points are kept apart instead of being appended to a copy
+            # of the whole cloud.
+            # As in dendromatics.individualize_trees, res_z is the (x, y) resolution of the voxels.
+            voxelated_cloud, vox_to_cloud_ind = _voxelate_columns(
+                coords, config.expert.res_z, config.expert.res_xy, n_digits
+            )
+            tree_vector, dist_to_axis, tree_id_vector = compute_axes(
+                voxelated_cloud,
+                clust_stripe,
+                (
+                    config.basic.lower_limit,
+                    config.basic.upper_limit,
+                    config.expert.height_range,
+                    config.expert.minimum_points,
+                    config.expert.maximum_d,
+                ),
+                config.misc.individualization_workers,
+                progress_hook=self._progress_hook,
+            )
+            if tree_vector.shape[0] == 0:
+                raise NoTreeError("No tree axis was found from the stripe.")
+            tree_heights = dm.compute_heights(
+                voxelated_cloud,
+                tree_vector,
+                dist_to_axis,
+                tree_id_vector,
+                config.expert.distance_to_axis,
+                config.expert.maximum_dev,
+                config.expert.res_heights,
+                n_digits,
+                X_field,
+                Y_field,
+                Z_field,
+            )
+            del voxelated_cloud
+            tree_id = tree_id_vector[vox_to_cloud_ind].astype(np.int32)
+            dist_axes = dist_to_axis[vox_to_cloud_ind].astype(coords.dtype, copy=False)
+            del vox_to_cloud_ind
+            # Only the tree ID and the distance to axis are stored, the coordinates are already known.
+            cache.save(
+                "individualization",
+                individualization_key,
+                tree_id=tree_id,
+                dist_axes=dist_axes,
+                tree_vector=tree_vector,
+                tree_heights=tree_heights,
+            )
+        else:
+            tree_id = cached["tree_id"]
+            dist_axes = cached["dist_axes"]
+            tree_vector = cached["tree_vector"]
+            tree_heights = cached["tree_heights"]
+        self.instrumentation.end(
+            "individualization",
+            points_out=coords.shape[0],
+            cached=cached is not None,
+            trees=tree_vector.shape[0],
         )
 
         print("  ")
@@ -558,38 +1587,58 @@ class FinProcessing(ABC):
 
         clean_stripe = clust_stripe[np.isin(clust_stripe[:, -1], tree_vector[:, 0])]
 
-        self._export_stripe(clean_stripe)
+        self._submit_export(self._export_stripe, self._to_global(clean_stripe))
 
         # Whole cloud including new
-        self._enrich_base_cloud(assigned_cloud)
+        self._submit_export(self._enrich_base_cloud, coords, tree_id, dist_axes)
 
         elapsed_las = timeit.default_timer() - t_las
         print("Total time:", "   %.2f" % elapsed_las, "s")
 
         # Export tree heights
-        self._export_tree_height(tree_heights)
+        tree_heights = self._to_global(tree_heights)
+        self._submit_export(self._export_tree_height, tree_heights)
 
         # stem extraction and curation
         print("---------------------------------------------")
         print("4.-Extracting and curating stems...")
         print("---------------------------------------------")
 
-        xyz0_coords = assigned_cloud[
-            (assigned_cloud[:, 5] < (config.advanced.stem_search_diameter / 2.0))
-            & (assigned_cloud[:, 3] > config.advanced.minimum_height)
-            & (assigned_cloud[:, 3] < config.advanced.maximum_height + config.advanced.section_wid),
-            :,
-        ]
-        stems = dm.verticality_clustering(
-            xyz0_coords,
-            config.expert.verticality_scale_stripe,
-            config.expert.verticality_thresh_stripe,
-            config.expert.number_of_points,
-            config.basic.number_of_iterations,
-            config.expert.res_xy_stripe,
-            config.expert.res_z_stripe,
-            n_digits,
-        )[:, 0:6]
+        stems_key = cache.key(
+            individualization_key,
+            stem_search_diameter=config.advanced.stem_search_diameter,
+            minimum_height=config.advanced.minimum_height,
+            maximum_height=config.advanced.maximum_height,
+            section_wid=config.advanced.section_wid,
+        )
+        self.instrumentation.start("stems", points_in=coords.shape[0])
+        cached = cache.load("stems", stems_key)
+        if cached is None:
+            # (x), (y), (z), z0, tree ID and distance to axis, sorted by tree. The verticality
+            # clustering keeps the order of the points, so do the stems, whose sections are
+            # then fitted tree by tree on slices of them.
+            xyz0_coords = gather_stems(
+                coords,
+                tree_id,
+                dist_axes,
+                config.advanced.stem_search_diameter / 2.0,
+                config.advanced.minimum_height,
+                config.advanced.maximum_height + config.advanced.section_wid,
+            )
+            stems = dm.verticality_clustering(
+                xyz0_coords,
+                config.expert.verticality_scale_stripe,
+                config.expert.verticality_thresh_stripe,
+                config.expert.number_of_points,
+                config.basic.number_of_iterations,
+                config.expert.res_xy_stripe,
+                config.expert.res_z_stripe,
+                n_digits,
+            )[:, 0:6]
+            cache.save("stems", stems_key, stems=stems)
+        else:
+            stems = cached["stems"]
+        self.instrumentation.end("stems", points_out=stems.shape[0], cached=cached is not None)
 
         # Computing circles
         print("---------------------------------------------")
@@ -602,120 +1651,106 @@ class FinProcessing(ABC):
             config.advanced.section_len,
         )  # Range of uniformly spaced values within the specified interval
 
-        (
-            X_c,
-            Y_c,
-            R,
-            check_circle,
-            _,
-            sector_perct,
-            n_points_in,
-        ) = dm.compute_sections(
-            stems,
-            sections,
-            config.advanced.section_wid,
-            config.expert.diameter_proportion,
-            config.expert.point_threshold,
-            config.expert.minimum_diameter / 2.0,
-            config.advanced.maximum_diameter / 2.0,
-            config.expert.point_distance,
-            config.expert.number_points_section,
-            config.expert.number_sectors,
-            config.expert.m_number_sectors,
-            config.expert.circle_width,
-            progress_hook=self.progress.update,
+        sections_key = cache.key(
+            stems_key,
+            section_len=config.advanced.section_len,
+            maximum_diameter=config.advanced.maximum_diameter,
+            diameter_proportion=config.expert.diameter_proportion,
+            point_threshold=config.expert.point_threshold,
+            minimum_diameter=config.expert.minimum_diameter,
+            point_distance=config.expert.point_distance,
+            number_points_section=config.expert.number_points_section,
+            number_sectors=config.expert.number_sectors,
+            m_number_sectors=config.expert.m_number_sectors,
+            circle_width=config.expert.circle_width,
         )
+        self.instrumentation.start("sections", points_in=stems.shape[0])
+        cached = cache.load("sections", sections_key)
+        if cached is None:
+            section_results = compute_sections(
+                stems,
+                sections,
+                (
+                    config.advanced.section_wid,
+                    config.expert.diameter_proportion,
+                    config.expert.point_threshold,
+                    config.expert.minimum_diameter / 2.0,
+                    config.advanced.maximum_diameter / 2.0,
+                    config.expert.point_distance,
+                    config.expert.number_points_section,
+                    config.expert.number_sectors,
+                    config.expert.m_number_sectors,
+                    config.expert.circle_width,
+                ),
+                config.misc.section_workers,
+                progress_hook=self._progress_hook,
+            )
+            cache.save("sections", sections_key, **section_results)
+            X_c = section_results["X_c"]
+            Y_c = section_results["Y_c"]
+            R = section_results["R"]
+            check_circle = section_results["check_circle"]
+            sector_perct = section_results["sector_perct"]
+            n_points_in = section_results["n_points_in"]
+        else:
+            X_c = cached["X_c"]
+            Y_c = cached["Y_c"]
+            R = cached["R"]
+            check_circle = cached["check_circle"]
+            sector_perct = cached["sector_perct"]
+            n_points_in = cached["n_points_in"]
+        self.instrumentation.end("sections", cached=cached is not None, sections=sections.shape[0])
+
+        if self.origin is not None:
+            # Coordinates of the input cloud are restored, sections without any circle are left to 0.
+            fitted = (X_c != 0) | (Y_c != 0)
+            X_c = np.where(fitted, X_c + self.origin[0], 0.0)
+            Y_c = np.where(fitted, Y_c + self.origin[1], 0.0)
+            tree_vector = self._to_global(tree_vector, first_column=4)
+            # The height difference between the stem centroid and its z0 depends on the origin.
+            tree_vector[:, 7] += self.origin[2]
 
         # Once every circle on every tree is fitted, outliers are detected.
         np.seterr(divide="ignore", invalid="ignore")
         outliers = dm.tilt_detection(X_c, Y_c, R, sections, w_1=3, w_2=1)
         np.seterr(divide="warn", invalid="warn")
 
-        print("  ")
-        print("---------------------------------------------")
-        print("6.-Drawing circles and axes...")
-        print("---------------------------------------------")
-
-        t_las2 = timeit.default_timer()
-
-        circles_coords = dm.generate_circles_cloud(
-            X_c,
-            Y_c,
-            R,
-            sections,
-            check_circle,
-            sector_perct,
-            n_points_in,
-            tree_vector,
-            outliers,
-            config.expert.minimum_diameter / 2.0,
-            config.advanced.maximum_diameter / 2.0,
-            config.expert.point_threshold,
-            config.expert.number_sectors,
-            config.expert.m_number_sectors,
-            config.expert.circa,
-        )
-
-        # Export circles
-        self._export_circles(circles_coords)
-
-        axes, tilt = dm.generate_axis_cloud(
-            tree_vector,
-            config.expert.axis_downstep,
-            config.expert.axis_upstep,
-            config.basic.lower_limit,
-            config.basic.upper_limit,
-            config.expert.p_interval,
-        )
-
-        # Export axes
-        self._export_axes(axes, tilt)
-
-        dbh_values, tree_locations = dm.tree_locator(
-            sections,
-            X_c,
-            Y_c,
-            tree_vector,
-            sector_perct,
-            R,
-            outliers,
-            n_points_in,
-            config.expert.point_threshold,
-            X_field,
-            Y_field,
-            Z_field,
-        )
-
-        # Export tree locations
-        self._export_tree_locations(tree_locations, dbh_values)
+        results = {
+            "tree_vector": tree_vector,
+            "tree_heights": tree_heights,
+            "sections": sections,
+            "X_c": X_c,
+            "Y_c": Y_c,
+            "R": R,
+            "check_circle": check_circle,
+            "sector_perct": sector_perct,
+            "n_points_in": n_points_in,
+            "outliers": outliers,
+        }
+        # The per-tree results are kept for a later process_tail(...).
+        if cache.enabled:
+            cache.save(
+                "results",
+                self._results_key(input_digest),
+                **results,
+                cloud_size=cloud_size,
+                cloud_shape=cloud_shape,
+                area_warning=self.area_warning,
+            )
 
-        # -------------------------------------------------------------------------------------------------------------
-        # Exporting results
-        # -------------------------------------------------------------------------------------------------------------
+        self.instrumentation.start("results")
+        self._draw_and_export_results(**results, cloud_size=cloud_size, cloud_shape=cloud_shape)
+        self.instrumentation.end("results")
 
-        self._export_tabular_data(
-            config,
-            self.output_basepath,
-            X_c,
-            Y_c,
-            R,
-            check_circle,
-            sector_perct,
-            n_points_in,
-            sections,
-            outliers,
-            dbh_values,
-            tree_locations,
-            tree_heights,
-            cloud_size,
-            cloud_shape,
-        )
-        elapsed_las2 = timeit.default_timer() - t_las2
-        print("Total time:", "   %.2f" % elapsed_las2, "s")
+        # The config file marks a completed run, it is only written once every output is.
+        self.instrumentation.start("wait_for_exports")
+        self._wait_for_exports()
+        self.instrumentation.end("wait_for_exports")
 
         elapsed_t = timeit.default_timer() - t_t
 
         config.to_config_file(Path(str(self.output_basepath) + "_config.ini"))
+        self.instrumentation.end("process", trees=X_c.shape[0])
 
         # -------------------------------------------------------------------------------------------------------------
         print("---------------------------------------------")
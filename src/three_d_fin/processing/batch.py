@@ -0,0 +1,149 @@
+import contextlib
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Optional
+
+from three_d_fin.processing.configuration import FinConfiguration
+from three_d_fin.processing.progress import Progress
+
+LAS_SUFFIXES = (".las", ".laz")
+
+
+def collect_input_files(source: str) -> list[Path]:
+    """Collect the point clouds to process in batch mode.
+
+    Parameters
+    ----------
+    source : str
+        Either a directory (every LAS/LAZ file it contains is collected), a
+        manifest file (a text file listing one point cloud per line, blank lines
+        and lines starting with '#' are ignored, relative paths are resolved against
+        the manifest location), a single LAS/LAZ file or a glob pattern.
+
+    Returns
+    -------
+    input_files : list[Path]
+        The list of point clouds to process.
+
+    """
+    source_path = Path(source)
+    if source_path.is_dir():
+        return sorted(path for path in source_path.iterdir() if path.is_file() and path.suffix.lower() in LAS_SUFFIXES)
+    if source_path.is_file() and source_path.suffix.lower() in LAS_SUFFIXES:
+        return [source_path]
+    if source_path.is_file():
+        input_files = []
+        with source_path.open("r") as f:
+            for line in f:
+                entry = line.strip()
+                if entry == "" or entry.startswith("#"):
+                    continue
+                entry_path = Path(entry)
+                input_files.append(entry_path if entry_path.is_absolute() else source_path.parent / entry_path)
+        return input_files
+    # Otherwise it is a glob pattern, Path.glob only accepts relative patterns.
+    anchor = Path(source_path.anchor)
+    pattern = str(source_path.relative_to(anchor)) if source_path.is_absolute() else source
+    return sorted(path for path in anchor.glob(pattern) if path.suffix.lower() in LAS_SUFFIXES)
+
+
+def _init_worker(max_memory: Optional[int]) -> None:
+    """Initialize a batch worker process.
+
+    Limit the address space of the worker (RLIMIT_AS) to max_memory MiB, so a plot
+    that does not fit in memory fails with a MemoryError instead of taking the whole
+    node down. The address space also counts the memory that is mapped but not
+    resident (libraries, thread stacks, allocator arenas), it is thus larger than
+    the memory actually used. The limit relies on the resource module and is thus
+    not enforced on Windows.
+
+    Parameters
+    ----------
+    max_memory : Optional[int]
+        Address space limit of the worker in MiB, None means no limit.
+
+    """
+    if max_memory is None:
+        return
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = max_memory * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _process_plot(config: FinConfiguration) -> Optional[str]:
+    """Process a single plot in a worker process.
+
+    The console output of the processing (including progress bars and the
+    traceback of a failure) is redirected to a log file placed along the other
+    outputs of the plot.
+
+    Parameters
+    ----------
+    config : FinConfiguration
+        The configuration of the plot, the misc section holds the input file and
+        the output directory.
+
+    Returns
+    -------
+    error : Optional[str]
+        None if the plot was successfully processed, the error message otherwise.
+
+    """
+    from three_d_fin.processing.standalone_processing import StandaloneLASProcessing
+
+    fin_processing = StandaloneLASProcessing(config)
+    log_path = Path(str(fin_processing.output_basepath) + "_log.txt")
+    with log_path.open("w") as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        # The default progress bar writes to the console it was created with.
+        fin_processing.progress = Progress(output=log)
+        try:
+            fin_processing.process()
+        except MemoryError:
+            traceback.print_exc()
+            return "not enough memory"
+        except Exception as e:
+            traceback.print_exc()
+            return str(e)
+    return None
+
+
+def run_batch(
+    configs: list[FinConfiguration], n_workers: int, max_memory: Optional[int] = None
+) -> dict[Path, Optional[str]]:
+    """Process several plots across a pool of worker processes.
+
+    Parameters
+    ----------
+    configs : list[FinConfiguration]
+        One configuration per plot, the misc section of each one holds the input
+        file and the output directory of the plot.
+    n_workers : int
+        Number of worker processes, i.e. number of plots processed simultaneously.
+    max_memory : Optional[int]
+        Address space limit of each worker in MiB, None means no limit, see
+        _init_worker(...).
+
+    Returns
+    -------
+    errors : dict[Path, Optional[str]]
+        For each input file, None if it was successfully processed, the error
+        message otherwise.
+
+    """
+    errors: dict[Path, Optional[str]] = {}
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(max_memory,)) as executor:
+        futures = {executor.submit(_process_plot, config): config.misc.input_file for config in configs}
+        for future in as_completed(futures):
+            input_file = futures[future]
+            try:
+                errors[input_file] = future.result()
+            except BrokenProcessPool:
+                errors[input_file] = "worker process terminated abruptly"
+            status = "done" if errors[input_file] is None else f"failed ({errors[input_file]})"
+            print(f"[{len(errors)}/{len(futures)}] {input_file}: {status}")
+    return errors
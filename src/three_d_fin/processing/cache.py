@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+
+# Size of the blocks read while hashing a file.
+HASH_BLOCK_SIZE = 1 << 24
+
+
+def array_digest(*arrays: np.ndarray) -> str:
+    """Compute a content hash of numpy arrays.
+
+    Parameters
+    ----------
+    *arrays : np.ndarray
+        The arrays to hash.
+
+    Returns
+    -------
+    digest : str
+        Hexadecimal digest of the arrays shapes, types and content.
+
+    """
+    hasher = hashlib.blake2b(digest_size=20)
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        hasher.update(f"{array.shape}{array.dtype.str}".encode())
+        hasher.update(memoryview(array).cast("B"))
+    return hasher.hexdigest()
+
+
+class StageCache:
+    """On-disk cache for the results of the stages of the 3DFin algorithm.
+
+    Each stage result is stored as a .npz file named after the stage and a key.
+    Keys are hashes computed from the key of the stage input (the content hash of
+    the point cloud or the key of the previous stage) and from the parameters the
+    stage depends on. Changing a parameter thus only invalidates the stages that
+    depend on it, directly or through their inputs.
+
+    A cache without directory is disabled: nothing is ever loaded nor saved.
+    """
+
+    def __init__(self, cache_dir: Optional[Path]) -> None:
+        """Init the cache.
+
+        Parameters
+        ----------
+        cache_dir : Optional[Path]
+            Directory where the stage results are stored, None to disable the cache.
+
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+
+    @property
+    def enabled(self) -> bool:
+        """Whether the cache is enabled."""
+        return self.cache_dir is not None
+
+    @staticmethod
+    def key(parent_key: str, **parameters: Any) -> str:
+        """Compute the key of a stage.
+
+        Parameters
+        ----------
+        parent_key : str
+            The key of the stage input.
+        **parameters : Any
+            The parameters the stage depends on, they must be JSON serializable.
+
+        Returns
+        -------
+        key : str
+            The key of the stage.
+
+        """
+        payload = json.dumps({"parent": parent_key, "parameters": parameters}, sort_keys=True, default=str)
+        return hashlib.blake2b(payload.encode(), digest_size=20).hexdigest()
+
+    def _path(self, stage: str, key: str) -> Path:
+        return self.cache_dir / f"{stage}_{key}.npz"
+
+    def load(self, stage: str, key: str) -> Optional[dict[str, np.ndarray]]:
+        """Load the result of a stage.
+
+        Parameters
+        ----------
+        stage : str
+            Name of the stage.
+        key : str
+            Key of the stage.
+
+        Returns
+        -------
+        arrays : Optional[dict[str, np.ndarray]]
+            The arrays saved for this stage and key, None if the cache is disabled or
+            if there is no such entry (or if it is unreadable).
+
+        """
+        if not self.enabled:
+            return None
+        path = self._path(stage, key)
+        if not path.exists():
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+        except (OSError, ValueError):
+            return None
+        print(f"   Using cached {stage}")
+        return arrays
+
+    def save(self, stage: str, key: str, **arrays: np.ndarray) -> None:
+        """Save the result of a stage.
+
+        The entry is written in a temporary file first and then moved to its
+        final location, so an interrupted run never leaves a corrupted entry.
+
+        Parameters
+        ----------
+        stage : str
+            Name of the stage.
+        key : str
+            Key of the stage.
+        **arrays : np.ndarray
+            The arrays to save.
+
+        """
+        if not self.enabled:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=f".{stage}_", suffix=".npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            Path(tmp_path).replace(self._path(stage, key))
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    def file_digest(self, path: Path) -> str:
+        """Compute the content hash of a file.
+
+        Hashing a large point cloud takes some time, so digests are memoized in
+        the cache directory and reused as long as the size and modification time
+        of the file are unchanged.
+
+        Parameters
+        ----------
+        path : Path
+            The file to hash.
+
+        Returns
+        -------
+        digest : str
+            Hexadecimal digest of the file content.
+
+        """
+        path = Path(path).resolve()
+        stat = path.stat()
+        index_path = self.cache_dir / "digests.json" if self.enabled else None
+        index: dict[str, dict[str, Any]] = {}
+        if index_path is not None and index_path.exists():
+            try:
+                index = json.loads(index_path.read_text())
+            except ValueError:
+                index = {}
+        entry = index.get(str(path))
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["digest"]
+
+        hasher = hashlib.blake2b(digest_size=20)
+        with path.open("rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                hasher.update(block)
+        digest = hasher.hexdigest()
+
+        if index_path is not None:
+            index[str(path)] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "digest": digest}
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".digests_", suffix=".json")
+            with os.fdopen(fd, "w") as f:
+                json.dump(index, f)
+            Path(tmp_path).replace(index_path)
+        return digest
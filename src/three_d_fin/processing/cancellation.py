@@ -0,0 +1,53 @@
+import threading
+from typing import Any
+
+from three_d_fin.processing.instrumentation import StageSink
+
+
+class ProcessingCancelled(Exception):
+    """Raised in the processing thread when the processing was cancelled."""
+
+
+class CancellationToken(StageSink):
+    """Let another thread (e.g. the GUI) stop a running processing.
+
+    Cancellation is cooperative: once cancel() is called, the processing raises
+    a ProcessingCancelled exception at the start of its next stage, the token
+    being one of the sinks of its instrumentation, or at the next progress update
+    of the long running dendromatics functions. A cancelled token stays cancelled
+    until reset() is called.
+    """
+
+    def __init__(self) -> None:
+        """Init a token which is not cancelled."""
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether the cancellation was requested."""
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        """Request the cancellation, it can be called from any thread."""
+        self._event.set()
+
+    def reset(self) -> None:
+        """Clear the cancellation request, before a new run."""
+        self._event.clear()
+
+    def check(self) -> None:
+        """Raise a ProcessingCancelled exception if the cancellation was requested."""
+        if self._event.is_set():
+            raise ProcessingCancelled("The processing was cancelled")
+
+    def emit(self, event: dict[str, Any]) -> None:
+        """Stop the processing before a stage starts if the cancellation was requested.
+
+        Parameters
+        ----------
+        event : dict[str, Any]
+            The event, see StageSink documentation for its content.
+
+        """
+        if event["event"] == "start":
+            self.check()
@@ -3,6 +3,7 @@ from pathlib import Path
 from typing import Optional
 
 import laspy
+import numpy as np
 from pydantic.v1 import (
     BaseModel,
     DirectoryPath,
@@ -403,6 +404,17 @@ class ExpertParameters(BaseModel):
         gt=0,
         default=2,
     )
+    # Size of the (x, y) cells, relative to the cloth resolution, in which only the lowest
+    # point is given to the cloth simulation. 0 disables the reduction
+    ground_reduction: float = Field(
+        title="Ground reduction",
+        description="Size of the (x, y) cells, relative to the cloth resolution, in which only the lowest "
+        "point is kept to generate the DTM.\nThe cloth only rests on the lowest points, but low outliers "
+        "are kept as well: use it on clean or denoised clouds. 0 disables the reduction.",
+        ge=0,
+        le=1,
+        default=0.0,
+    )
 
 
 class MiscParameters(BaseModel):
@@ -429,6 +441,13 @@ class MiscParameters(BaseModel):
         "the data via scripting.",
         default=False,
     )
+    txt_precision: int = Field(
+        title="Precision of output txt files",
+        description="Number of digits after the decimal point of the values written in the txt files.",
+        ge=0,
+        le=12,
+        default=3,
+    )
     # input file is not mandatory and could be provided by another mean.
     input_file: Optional[FilePath] = Field(title="Input file", description="Input File (*.las, *.laz)", default=None)
     output_dir: DirectoryPath = Field(
@@ -436,6 +455,174 @@ class MiscParameters(BaseModel):
         description="output directory",
         default_factory=lambda: Path.home(),
     )
+    # The DTM is generated from the point cloud by default.
+    dtm_file: Optional[FilePath] = Field(
+        title="DTM file",
+        description="Digital Terrain Model used to normalize the point cloud, either the "
+        "_dtm.npy file of a previous run, which normalizes the point cloud exactly as that run, "
+        "a point cloud (*.las, *.laz) or an ESRI ASCII grid (*.asc). When set, the DTM "
+        "generation is skipped. Leave empty to generate the DTM from the point cloud.",
+        default=None,
+    )
+    # Stage cache is disabled by default.
+    cache_dir: Optional[Path] = Field(
+        title="Cache directory",
+        description="Directory where the results of the costly stages of the algorithm "
+        "(DTM, normalization, stems detection, individualization, sections) are cached. "
+        "When the algorithm is run again on the same point cloud, only the stages "
+        "whose parameters changed are recomputed. Leave empty to disable the cache.",
+        default=None,
+    )
+    # Tiled processing is disabled by default.
+    tile_size: Optional[float] = Field(
+        title="Tile size",
+        description="Size of the square (x, y) tiles in which the point cloud is split "
+        "in order to process clouds that do not fit in memory. Tiles are processed one "
+        "after the other and trees straddling tile edges are stitched together. "
+        "Leave empty to process the whole cloud at once.",
+        gt=0,
+        default=None,
+        hint="meters",
+    )
+    tile_buffer: float = Field(
+        title="Tile buffer",
+        description="Width of the overlap added around each tile. It should be large "
+        "enough to contain the trees whose stem lies close to the tile edges, a value "
+        "close to the maximum distance to the axes is advised.",
+        ge=0,
+        default=15.0,
+        hint="meters",
+    )
+    # Windowed loading is disabled by default.
+    windowed_loading: bool = Field(
+        title="Windowed loading",
+        description="Load at full resolution only the points of a normalized point cloud "
+        "that lie below the stripe and the highest section, and only one point per "
+        "individualization voxel above them (e.g. crowns). Results are unchanged, "
+        "memory usage and loading time are reduced for tall canopies. Ignored if the "
+        "point cloud is not normalized or if it is processed by tiles.",
+        default=False,
+    )
+    # laspy selects the LAZ backend by default.
+    laz_threads: Optional[int] = Field(
+        title="LAZ threads",
+        description="Number of threads used to decompress and compress LAZ files with "
+        "the lazrs backend, in parallel if greater than 1. Leave empty to let laspy "
+        "select the backend.",
+        ge=1,
+        default=None,
+    )
+    individualization_workers: int = Field(
+        title="Individualization workers",
+        description="Number of processes assigning the points to the tree axes in parallel "
+        "(step 2). The plot is split in (x, y) blocks, each one assigned to the axes that can "
+        "reach it (within the maximum distance to tree axis) by a worker process reading the "
+        "voxels from shared memory, results are unchanged. It pays off on large plots.",
+        ge=1,
+        default=1,
+    )
+    section_workers: int = Field(
+        title="Section workers",
+        description="Number of processes fitting the sections of the trees in parallel "
+        "(step 5). Trees are split in chunks fitted by worker processes reading the stem "
+        "points from shared memory, results are unchanged. Starting the workers takes a few "
+        "seconds, it pays off on plots with many trees.",
+        ge=1,
+        default=1,
+    )
+    output_laz: bool = Field(
+        title="Output LAZ files",
+        description="Write the point cloud outputs as compressed LAZ files instead of LAS files.",
+        default=False,
+    )
+    export_timings: bool = Field(
+        title="Export timings",
+        description="Write the wall time, CPU time, peak memory and number of points of each "
+        "stage of the algorithm in a JSON lines file (_timings.jsonl) next to the configuration file.",
+        default=False,
+    )
+    export_npz: bool = Field(
+        title="Export NPZ bundle",
+        description="Also write the section results, the tree locations and heights and the run metadata "
+        "as named arrays in a single uncompressed NumPy file (_results.npz), which can be loaded "
+        "without parsing text and memory-mapped (see three_d_fin.processing.io.load_results_bundle).",
+        default=False,
+    )
+    # Coordinates are processed as float64 by default.
+    compact_coordinates: bool = Field(
+        title="Compact coordinates",
+        description="Process the coordinates as single precision (float32) numbers relative "
+        "to a local origin of the plot, which is restored in the outputs. It lowers the "
+        "memory usage of the algorithm. The DTM and the normalized heights are computed in "
+        "double precision beforehand, the rest of the algorithm is approximate: a few points "
+        "may be assigned to another tree and the trees may differ by a few millimeters from "
+        "the ones computed in double precision.",
+        default=False,
+    )
+    # The memory budget is the memory available when the processing starts by default.
+    memory_budget: Optional[int] = Field(
+        title="Memory budget",
+        description="Memory the processing is allowed to use. Before the point cloud is "
+        "loaded, the peak memory of the algorithm is estimated from the point cloud header "
+        "and compared to this budget, see the memory strategy. Leave empty to use the "
+        "memory available on the machine.",
+        gt=0,
+        default=None,
+        hint="MiB",
+    )
+    memory_strategy: str = Field(
+        title="Memory strategy",
+        description="What to do when the estimated peak memory exceeds the memory budget: "
+        "'adapt' switches to windowed loading, which does not change the results, "
+        "'approximate' also switches to compact coordinates, then tiles, which change the "
+        "results marginally, 'refuse' stops before the point cloud is loaded and 'off' "
+        "disables the estimation. The processing is refused if no allowed execution fits.",
+        default="adapt",
+    )
+    checkpoints: str = Field(
+        title="Checkpoints",
+        description="Checkpoints of the stages of the algorithm, written in a _checkpoints "
+        "directory next to the outputs and removed once the run completes: 'on' writes them "
+        "from scratch, 'resume' continues an interrupted run from the checkpoints it left for "
+        "the same input and parameters, and keeps writing them, 'off' disables them. The stage "
+        "cache directory, if set, is used instead.",
+        default="off",
+    )
+
+    @validator("checkpoints")
+    def valid_checkpoints(cls, v: str):
+        """Validate checkpoints field, it should be one of on, resume or off."""
+        if v not in ("on", "resume", "off"):
+            raise ValueError("checkpoints should be one of 'on', 'resume' or 'off'")
+        return v
+
+    @validator("memory_strategy")
+    def valid_memory_strategy(cls, v: str):
+        """Validate memory_strategy field, it should be one of adapt, approximate, refuse or off."""
+        if v not in ("adapt", "approximate", "refuse", "off"):
+            raise ValueError("memory strategy should be one of 'adapt', 'approximate', 'refuse' or 'off'")
+        return v
+
+    @validator("dtm_file")
+    def valid_dtm_file(cls, v: Optional[FilePath]):
+        """Validate dtm_file field, it should be a .npy DTM, a las file or an ESRI ASCII grid."""
+        if v is None or v.suffix.lower() == ".asc":
+            return v
+        if v.suffix.lower() == ".npy":
+            try:
+                dtm = np.load(v.resolve(), mmap_mode="r")
+            except ValueError:
+                raise ValueError("invalid DTM file, it should be a _dtm.npy file of a previous run") from None
+            if dtm.ndim != 2 or dtm.shape[1] < 3:
+                raise ValueError("invalid DTM file, it should be a _dtm.npy file of a previous run")
+            return v
+        try:
+            laspy.open(v.resolve(), read_evlrs=False)
+        except laspy.LaspyException:
+            raise ValueError(
+                "invalid DTM file, it should be a .npy DTM, a las file or an ESRI ASCII grid (.asc)"
+            ) from None
+        return v
 
     @validator("input_file")
     def valid_input_las(cls, v: Optional[FilePath]):
@@ -557,7 +744,9 @@ class FinConfiguration(BaseModel):
             # We remove optional sections, it's not supported by the parser
             if parameter_dict["misc"] is None:
                 parameter_dict.pop("misc")
-            elif parameter_dict["misc"]["input_file"] is None:
-                parameter_dict["misc"].pop("input_file")
+            else:
+                parameter_dict["misc"] = {
+                    key: value for key, value in parameter_dict["misc"].items() if value is not None
+                }
             parser.read_dict(parameter_dict)
             parser.write(f)
@@ -0,0 +1,58 @@
+import numpy as np
+
+# Number of points located in the (x, y) cells at once, so that no temporary array
+# the size of the cloud is allocated.
+CHUNK_SIZE = 1_000_000
+
+
+def _cells(coords: np.ndarray, mins: np.ndarray, resolution: float, n_y: int) -> np.ndarray:
+    """Get the flat index of the (x, y) cell of each point."""
+    cell = np.floor((coords[:, 0:2] - mins) / resolution).astype(np.int64)
+    return cell[:, 0] * n_y + cell[:, 1]
+
+
+def _first_lowest(cell: np.ndarray, z: np.ndarray) -> np.ndarray:
+    """Get the index of the first lowest point of each occupied cell."""
+    _, cell_id = np.unique(cell, return_inverse=True)
+    cell_min = np.full(cell_id.max() + 1, np.inf)
+    np.minimum.at(cell_min, cell_id, z)
+    lowest = np.flatnonzero(z == cell_min[cell_id])
+    # Several points of a cell may lie at its lowest height.
+    _, first = np.unique(cell_id[lowest], return_index=True)
+    return lowest[first]
+
+
+def lowest_points(coords: np.ndarray, resolution: float) -> np.ndarray:
+    """Keep the lowest point of each (x, y) cell of the point cloud.
+
+    The cloth of the cloth simulation is only held up by the lowest points below
+    it, the other ones do not change the DTM. The cloud is thus reduced to a
+    single point per cell, with cells smaller than the cloth resolution. Ties are
+    resolved by keeping the first point of the cell. The lowest points of each
+    chunk of the cloud are selected first, then the lowest of them, so that only
+    occupied cells are ever stored.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        The point cloud, with (x), (y), (z) coordinates in the first three columns.
+    resolution : float
+        Size of the (x, y) cells, in meters.
+
+    Returns
+    -------
+    lowest : np.ndarray
+        The (x), (y), (z) coordinates of the lowest point of each non empty cell,
+        in the order of the point cloud.
+
+    """
+    mins = coords[:, 0:2].min(axis=0).astype(np.float64)
+    n_y = int(np.floor((coords[:, 1].max() - mins[1]) / resolution)) + 1
+    candidates = []
+    for start in range(0, coords.shape[0], CHUNK_SIZE):
+        chunk = coords[start : start + CHUNK_SIZE]
+        candidates.append(_first_lowest(_cells(chunk, mins, resolution, n_y), chunk[:, 2]) + start)
+    # Candidates are sorted by index so that ties are still resolved by the point order.
+    candidates = np.sort(np.concatenate(candidates))
+    lowest = candidates[_first_lowest(_cells(coords[candidates], mins, resolution, n_y), coords[candidates, 2])]
+    return coords[np.sort(lowest), 0:3].astype(np.float64, copy=False)
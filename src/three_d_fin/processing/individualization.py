@@ -0,0 +1,223 @@
+import contextlib
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context, shared_memory
+from typing import Optional
+
+import numpy as np
+
+# Number of blocks per worker, more blocks than workers balance the load of the
+# workers, blocks being of the same size but not holding the same number of voxels.
+BLOCKS_PER_WORKER = 4
+
+# Added to the reach of the axes when selecting the axes of a block, in meters, so
+# that rounding errors never leave out an axis.
+REACH_TOLERANCE = 0.01
+
+# Distance to the axis and tree ID of the voxels assigned to no axis, as in dendromatics.
+UNASSIGNED = 100000.0
+
+
+def block_grid(voxelated_cloud: np.ndarray, n_blocks: int) -> tuple[np.ndarray, np.ndarray]:
+    """Split the voxels in a grid of (x, y) blocks of the same size.
+
+    Parameters
+    ----------
+    voxelated_cloud : np.ndarray
+        The voxels, (x), (y) coordinates are stored in the first and second columns.
+    n_blocks : int
+        Approximate number of blocks, the grid follows the aspect ratio of the cloud.
+
+    Returns
+    -------
+    order : np.ndarray
+        Indexes sorting the voxels by block.
+    block_bounds : np.ndarray
+        Bounds of the blocks in the sorted voxels, the voxels of the i-th block are
+        order[block_bounds[i] : block_bounds[i + 1]]. Blocks may be empty.
+
+    """
+    mins = voxelated_cloud[:, 0:2].min(axis=0)
+    extent = np.maximum(voxelated_cloud[:, 0:2].max(axis=0) - mins, 1e-6)
+    n_x = max(int(np.ceil(np.sqrt(n_blocks * extent[0] / extent[1]))), 1)
+    n_y = max(int(np.ceil(n_blocks / n_x)), 1)
+    shape = np.array([n_x, n_y])
+    cell = np.minimum(((voxelated_cloud[:, 0:2] - mins) / (extent / shape)).astype(np.int64), shape - 1)
+    block = cell[:, 0] * n_y + cell[:, 1]
+    order = np.argsort(block, kind="stable")
+    block_bounds = np.searchsorted(block[order], np.arange(n_x * n_y + 1))
+    return order, block_bounds
+
+
+def axes_in_reach(tree_vector: np.ndarray, block: np.ndarray, d_max: float) -> np.ndarray:
+    """Select the axes which could be closer than d_max to a voxel of a block.
+
+    At a given height, a point closer than d_max to an axis lies within d_max / cos(tilt)
+    of the (x, y) location of the axis at that height. The axes are thus selected by
+    the bounding box of their (x, y) course between the lowest and the highest voxels
+    of the block, grown by that distance. It is the overlap between the blocks, d_max
+    for vertical axes.
+
+    Parameters
+    ----------
+    tree_vector : np.ndarray
+        The axes, as described by dendromatics.compute_axes(...): tree ID, PCA1 (x),
+        (y), (z) values and stem centroid (x), (y), (z) values.
+    block : np.ndarray
+        The voxels of the block, with (x), (y), (z) coordinates.
+    d_max : float
+        Points that are closer than d_max to an axis are assigned to that axis.
+
+    Returns
+    -------
+    in_reach : np.ndarray
+        Whether each axis is in reach of the block.
+
+    """
+    direction = tree_vector[:, 1:4]
+    centroid = tree_vector[:, 4:7]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = direction[:, 0:2] / direction[:, 2:3]
+        reach = d_max / np.abs(direction[:, 2]) + REACH_TOLERANCE
+    low = centroid[:, 0:2] + slope * (block[:, 2].min() - centroid[:, 2:3])
+    high = centroid[:, 0:2] + slope * (block[:, 2].max() - centroid[:, 2:3])
+    course_min = np.minimum(low, high) - reach[:, np.newaxis]
+    course_max = np.maximum(low, high) + reach[:, np.newaxis]
+    # Horizontal axes (or NaN courses) are kept.
+    return ~np.any((course_max < block[:, 0:2].min(axis=0)) | (course_min > block[:, 0:2].max(axis=0)), axis=1)
+
+
+def _assign_block(
+    buffer_name: str, n_voxels: int, start: int, stop: int, clust_stripe: np.ndarray, parameters: tuple
+) -> tuple[np.ndarray, np.ndarray]:
+    """Assign the voxels of a block to the axes of its stems in a worker process.
+
+    The sorted voxels are read from the shared memory block named buffer_name, the
+    block holds its rows start to stop (excluded).
+    """
+    import dendromatics as dm
+
+    buffer = shared_memory.SharedMemory(name=buffer_name)
+    voxels = np.ndarray((n_voxels, 3), dtype=np.float64, buffer=buffer.buf)
+    try:
+        _, dist_to_axis, tree_id_vector = dm.compute_axes(
+            voxels[start:stop], clust_stripe, *parameters, 0, 1, 2, Z0_field=3, tree_id_field=-1
+        )
+        return dist_to_axis, tree_id_vector
+    finally:
+        # See sections._fit_shared_chunk(...).
+        del voxels
+        with contextlib.suppress(BufferError):
+            buffer.close()
+
+
+def compute_axes(
+    voxelated_cloud: np.ndarray,
+    clust_stripe: np.ndarray,
+    parameters: tuple,
+    n_workers: int = 1,
+    progress_hook: Optional[Callable[[int, int], None]] = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Identify the tree axes and assign the voxels to them, by blocks across a pool of processes.
+
+    Results are the same as the ones of dendromatics.compute_axes(...), which
+    computes the distance of every voxel to every axis. The axes are first computed
+    from the stripe alone. The voxels are then split in (x), (y) blocks, each one
+    assigned by a worker process to the axes in reach of it (see axes_in_reach(...)),
+    in the same order as dendromatics does so that ties are resolved alike, the
+    other axes being farther than d_max from every voxel of the block. The voxels are
+    placed once in a shared memory block read by the worker processes. Tree IDs are
+    the IDs of the stripe clusters, they are thus consistent across the blocks.
+
+    Parameters
+    ----------
+    voxelated_cloud : np.ndarray
+        The voxelated point cloud, with (x), (y), (z) coordinates.
+    clust_stripe : np.ndarray
+        The clusterized stripe, with (x), (y), (z), z0 coordinates and the cluster
+        ID in the last column.
+    parameters : tuple
+        Positional parameters of dendromatics.compute_axes(...) following the
+        stripe: stripe lower limit, stripe upper limit, h_range, min_points and
+        d_max.
+    n_workers : int
+        Number of worker processes, dendromatics.compute_axes(...) is called on
+        the whole cloud in the current process if it is 1. Defaults to 1.
+    progress_hook : Optional[Callable[[int, int], None]]
+        Called with the number of assigned blocks and the number of blocks (or
+        the number of processed stems and the number of stems in the current
+        process). It may raise an exception to stop the assignment. Defaults to None.
+
+    Returns
+    -------
+    tree_vector : np.ndarray
+        Description of each tree, see dendromatics.compute_axes(...).
+    dist_to_axis : np.ndarray
+        Distance from each voxel to its closest axis.
+    tree_id_vector : np.ndarray
+        Tree ID of each voxel.
+
+    """
+    import dendromatics as dm
+
+    # (x), (y), (z) coordinates are the first three columns of the voxels and of the stripe.
+    if n_workers <= 1:
+        return dm.compute_axes(
+            voxelated_cloud,
+            clust_stripe,
+            *parameters,
+            0,
+            1,
+            2,
+            Z0_field=3,
+            tree_id_field=-1,
+            progress_hook=progress_hook,
+        )
+
+    # The axes only depend on the stripe, a single voxel is assigned to them.
+    tree_vector, _, _ = dm.compute_axes(
+        voxelated_cloud[0:1], clust_stripe, *parameters, 0, 1, 2, Z0_field=3, tree_id_field=-1
+    )
+    dist_to_axis = np.full(voxelated_cloud.shape[0], UNASSIGNED)
+    tree_id_vector = np.full(voxelated_cloud.shape[0], UNASSIGNED)
+    order, block_bounds = block_grid(voxelated_cloud, n_workers * BLOCKS_PER_WORKER)
+    sorted_voxels = voxelated_cloud[order].astype(np.float64, copy=False)
+    blocks = []
+    for i in range(block_bounds.shape[0] - 1):
+        start, stop = block_bounds[i], block_bounds[i + 1]
+        if start == stop:
+            continue
+        in_reach = axes_in_reach(tree_vector, sorted_voxels[start:stop], parameters[4])
+        if np.any(in_reach):
+            blocks.append((start, stop, clust_stripe[np.isin(clust_stripe[:, -1], tree_vector[in_reach, 0])]))
+    if progress_hook is not None:
+        progress_hook(0, len(blocks))
+    if len(blocks) == 0:
+        return tree_vector, dist_to_axis, tree_id_vector
+
+    buffer = shared_memory.SharedMemory(create=True, size=sorted_voxels.nbytes)
+    # See sections.compute_sections(...) for the spawned workers.
+    executor = ProcessPoolExecutor(max_workers=min(n_workers, len(blocks)), mp_context=get_context("spawn"))
+    try:
+        shared_voxels = np.ndarray(sorted_voxels.shape, dtype=np.float64, buffer=buffer.buf)
+        shared_voxels[:] = sorted_voxels
+        del shared_voxels, sorted_voxels
+        futures = {
+            executor.submit(
+                _assign_block, buffer.name, voxelated_cloud.shape[0], start, stop, block_stripe, parameters
+            ): (start, stop)
+            for start, stop, block_stripe in blocks
+        }
+        for n_assigned, future in enumerate(as_completed(futures), start=1):
+            start, stop = futures[future]
+            block_dist, block_tree_id = future.result()
+            dist_to_axis[order[start:stop]] = block_dist
+            tree_id_vector[order[start:stop]] = block_tree_id
+            if progress_hook is not None:
+                progress_hook(n_assigned, len(blocks))
+    finally:
+        # See sections.compute_sections(...).
+        executor.shutdown(wait=False, cancel_futures=True)
+        buffer.close()
+        buffer.unlink()
+    return tree_vector, dist_to_axis, tree_id_vector
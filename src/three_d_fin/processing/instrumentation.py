@@ -0,0 +1,188 @@
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None
+
+
+def peak_rss() -> Optional[int]:
+    """Get the peak resident set size of the process.
+
+    Returns
+    -------
+    peak_rss : Optional[int]
+        The peak resident set size in bytes, None if it is not available on
+        the platform.
+
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is expressed in bytes on macOS and in kilobytes elsewhere.
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class StageSink:
+    """Consume the events emitted by an Instrumentation object.
+
+    Events are dictionaries with the following keys:
+    - "event": either "start" or "end".
+    - "stage": the name of the stage.
+    - "timestamp": the time of the event, in seconds since the epoch.
+    - "points_in": the number of points given to the stage, None if not relevant.
+    End events also have the following keys:
+    - "points_out": the number of points produced by the stage, None if not relevant.
+    - "wall_time": the duration of the stage in seconds.
+    - "cpu_time": the CPU time used by the process during the stage, in seconds.
+    - "peak_rss": the peak resident set size of the process at the end of the stage,
+    in bytes, None if not available.
+    - "peak_rss_delta": the increase of the peak resident set size during the stage,
+    in bytes, None if not available.
+    And any additional information given by the stage.
+
+    Default implementation does nothing, implementers should override emit(...).
+    """
+
+    def emit(self, event: dict[str, Any]) -> None:
+        """Consume an event.
+
+        Parameters
+        ----------
+        event : dict[str, Any]
+            The event, see the class documentation for its content.
+
+        """
+        pass
+
+
+class JSONLinesSink(StageSink):
+    """Write the events in a JSON lines file, one event per line."""
+
+    path: Path
+
+    def __init__(self, path: Path) -> None:
+        """Init the sink, the file is truncated.
+
+        Parameters
+        ----------
+        path : Path
+            The path of the JSON lines file.
+
+        """
+        self.path = Path(path)
+        self.path.write_text("")
+
+    def emit(self, event: dict[str, Any]) -> None:
+        """Append the event to the file.
+
+        Parameters
+        ----------
+        event : dict[str, Any]
+            The event, see StageSink documentation for its content.
+
+        """
+        # The file is not kept open, so events are on disk even if the run is interrupted.
+        with self.path.open("a") as f:
+            f.write(json.dumps(event) + "\n")
+
+
+class Instrumentation:
+    """Measure the stages of the 3DFin algorithm and emit the measures to sinks.
+
+    Stages are identified by their name, start(...) and end(...) should be called
+    around each of them. Stages can be nested or run in different threads, as long
+    as their names are distinct.
+    """
+
+    sinks: list[StageSink]
+
+    def __init__(self) -> None:
+        """Init the instrumentation without any sink."""
+        self.sinks = []
+        self._started: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink: StageSink) -> None:
+        """Add a sink that will receive the next events.
+
+        Parameters
+        ----------
+        sink : StageSink
+            The sink to add.
+
+        """
+        with self._lock:
+            self.sinks.append(sink)
+
+    def remove_sink(self, sink: StageSink) -> None:
+        """Remove a sink, if present.
+
+        Parameters
+        ----------
+        sink : StageSink
+            The sink to remove.
+
+        """
+        with self._lock:
+            if sink in self.sinks:
+                self.sinks.remove(sink)
+
+    def _emit(self, event: dict[str, Any]) -> None:
+        with self._lock:
+            for sink in self.sinks:
+                sink.emit(event)
+
+    def start(self, stage: str, points_in: Optional[int] = None) -> None:
+        """Signal the start of a stage.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage.
+        points_in : Optional[int]
+            The number of points given to the stage, None if not relevant.
+
+        """
+        self._started[stage] = {
+            "points_in": points_in,
+            "wall_time": time.perf_counter(),
+            "cpu_time": time.process_time(),
+            "peak_rss": peak_rss(),
+        }
+        self._emit({"event": "start", "stage": stage, "timestamp": time.time(), "points_in": points_in})
+
+    def end(self, stage: str, points_out: Optional[int] = None, **info: Any) -> None:
+        """Signal the end of a stage.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage, it must have been started.
+        points_out : Optional[int]
+            The number of points produced by the stage, None if not relevant.
+        **info : Any
+            Additional information about the stage, they must be JSON serializable.
+
+        """
+        started = self._started.pop(stage)
+        end_peak_rss = peak_rss()
+        self._emit(
+            {
+                "event": "end",
+                "stage": stage,
+                "timestamp": time.time(),
+                "points_in": started["points_in"],
+                "points_out": points_out,
+                "wall_time": time.perf_counter() - started["wall_time"],
+                "cpu_time": time.process_time() - started["cpu_time"],
+                "peak_rss": end_peak_rss,
+                "peak_rss_delta": end_peak_rss - started["peak_rss"] if end_peak_rss is not None else None,
+                **info,
+            }
+        )
@@ -1,10 +1,50 @@
+import json
+import os
+import struct
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import TYPE_CHECKING, Optional
 
+import laspy
 import numpy as np
-import pandas as pd
 
 from three_d_fin.processing.configuration import FinConfiguration
 
+if TYPE_CHECKING:
+    import xlsxwriter
+
+# Number of text files of the tabular data written at once.
+TXT_WRITERS = 4
+
+# Number of points read at once while streaming a point cloud.
+CHUNK_SIZE = 5_000_000
+
+
+def select_laz_backend(laz_threads: Optional[int]) -> Optional[laspy.LazBackend]:
+    """Select the backend used to decompress and compress LAZ files.
+
+    The lazrs parallel backend runs on a global thread pool whose size is read
+    from the RAYON_NUM_THREADS environment variable when it is first used, the
+    thread count is thus only taken into account until the first LAZ file is
+    read or written by the process.
+
+    Parameters
+    ----------
+    laz_threads : Optional[int]
+        Number of threads, None to let laspy select the backend.
+
+    Returns
+    -------
+    laz_backend : Optional[laspy.LazBackend]
+        The backend to give to laspy, None for laspy default selection.
+
+    """
+    if laz_threads is None:
+        return None
+    os.environ["RAYON_NUM_THREADS"] = str(laz_threads)
+    return laspy.LazBackend.LazrsParallel if laz_threads > 1 else laspy.LazBackend.Lazrs
+
 
 def export_tabular_data(
     config: FinConfiguration,
@@ -23,7 +63,7 @@ def export_tabular_data(
     cloud_size: int,
     cloud_shape: int,
 ):
-    """Export tabular data in XLSX or TXT.
+    """Export tabular data in XLSX or TXT, and in a NPZ bundle if requested.
 
     Parameters
     ----------
@@ -94,40 +134,6 @@ def export_tabular_data(
         # 0: does not pass quality check - 1: passes quality checks
         quality = np.where(mask, quality, 1)
 
-        # Function to convert data to pandas DataFrames
-        def to_pandas(data):
-            # Covers np.arrays of shape == 2 (almost every case)
-            if len(data.shape) == 2:
-                df = pd.DataFrame(
-                    data=data,
-                    index=["T" + str(i + 1) for i in range(data.shape[0])],
-                    columns=["S" + str(i + 1) for i in range(data.shape[1])],
-                )
-
-            # Covers np.arrays of shape == 1 (basically, data regarding the normalized height of every section).
-            if len(data.shape) == 1:
-                df = pd.DataFrame(data=data).transpose()
-                df.index = ["Z0"]
-                df.columns = ["S" + str(i + 1) for i in range(data.shape[0])]
-
-            return df
-
-        # Converting data to pandas DataFrames for ease to output them as excel files.
-        df_diameters = to_pandas(R) * 2
-        df_X_c = to_pandas(X_c)
-        df_Y_c = to_pandas(Y_c)
-        df_sections = to_pandas(sections)
-        df_quality = to_pandas(quality)
-        df_outliers = to_pandas(outliers)
-        df_sector_perct = to_pandas(sector_perct)
-        df_n_points_in = to_pandas(n_points_in)
-
-        df_dbh_and_heights = pd.DataFrame(
-            data=dbh_and_heights,
-            index=["T" + str(i + 1) for i in range(dbh_values.shape[0])],
-            columns=["TH", "DBH", "X", "Y"],
-        )
-
         # Description to be added to each excel sheet.
         info_diameters = """Diameter of every section (S) of every tree (T).
             Units are meters.
@@ -154,118 +160,345 @@ def export_tabular_data(
         """
         info_cloud_size = f"This cloud has {cloud_size} million points and its area is {cloud_shape} m2"
 
-        # Converting descriptions to pandas DataFrames for ease to include them in the excel file.
-        df_info_diameters = pd.Series(info_diameters)
-        df_info_X_c = pd.Series(info_X_c)
-        df_info_Y_c = pd.Series(info_Y_c)
-        df_info_sections = pd.Series(info_sections)
-        df_info_quality = pd.Series(info_quality)
-        df_info_outliers = pd.Series(info_outliers)
-        df_info_sector_perct = pd.Series(info_sector_perct)
-        df_info_n_points_in = pd.Series(info_n_points_in)
-        df_info_dbh_and_heights = pd.Series(info_dbh_and_heights)
-        df_info_cloud_size = pd.Series(info_cloud_size)
-
-        xls_filename = str(basepath_output) + ".xlsx"
-
-        # Creating an instance of a excel writer
-        writer = pd.ExcelWriter(xls_filename, engine="xlsxwriter")
-
-        # Writing the descriptions
-
-        df_info_dbh_and_heights.to_excel(
-            writer,
-            sheet_name="Plot Metrics",
-            header=False,
-            index=False,
-            merge_cells=False,
-        )
+        import xlsxwriter
+
+        # Sheets are written row by row, in constant memory.
+        with xlsxwriter.Workbook(str(basepath_output) + ".xlsx", {"constant_memory": True}) as workbook:
+            _write_sheet(
+                workbook,
+                "Plot Metrics",
+                [info_dbh_and_heights, info_cloud_size],
+                dbh_and_heights,
+                columns=["TH", "DBH", "X", "Y"],
+            )
+            _write_sheet(workbook, "Diameters", [info_diameters], R * 2)
+            _write_sheet(workbook, "X", [info_X_c], X_c)
+            _write_sheet(workbook, "Y", [info_Y_c], Y_c)
+            _write_sheet(workbook, "Sections", [info_sections], sections)
+            _write_sheet(workbook, "Q(Overall Quality 0-1)", [info_quality], quality)
+            _write_sheet(workbook, "Q1(Outlier Probability)", [info_outliers], outliers)
+            _write_sheet(workbook, "Q2(Sector Occupancy)", [info_sector_perct], sector_perct)
+            _write_sheet(workbook, "Q3(Points Inner Circle)", [info_n_points_in], n_points_in)
 
-        df_info_cloud_size.to_excel(
-            writer,
-            sheet_name="Plot Metrics",
-            startrow=1,
-            header=False,
-            index=False,
-            merge_cells=False,
+    else:
+        precision = config.misc.txt_precision if config.misc is not None else 3
+        txt_outputs = {
+            "_diameters.txt": R * 2,
+            "_X_c.txt": X_c,
+            "_Y_c.txt": Y_c,
+            "_check_circle.txt": check_circle,
+            "_n_points_in.txt": n_points_in,
+            "_sector_perct.txt": sector_perct,
+            "_outliers.txt": outliers,
+            "_dbh_and_heights.txt": dbh_and_heights,
+            "_sections.txt": np.column_stack(sections),
+        }
+        # Files are formatted and written concurrently, numpy releases the GIL on large arrays.
+        with ThreadPoolExecutor(max_workers=TXT_WRITERS, thread_name_prefix="3DFin_txt") as executor:
+            futures = [
+                executor.submit(write_txt, str(basepath_output) + suffix, data, precision)
+                for suffix, data in txt_outputs.items()
+            ]
+        for future in futures:
+            future.result()
+
+    if config.misc is not None and config.misc.export_npz:
+        export_results_bundle(
+            config,
+            basepath_output,
+            X_c=X_c,
+            Y_c=Y_c,
+            R=R,
+            check_circle=check_circle,
+            sector_perct=sector_perct,
+            n_points_in=n_points_in,
+            sections=sections,
+            outliers=outliers,
+            dbh_values=dbh_values,
+            tree_locations=tree_locations,
+            tree_heights=tree_heights,
+            cloud_size=cloud_size,
+            cloud_shape=cloud_shape,
         )
 
-        df_info_diameters.to_excel(
-            writer,
-            sheet_name="Diameters",
-            header=False,
-            index=False,
-            merge_cells=False,
-        )
 
-        df_info_X_c.to_excel(writer, sheet_name="X", header=False, index=False, merge_cells=False)
+def write_txt(txt_file: Path, data: np.ndarray, precision: int = 3):
+    """Write a matrix in a text file, values being formatted in fixed point notation.
 
-        df_info_Y_c.to_excel(writer, sheet_name="Y", header=False, index=False, merge_cells=False)
+    The output is the one of numpy.savetxt(txt_file, data, fmt=f"%.{precision}f"),
+    but values are formatted all at once with integer arithmetic in a buffer of
+    characters, instead of one by one through Python string formatting. Values
+    that are not finite, too large, or close to a rounding tie are formatted by
+    Python, so that they are rounded exactly as printf would.
 
-        df_info_sections.to_excel(
-            writer,
-            sheet_name="Sections",
-            header=False,
-            index=False,
-            merge_cells=False,
-        )
+    Parameters
+    ----------
+    txt_file : Path
+        Path of the text file.
+    data : numpy.ndarray
+        Matrix to write, one row per line. A vector is written as a column.
+    precision : int
+        Number of digits after the decimal point.
 
-        df_info_quality.to_excel(
-            writer,
-            sheet_name="Q(Overall Quality 0-1)",
-            header=False,
-            index=False,
-            merge_cells=False,
-        )
+    """
+    data = np.asarray(data, dtype=np.float64)
+    if data.ndim == 1:
+        data = data.reshape(-1, 1)
+    if data.size == 0:
+        Path(txt_file).write_bytes(b"")
+        return
+    values = data.ravel()
+    scaled = np.abs(values) * 10.0**precision
+    with np.errstate(invalid="ignore"):
+        # The scaled value is within half a unit in the last place of the exact one, the
+        # rounding of values closer to a tie depends on their exact decimal expansion.
+        python_formatted = ~(scaled < 2.0**52) | (np.abs(scaled - np.floor(scaled) - 0.5) <= 4 * np.spacing(scaled))
+    scaled[python_formatted] = 0.0
+    rounded = np.rint(scaled).astype(np.int64)
+    integer_part, fractional_part = np.divmod(rounded, 10**precision)
+
+    # Characters of each value, right-aligned in a field of fixed width: sign, integer
+    # digits, decimal point, fractional digits and a separator.
+    integer_digits = 1 + np.searchsorted(10 ** np.arange(1, 19, dtype=np.int64), integer_part, side="right")
+    lengths = np.signbit(values) + integer_digits + (precision + 1 if precision > 0 else 0)
+    fallback = {i: b"%.*f" % (precision, values[i]) for i in np.flatnonzero(python_formatted)}
+    lengths[python_formatted] = [len(string) for string in fallback.values()]
+    width = int(lengths.max(initial=1)) + 1
+    chars = np.full((values.shape[0], width), ord(" "), dtype=np.uint8)
+    # Separators: a space between the values of a row, a new line at the end of each row.
+    chars[:, -1] = ord(" ")
+    chars.reshape(data.shape[0], -1)[:, -1] = ord("\n")
+
+    column = width - 2
+    for _ in range(precision):
+        fractional_part, digit = np.divmod(fractional_part, 10)
+        chars[:, column] = ord("0") + digit
+        column -= 1
+    if precision > 0:
+        chars[:, column] = ord(".")
+        column -= 1
+    # Integer digits, then the sign in front of the most significant one. Leading zeros
+    # are written too, they are dropped along with the padding.
+    for position in range(int(integer_digits.max())):
+        integer_part, digit = np.divmod(integer_part, 10)
+        chars[:, column - position] = ord("0") + digit
+    negative = np.flatnonzero(np.signbit(values))
+    chars[negative, column - integer_digits[negative]] = ord("-")
+
+    for i, string in fallback.items():
+        chars[i, width - 1 - len(string) : width - 1] = np.frombuffer(string, dtype=np.uint8)
+    keep = np.arange(width) >= (width - 1 - lengths)[:, np.newaxis]
+    with Path(txt_file).open("wb") as txt:
+        txt.write(chars[keep].tobytes())
+
+
+def _write_sheet(
+    workbook: "xlsxwriter.Workbook",
+    sheet_name: str,
+    descriptions: list[str],
+    data: np.ndarray,
+    columns: Optional[list[str]] = None,
+):
+    """Write a description and a matrix of results in a new XLSX sheet.
 
-        df_info_outliers.to_excel(
-            writer,
-            sheet_name="Q1(Outlier Probability)",
-            header=False,
-            index=False,
-            merge_cells=False,
-        )
+    Descriptions are written in the first rows, the matrix below them, one row
+    per tree (T1, T2...) and one column per section (S1, S2...) unless column
+    names are given. A vector is written as a single row (Z0). Cells are written
+    in row order, as required by the constant memory mode of xlsxwriter. NaN
+    values are left blank and infinite values written as text, as pandas does.
 
-        df_info_sector_perct.to_excel(
-            writer,
-            sheet_name="Q2(Sector Occupancy)",
-            header=False,
-            index=False,
-            merge_cells=False,
-        )
+    Parameters
+    ----------
+    workbook : xlsxwriter.Workbook
+        The workbook to write into.
+    sheet_name : str
+        Name of the new sheet.
+    descriptions : list[str]
+        Descriptions of the data, one per row.
+    data : numpy.ndarray
+        The matrix, or vector, to write.
+    columns : Optional[list[str]]
+        Names of the columns of the matrix.
 
-        df_info_n_points_in.to_excel(
-            writer,
-            sheet_name="Q3(Points Inner Circle)",
-            header=False,
-            index=False,
-            merge_cells=False,
-        )
+    """
+    worksheet = workbook.add_worksheet(sheet_name)
+    for row, description in enumerate(descriptions):
+        worksheet.write_string(row, 0, description)
+
+    if data.ndim == 1:
+        data = data.reshape(1, -1)
+        labels = ["Z0"]
+    else:
+        labels = ["T" + str(i + 1) for i in range(data.shape[0])]
+    if columns is None:
+        columns = ["S" + str(i + 1) for i in range(data.shape[1])]
+
+    worksheet.write_row(2, 2, columns)
+    finite = np.isfinite(data)
+    for i, label in enumerate(labels):
+        row = i + 3
+        values = data[i].tolist()
+        worksheet.write_string(row, 1, label)
+        if finite[i].all():
+            worksheet.write_row(row, 2, values)
+            continue
+        for j, value in enumerate(values):
+            if np.isinf(value):
+                worksheet.write_string(row, j + 2, "inf" if value > 0 else "-inf")
+            elif not np.isnan(value):
+                worksheet.write_number(row, j + 2, value)
+
+
+def export_results_bundle(
+    config: FinConfiguration,
+    basepath_output: Path,
+    cloud_size: float,
+    cloud_shape: int,
+    **results: np.ndarray,
+) -> Path:
+    """Export the results in a single NPZ bundle.
+
+    Arrays are stored uncompressed and at full precision under their name, along
+    with a "metadata" JSON string holding the 3DFin version, the size and the
+    area of the cloud and the configuration of the run. Unlike the XLSX and TXT
+    outputs, the bundle can be loaded without parsing text and memory-mapped
+    (see load_results_bundle(...)).
+
+    Parameters
+    ----------
+    config : FinConfiguration
+        A valid FinConfiguration instance.
+    basepath_output : Path
+        A valid output path. it ends with a file base name (no extension).
+    cloud_size : float
+        Number of point in the cloud (in M points)
+    cloud_shape : int
+        Area of the cloud in :math: m^2
+    **results : np.ndarray
+        The arrays to export, see export_tabular_data(...).
 
-        # Writing the data
-        df_dbh_and_heights.to_excel(writer, sheet_name="Plot Metrics", startrow=2, startcol=1)
-        df_diameters.to_excel(writer, sheet_name="Diameters", startrow=2, startcol=1)
-        df_X_c.to_excel(writer, sheet_name="X", startrow=2, startcol=1)
-        df_Y_c.to_excel(writer, sheet_name="Y", startrow=2, startcol=1)
-        df_sections.to_excel(writer, sheet_name="Sections", startrow=2, startcol=1)
-        df_quality.to_excel(writer, sheet_name="Q(Overall Quality 0-1)", startrow=2, startcol=1)
-        df_outliers.to_excel(writer, sheet_name="Q1(Outlier Probability)", startrow=2, startcol=1)
-        df_sector_perct.to_excel(writer, sheet_name="Q2(Sector Occupancy)", startrow=2, startcol=1)
-        df_n_points_in.to_excel(writer, sheet_name="Q3(Points Inner Circle)", startrow=2, startcol=1)
+    Returns
+    -------
+    bundle_path : Path
+        Path of the written bundle.
 
-        writer.close()
+    """
+    from three_d_fin import __about__
 
-    else:
-        np.savetxt(str(basepath_output) + "_diameters.txt", R * 2, fmt=("%.3f"))
-        np.savetxt(str(basepath_output) + "_X_c.txt", X_c, fmt=("%.3f"))
-        np.savetxt(str(basepath_output) + "_Y_c.txt", Y_c, fmt=("%.3f"))
-        np.savetxt(str(basepath_output) + "_check_circle.txt", check_circle, fmt=("%.3f"))
-        np.savetxt(str(basepath_output) + "_n_points_in.txt", n_points_in, fmt=("%.3f"))
-        np.savetxt(str(basepath_output) + "_sector_perct.txt", sector_perct, fmt=("%.3f"))
-        np.savetxt(str(basepath_output) + "_outliers.txt", outliers, fmt=("%.3f"))
-        np.savetxt(str(basepath_output) + "_dbh_and_heights.txt", dbh_and_heights, fmt=("%.3f"))
-        np.savetxt(
-            str(basepath_output) + "_sections.txt",
-            np.column_stack(sections),
-            fmt=("%.3f"),
-        )
+    metadata = {
+        "version": __about__.__version__,
+        "cloud_size": float(cloud_size),
+        "cloud_shape": float(cloud_shape),
+        "config": json.loads(config.json()),
+    }
+    bundle_path = Path(str(basepath_output) + "_results.npz")
+    np.savez(bundle_path, metadata=np.array(json.dumps(metadata)), **results)
+    return bundle_path
+
+
+# Readers of the header of the .npy formats which can be memory-mapped.
+_NPY_HEADER_READERS = {
+    (1, 0): np.lib.format.read_array_header_1_0,
+    (2, 0): np.lib.format.read_array_header_2_0,
+}
+
+
+def load_results_bundle(bundle_path: Path, mmap: bool = False) -> tuple[dict[str, np.ndarray], dict]:
+    """Load a NPZ bundle written by export_results_bundle(...).
+
+    Parameters
+    ----------
+    bundle_path : Path
+        Path of the bundle.
+    mmap : bool
+        If True, arrays are memory-mapped read-only instead of being read in memory.
+
+    Returns
+    -------
+    results : dict[str, np.ndarray]
+        The arrays of the bundle, by name.
+    metadata : dict
+        The metadata of the bundle.
+
+    """
+    results = {}
+    with zipfile.ZipFile(bundle_path) as bundle, Path(bundle_path).open("rb") as bundle_file:
+        for info in bundle.infolist():
+            name = info.filename.removesuffix(".npy")
+            if mmap and name != "metadata" and info.compress_type == zipfile.ZIP_STORED:
+                # The array data follows the local header of the member and its .npy header.
+                bundle_file.seek(info.header_offset)
+                local_header = bundle_file.read(zipfile.sizeFileHeader)
+                name_length, extra_length = struct.unpack("<HH", local_header[26:30])
+                bundle_file.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+                read_header = _NPY_HEADER_READERS.get(np.lib.format.read_magic(bundle_file))
+                if read_header is not None:
+                    shape, fortran_order, dtype = read_header(bundle_file)
+                    # Empty arrays cannot be memory-mapped.
+                    if np.prod(shape) > 0 and not dtype.hasobject:
+                        results[name] = np.memmap(
+                            bundle_file,
+                            dtype=dtype,
+                            mode="r",
+                            offset=bundle_file.tell(),
+                            shape=shape,
+                            order="F" if fortran_order else "C",
+                        )
+                        continue
+            with bundle.open(info) as member:
+                results[name] = np.lib.format.read_array(member, allow_pickle=False)
+    metadata = json.loads(str(results.pop("metadata")))
+    return results, metadata
+
+
+def load_dtm(dtm_file: Path) -> np.ndarray:
+    """Load a Digital Terrain Model from a point cloud or a raster file.
+
+    Supported formats are the full precision DTM of a previous run (_dtm.npy),
+    LAS/LAZ point clouds and ESRI ASCII grids (.asc), for which the center of
+    each valid cell is used as a DTM point.
+
+    Parameters
+    ----------
+    dtm_file : Path
+        Path to the DTM file.
+
+    Returns
+    -------
+    dtm : np.ndarray
+        A numpy array of shape (n, 3) where n is the number of points in the DTM.
+        (x), (y) and (z) coordinates are stored in the first, second,
+        third columns respectively.
+
+    """
+    dtm_file = Path(dtm_file)
+    if dtm_file.suffix.lower() == ".asc":
+        return _load_esri_ascii_grid(dtm_file)
+    if dtm_file.suffix.lower() == ".npy":
+        return np.asarray(np.load(dtm_file)[:, 0:3], dtype=np.float64)
+    dtm = laspy.read(str(dtm_file.resolve()))
+    return np.vstack((dtm.x, dtm.y, dtm.z)).transpose()
+
+
+def _load_esri_ascii_grid(grid_file: Path) -> np.ndarray:
+    """Load an ESRI ASCII grid as a (n, 3) array of cell centers, no data cells are dropped."""
+    header: dict[str, float] = {}
+    with grid_file.open("r") as f:
+        for line in f:
+            key, value = line.split()[0:2]
+            # The header ends with the first line of values.
+            if not key[0].isalpha():
+                break
+            header[key.lower()] = float(value)
+    n_cols = int(header["ncols"])
+    n_rows = int(header["nrows"])
+    cell_size = header["cellsize"]
+    # Lower left corner is either given as a cell corner or as a cell center.
+    x_0 = header["xllcenter"] if "xllcenter" in header else header["xllcorner"] + cell_size / 2.0
+    y_0 = header["yllcenter"] if "yllcenter" in header else header["yllcorner"] + cell_size / 2.0
+
+    z = np.loadtxt(grid_file, skiprows=len(header), ndmin=2).reshape(n_rows, n_cols)
+    # First row is the northernmost one.
+    x, y = np.meshgrid(x_0 + np.arange(n_cols) * cell_size, y_0 + np.arange(n_rows)[::-1] * cell_size)
+    valid = z != header["nodata_value"] if "nodata_value" in header else np.ones(z.shape, dtype=bool)
+    return np.c_[x[valid], y[valid], z[valid]]
@@ -0,0 +1,271 @@
+import contextlib
+import os
+import sys
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from three_d_fin.processing.configuration import FinConfiguration
+from three_d_fin.processing.io import CHUNK_SIZE
+
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None
+
+# Memory used by the interpreter and the libraries, in bytes.
+BASE_MEMORY = 200 * 1024 * 1024
+
+# Bytes per point of the temporary arrays of the stages, on top of the loaded cloud and of
+# its coordinates. They were calibrated on synthetic plots (see benchmarks/run_benchmark.py)
+# and are meant to give an order of magnitude, not an exact figure.
+CLOUD_SHAPE_BYTES = 56  # Voxelation of the cloud.
+DTM_BYTES = 48  # Cloth simulation.
+INDIVIDUALIZATION_BYTES = 115  # Voxelation of the cloud, voxels and distances to the axes.
+INDIVIDUALIZATION_BLOCKS_BYTES = 32  # Shared copy of the voxels sorted by block, with parallel workers.
+# Bytes per point of the stripe and per point below the highest section, which are only
+# a fraction of the cloud.
+STRIPE_BYTES = 150
+STEMS_BYTES = 110
+
+# Smallest tile size tried when looking for tiles that fit in the memory budget, in meters.
+MIN_TILE_SIZE = 10.0
+
+# Share of an address space limit kept for the mappings that are not resident, e.g. the stacks
+# and the allocator arenas of the worker threads, which the estimates do not account for.
+ADDRESS_SPACE_HEADROOM = 0.25
+
+
+class MemoryBudgetError(MemoryError):
+    """Raised when the processing of a point cloud is not expected to fit in the memory budget."""
+
+
+class CloudSummary:
+    """Number of points and extent of a point cloud, as known before loading it."""
+
+    def __init__(self, point_count: int, mins: np.ndarray, maxs: np.ndarray, record_size: int) -> None:
+        """Init the cloud summary.
+
+        Parameters
+        ----------
+        point_count : int
+            Number of points of the cloud.
+        mins : np.ndarray
+            The minimum (x), (y), (z) coordinates.
+        maxs : np.ndarray
+            The maximum (x), (y), (z) coordinates.
+        record_size : int
+            Size of a point once loaded by the provider of the cloud, in bytes.
+            0 if the cloud is already loaded.
+
+        """
+        self.point_count = int(point_count)
+        self.mins = np.asarray(mins, dtype=np.float64)
+        self.maxs = np.asarray(maxs, dtype=np.float64)
+        self.record_size = int(record_size)
+
+    @property
+    def area(self) -> float:
+        """Area of the (x, y) bounding box of the cloud, in m^2."""
+        return max(float(np.prod(self.maxs[0:2] - self.mins[0:2])), 1.0)
+
+    @property
+    def height(self) -> float:
+        """Height of the cloud, in meters."""
+        return max(float(self.maxs[2] - self.mins[2]), 1.0)
+
+
+class MemoryEstimate:
+    """Estimated peak memory of each stage of the algorithm."""
+
+    def __init__(self, stages: dict[str, int]) -> None:
+        """Init the memory estimate.
+
+        Parameters
+        ----------
+        stages : dict[str, int]
+            The estimated peak memory of each stage, in bytes.
+
+        """
+        self.stages = stages
+
+    @property
+    def peak(self) -> int:
+        """Estimated peak memory of the whole algorithm, in bytes."""
+        return max(self.stages.values())
+
+    @property
+    def peak_stage(self) -> str:
+        """Stage where the peak memory is expected."""
+        return max(self.stages, key=self.stages.__getitem__)
+
+    def __str__(self) -> str:
+        """Describe the peak memory and the stage where it is expected."""
+        return f"{self.peak / 1024**2:.0f} MiB ({self.peak_stage} stage)"
+
+
+def _fraction(low: float, high: float, height: float) -> float:
+    """Get the fraction of the points of a cloud between two heights, assuming they are evenly spread."""
+    return min(max((high - low) / height, 0.0), 1.0)
+
+
+def estimate_memory(cloud: CloudSummary, config: FinConfiguration) -> MemoryEstimate:
+    """Estimate the peak memory of each stage of the algorithm.
+
+    The estimation only relies on the number of points and on the extent of the
+    cloud, points are assumed to be evenly spread along the (z) axis to estimate
+    the size of the stripe and of the stems. When the cloud is processed by tiles,
+    the estimation is the one of the processing of a single tile.
+
+    Parameters
+    ----------
+    cloud : CloudSummary
+        The point cloud to process.
+    config : FinConfiguration
+        The configuration of the processing.
+
+    Returns
+    -------
+    estimate : MemoryEstimate
+        The estimated peak memory of each stage.
+
+    """
+    misc = config.misc
+    height = cloud.height
+    n_points = cloud.point_count
+    # Points kept in memory alongside the coordinates, by the provider of the cloud.
+    held_points = n_points
+    # Points read at once while streaming the cloud.
+    chunk = min(n_points, CHUNK_SIZE) * cloud.record_size * 2
+    stages = {}
+    if misc.tile_size is not None:
+        # The tile and its buffer are expected to hold their share of the points.
+        tile_width = misc.tile_size + 2 * misc.tile_buffer
+        n_points = int(n_points * min(tile_width**2 / cloud.area, 1.0))
+        held_points = n_points
+        stages["split"] = BASE_MEMORY + chunk
+    elif misc.is_normalized and misc.windowed_loading:
+        # Points above the window are thinned to one point per individualization voxel.
+        window_height = max(config.basic.upper_limit, config.advanced.maximum_height + config.advanced.section_wid, 0.5)
+        # The (x, y) resolution of the individualization voxels is res_z, their (z) resolution res_xy.
+        voxels = cloud.area / config.expert.res_z**2 * max(height - window_height, 0.0) / config.expert.res_xy
+        above = n_points * (1.0 - _fraction(0.0, window_height, height))
+        n_points = int(n_points - above + min(above, voxels))
+        held_points = 0
+        stages["windowed_loading"] = BASE_MEMORY + n_points * 32 + chunk
+
+    held = BASE_MEMORY + held_points * cloud.record_size
+    # Coordinates are extracted as float64, they are then converted in compact mode.
+    coords = n_points * (16 if misc.compact_coordinates else 32)
+    stages["load"] = held + n_points * 32 + (n_points * 16 if misc.compact_coordinates else n_points * 8)
+    stages["cloud_shape"] = held + coords + n_points * CLOUD_SHAPE_BYTES
+    if not misc.is_normalized:
+        # The DTM is computed from the float64 coordinates.
+        stages["dtm"] = held + n_points * 32 + (0 if misc.dtm_file is not None else n_points * DTM_BYTES)
+    stripe_points = n_points * _fraction(config.basic.lower_limit, config.basic.upper_limit, height)
+    stages["stripe"] = held + coords + int(stripe_points * STRIPE_BYTES)
+    stages["individualization"] = held + coords + n_points * INDIVIDUALIZATION_BYTES
+    if misc.individualization_workers > 1:
+        stages["individualization"] += n_points * INDIVIDUALIZATION_BLOCKS_BYTES
+    # The tree IDs and the distances to the axes of the points, and the enriched cloud
+    # which is written while the stems are computed.
+    stem_points = n_points * _fraction(0.0, config.advanced.maximum_height + config.advanced.section_wid, height)
+    assignment = n_points * (8 if misc.compact_coordinates else 12)
+    stages["stems"] = held + coords + assignment + int(stem_points * STEMS_BYTES) + chunk
+    return MemoryEstimate(stages)
+
+
+def available_memory() -> Optional[int]:
+    """Get the memory available to the process.
+
+    It is the memory available on the machine, capped by the address space
+    limit of the process if any (e.g. the --max_memory option of the batch
+    subcommand). The estimates are resident memory while the limit applies to
+    every mapping of the process, so only the limit minus a headroom (see
+    ADDRESS_SPACE_HEADROOM) and minus the mappings of the process that are not
+    resident is considered available.
+
+    Returns
+    -------
+    available_memory : Optional[int]
+        The available memory in bytes, None if it is not known on the platform.
+
+    """
+    available = None
+    # Linux.
+    with contextlib.suppress(OSError), Path("/proc/meminfo").open() as meminfo:
+        for line in meminfo:
+            if line.startswith("MemAvailable:"):
+                available = int(line.split()[1]) * 1024
+                break
+    if available is None and sys.platform == "win32":
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [
+                ("dwLength", ctypes.c_ulong),
+                ("dwMemoryLoad", ctypes.c_ulong),
+                ("ullTotalPhys", ctypes.c_ulonglong),
+                ("ullAvailPhys", ctypes.c_ulonglong),
+                ("ullTotalPageFile", ctypes.c_ulonglong),
+                ("ullAvailPageFile", ctypes.c_ulonglong),
+                ("ullTotalVirtual", ctypes.c_ulonglong),
+                ("ullAvailVirtual", ctypes.c_ulonglong),
+                ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+            ]
+
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            available = status.ullAvailPhys
+    if available is None and hasattr(os, "sysconf"):
+        # macOS does not expose the available pages, the physical memory is used instead.
+        pages = "SC_AVPHYS_PAGES" if "SC_AVPHYS_PAGES" in os.sysconf_names else "SC_PHYS_PAGES"
+        with contextlib.suppress(ValueError, OSError):
+            available = os.sysconf(pages) * os.sysconf("SC_PAGE_SIZE")
+    if resource is not None:
+        limit, _ = resource.getrlimit(resource.RLIMIT_AS)
+        if limit != resource.RLIM_INFINITY:
+            ceiling = _address_space_ceiling(limit)
+            available = ceiling if available is None else min(available, ceiling)
+    return available
+
+
+def _address_space_ceiling(limit: int) -> int:
+    """Get the resident memory that fits in an address space limit, see available_memory()."""
+    ceiling = int(limit * (1.0 - ADDRESS_SPACE_HEADROOM))
+    # Linux, the libraries and the reserved memory already mapped by the process.
+    with contextlib.suppress(OSError, ValueError, KeyError), Path("/proc/self/status").open() as status:
+        sizes = {line.split(":")[0]: int(line.split()[1]) * 1024 for line in status if line.startswith("Vm")}
+        ceiling -= max(sizes["VmSize"] - sizes["VmRSS"], 0)
+    return max(ceiling, 0)
+
+
+def fit_tile_size(cloud: CloudSummary, config: FinConfiguration, budget: int) -> Optional[float]:
+    """Find a tile size such that the processing of each tile fits in a memory budget.
+
+    Tile sizes are halved from the size of the cloud down to MIN_TILE_SIZE.
+
+    Parameters
+    ----------
+    cloud : CloudSummary
+        The point cloud to process.
+    config : FinConfiguration
+        The configuration of the processing, its tile size is ignored.
+    budget : int
+        The memory budget, in bytes.
+
+    Returns
+    -------
+    tile_size : Optional[float]
+        The largest tile size tried that fits in the budget, None if none fits.
+
+    """
+    tile_size = float(np.ceil(max(cloud.maxs[0:2] - cloud.mins[0:2]) / 2.0))
+    while tile_size >= MIN_TILE_SIZE:
+        misc = config.misc.copy(update={"tile_size": tile_size})
+        if estimate_memory(cloud, config.copy(update={"misc": misc})).peak <= budget:
+            return tile_size
+        tile_size = float(np.floor(tile_size / 2.0))
+    return None
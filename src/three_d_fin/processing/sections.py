@@ -0,0 +1,284 @@
+import contextlib
+from collections.abc import Callable, Sequence
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context, shared_memory
+from typing import Optional
+
+import numpy as np
+
+# Number of chunks of trees per worker, more chunks than workers balance the load
+# of the workers when some chunks are slower to fit than others.
+CHUNKS_PER_WORKER = 4
+
+# Columns of the stems used to fit the sections: (x), (y), z0 and tree ID.
+STEM_COLUMNS = [0, 1, 3, 4]
+
+# Number of points whose selection is computed at once by gather_stems(...).
+SELECTION_CHUNK_SIZE = 1_000_000
+
+# Results of dendromatics.compute_sections(...) kept by the processing.
+SECTION_RESULTS = ("X_c", "Y_c", "R", "check_circle", "sector_perct", "n_points_in")
+
+# Results of a section holding too few points to be fitted, as given by dendromatics.fit_circle_check(...):
+# no circle and a check_circle value of 2.
+UNFITTED_SECTION = (0.0, 0.0, 0.0, 2.0, 0.0, 0.0)
+
+
+def gather_stems(
+    coords: np.ndarray,
+    tree_id: np.ndarray,
+    dist_axes: np.ndarray,
+    max_dist: float,
+    min_height: float,
+    max_height: float,
+) -> np.ndarray:
+    """Gather the points close to the tree axes, tree by tree.
+
+    Points are selected chunk by chunk, so no mask the size of the cloud is built,
+    and their indexes are sorted by tree ID before being gathered: the points of
+    each tree are contiguous (see partition_trees(...)), in the order of the cloud.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        The individualized cloud, with (x), (y), (z), z0 coordinates.
+    tree_id : np.ndarray
+        Tree ID of each point.
+    dist_axes : np.ndarray
+        Distance of each point to the axis of its tree.
+    max_dist : float
+        Points closer than max_dist to their axis are gathered.
+    min_height : float
+        Points whose z0 is above min_height are gathered.
+    max_height : float
+        Points whose z0 is below max_height are gathered.
+
+    Returns
+    -------
+    stems : np.ndarray
+        The (x), (y), (z), z0 coordinates, tree ID and distance to axis of the
+        gathered points, in double precision, sorted by tree ID.
+
+    """
+    index = []
+    for start in range(0, coords.shape[0], SELECTION_CHUNK_SIZE):
+        stop = start + SELECTION_CHUNK_SIZE
+        selected = dist_axes[start:stop] < max_dist
+        selected &= coords[start:stop, 3] > min_height
+        selected &= coords[start:stop, 3] < max_height
+        index.append(np.flatnonzero(selected) + start)
+    index = np.concatenate(index) if len(index) > 0 else np.empty(0, dtype=np.int64)
+    index = index[np.argsort(tree_id[index], kind="stable")]
+    stems = np.empty((index.shape[0], 6))
+    for column in range(4):
+        stems[:, column] = coords[index, column]
+    stems[:, 4] = tree_id[index]
+    stems[:, 5] = dist_axes[index]
+    return stems
+
+
+def partition_trees(tree_id: np.ndarray, n_chunks: int) -> tuple[Optional[np.ndarray], np.ndarray, np.ndarray]:
+    """Partition points by tree and group the trees in contiguous chunks.
+
+    Parameters
+    ----------
+    tree_id : np.ndarray
+        Tree ID of each point.
+    n_chunks : int
+        Maximum number of chunks, chunks hold about the same number of points.
+
+    Returns
+    -------
+    order : Optional[np.ndarray]
+        Indexes sorting the points by tree ID, None if they are already sorted
+        (e.g. by gather_stems(...)). The sort is stable, points of a tree keep their
+        relative order.
+    tree_bounds : np.ndarray
+        Bounds of the trees in the sorted points (offsets of a compressed sparse row
+        layout), the points of the i-th tree (in increasing tree ID order) are the
+        sorted points tree_bounds[i] to tree_bounds[i + 1] (excluded).
+    chunk_bounds : np.ndarray
+        Bounds of the chunks in the trees, the i-th chunk holds the trees
+        chunk_bounds[i] to chunk_bounds[i + 1] (excluded).
+
+    """
+    order = None if np.all(tree_id[1:] >= tree_id[:-1]) else np.argsort(tree_id, kind="stable")
+    sorted_tree_id = tree_id if order is None else tree_id[order]
+    if tree_id.shape[0] == 0:
+        tree_bounds = np.zeros(1, dtype=np.int64)
+    else:
+        tree_starts = np.flatnonzero(sorted_tree_id[1:] != sorted_tree_id[:-1]) + 1
+        tree_bounds = np.r_[0, tree_starts, tree_id.shape[0]]
+    n_trees = tree_bounds.shape[0] - 1
+    # A chunk ends at the first tree starting after its share of the points.
+    targets = np.arange(1, n_chunks) * (tree_id.shape[0] / n_chunks)
+    chunk_bounds = np.unique(np.r_[0, np.searchsorted(tree_bounds[:-1], targets, side="right"), n_trees])
+    return order, tree_bounds, chunk_bounds
+
+
+def _fit_chunk(
+    stems: np.ndarray,
+    sections: np.ndarray,
+    parameters: tuple,
+    progress_hook: Optional[Callable[[int, int], None]],
+    fields: Sequence[int] = STEM_COLUMNS,
+) -> list[np.ndarray]:
+    """Fit the sections of a chunk of trees, sorted by tree ID.
+
+    Fields are the STEM_COLUMNS columns of stems. Results are the ones of
+    dendromatics.compute_sections(...), which scans every point of a tree for each
+    section and fits every section. Here the points of a tree are sorted by z0 once,
+    the points of each section are found by binary search and only the sections
+    holding more than n_points_section points are fitted, with the points in the order
+    of the stems as dendromatics does. The other sections, e.g. the ones above the top
+    of the stem, would not be fitted by dendromatics.fit_circle_check(...) and get
+    UNFITTED_SECTION results.
+    """
+    import dendromatics as dm
+
+    x_field, y_field, z0_field, tree_id_field = fields
+    section_width, n_points_section = parameters[0], parameters[6]
+    _, tree_bounds, _ = partition_trees(stems[:, tree_id_field], 1)
+    n_trees = tree_bounds.shape[0] - 1
+    results = np.empty((len(SECTION_RESULTS), n_trees, sections.shape[0]))
+    results[:] = np.array(UNFITTED_SECTION)[:, np.newaxis, np.newaxis]
+    # Same operation as dendromatics to get the same upper bounds.
+    section_tops = sections + section_width
+    if progress_hook is not None:
+        progress_hook(0, n_trees)
+    for tree in range(n_trees):
+        tree_points = stems[tree_bounds[tree] : tree_bounds[tree + 1]]
+        by_height = np.argsort(tree_points[:, z0_field], kind="stable")
+        z0 = tree_points[by_height, z0_field]
+        # Points of a section lie between its bottom (included) and its top (excluded).
+        first = np.searchsorted(z0, sections, side="left")
+        last = np.searchsorted(z0, section_tops, side="left")
+        for section in np.flatnonzero(last - first > n_points_section):
+            in_section = np.sort(by_height[first[section] : last[section]])
+            X_c, Y_c, R, check_circle, _, sector_perct, n_points_in = dm.fit_circle_check(
+                tree_points[in_section, x_field], tree_points[in_section, y_field], 0, 0, *parameters[1:]
+            )
+            results[:, tree, section] = (X_c, Y_c, R, check_circle, sector_perct, n_points_in)
+        if progress_hook is not None:
+            progress_hook(tree + 1, n_trees)
+    return list(results)
+
+
+def _fit_shared_chunk(
+    buffer_name: str, n_points: int, start: int, stop: int, sections: np.ndarray, parameters: tuple
+) -> list[np.ndarray]:
+    """Fit the sections of a chunk of trees in a worker process.
+
+    The sorted stems are read from the shared memory block named buffer_name, the
+    chunk holds its rows start to stop (excluded).
+    """
+    buffer = shared_memory.SharedMemory(name=buffer_name)
+    stems = np.ndarray((n_points, len(STEM_COLUMNS)), dtype=np.float64, buffer=buffer.buf)
+    try:
+        return _fit_chunk(stems[start:stop], sections, parameters, None, range(len(STEM_COLUMNS)))
+    finally:
+        # The block can only be closed once no array refers to it, which is not the
+        # case if the fitting raised (its traceback still refers to the chunk), the
+        # block is then closed when the worker exits.
+        del stems
+        with contextlib.suppress(BufferError):
+            buffer.close()
+
+
+def compute_sections(
+    stems: np.ndarray,
+    sections: np.ndarray,
+    parameters: tuple,
+    n_workers: int = 1,
+    progress_hook: Optional[Callable[[int, int], None]] = None,
+) -> dict[str, np.ndarray]:
+    """Fit the sections of every tree, tree by tree chunks across a pool of processes.
+
+    Results are the same as the ones of dendromatics.compute_sections(...): trees
+    are independent, the points are partitioned by tree ID (unless they already are,
+    see gather_stems(...)) and the trees are fitted by chunks of consecutive IDs. Each
+    chunk only scans its own points, instead of every stem point being scanned for
+    every tree, and only fits the sections holding enough points (see _fit_chunk(...)),
+    sections above the top of a stem are skipped. With more than one worker, the
+    sorted points are placed once in a shared memory block read by the worker
+    processes, instead of being pickled to each of them. The rows of the results
+    follow the increasing tree ID order, as dendromatics does.
+
+    Parameters
+    ----------
+    stems : np.ndarray
+        Points of the stems, with (x), (y), (z), z0 and tree ID fields.
+    sections : np.ndarray
+        Heights of the sections.
+    parameters : tuple
+        Positional parameters of dendromatics.compute_sections(...) following the
+        sections (section width, times_R, threshold, R_min, R_max...).
+    n_workers : int
+        Number of worker processes, the chunks are fitted in the current process
+        if it is 1. Defaults to 1.
+    progress_hook : Optional[Callable[[int, int], None]]
+        Called with the number of fitted trees and the number of trees, after
+        each chunk (and after each tree in the current process). It may raise
+        an exception to stop the fitting. Defaults to None.
+
+    Returns
+    -------
+    results : dict[str, np.ndarray]
+        The X_c, Y_c, R, check_circle, sector_perct and n_points_in matrices,
+        with one row per tree and one column per section.
+
+    """
+    order, tree_bounds, chunk_bounds = partition_trees(stems[:, 4], max(n_workers, 1) * CHUNKS_PER_WORKER)
+    n_trees = tree_bounds.shape[0] - 1
+    # Trees are fitted on slices of the stems if they are already sorted by tree.
+    sorted_stems = stems if order is None else stems[order]
+    chunks = [(tree_bounds[chunk_bounds[i]], tree_bounds[chunk_bounds[i + 1]]) for i in range(len(chunk_bounds) - 1)]
+    results = [np.zeros((n_trees, sections.shape[0]), dtype=np.float64) for _ in SECTION_RESULTS]
+    if progress_hook is not None:
+        progress_hook(0, n_trees)
+
+    if n_workers <= 1 or len(chunks) <= 1:
+        for chunk_index, (start, stop) in enumerate(chunks):
+            first_tree = chunk_bounds[chunk_index]
+
+            def chunk_hook(count: int, total: int, first_tree: int = first_tree) -> None:
+                if progress_hook is not None:
+                    progress_hook(first_tree + count, n_trees)
+
+            chunk_results = _fit_chunk(sorted_stems[start:stop], sections, parameters, chunk_hook)
+            for i, chunk_result in enumerate(chunk_results):
+                results[i][first_tree : chunk_bounds[chunk_index + 1]] = chunk_result
+        return {name: results[i] for i, name in enumerate(SECTION_RESULTS)}
+
+    buffer = shared_memory.SharedMemory(create=True, size=max(stems.shape[0] * len(STEM_COLUMNS) * 8, 1))
+    # Worker processes are spawned rather than forked: the processing may run while
+    # export threads or a GUI are running, which forked processes do not support.
+    executor = ProcessPoolExecutor(max_workers=min(n_workers, len(chunks)), mp_context=get_context("spawn"))
+    try:
+        shared_stems = np.ndarray((stems.shape[0], len(STEM_COLUMNS)), dtype=np.float64, buffer=buffer.buf)
+        for i, column in enumerate(STEM_COLUMNS):
+            shared_stems[:, i] = sorted_stems[:, column]
+        del shared_stems, sorted_stems
+        futures = {
+            executor.submit(
+                _fit_shared_chunk, buffer.name, stems.shape[0], start, stop, sections, parameters
+            ): chunk_index
+            for chunk_index, (start, stop) in enumerate(chunks)
+        }
+        n_fitted = 0
+        for future in as_completed(futures):
+            chunk_index = futures[future]
+            first_tree, last_tree = chunk_bounds[chunk_index], chunk_bounds[chunk_index + 1]
+            for i, chunk_result in enumerate(future.result()):
+                results[i][first_tree:last_tree] = chunk_result
+            n_fitted += last_tree - first_tree
+            if progress_hook is not None:
+                progress_hook(n_fitted, n_trees)
+    finally:
+        # On error (or cancellation), the chunks not started yet are dropped and the
+        # running ones are not waited for, the block stays mapped in their processes
+        # until they are done.
+        executor.shutdown(wait=False, cancel_futures=True)
+        buffer.close()
+        buffer.unlink()
+    return {name: results[i] for i, name in enumerate(SECTION_RESULTS)}
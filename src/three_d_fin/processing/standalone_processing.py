@@ -1,14 +1,22 @@
+from collections.abc import Iterator
+from copy import deepcopy
 from pathlib import Path
+from typing import Optional
 
 import laspy
 import numpy as np
 
 from three_d_fin.processing.abstract_processing import FinProcessing
+from three_d_fin.processing.cache import StageCache
+from three_d_fin.processing.io import CHUNK_SIZE, select_laz_backend
+from three_d_fin.processing.memory import CloudSummary
 
 
 class StandaloneLASProcessing(FinProcessing):
     """Implement the FinProcessing interface for LAS files in a standalone context."""
 
+    export_workers = 4
+
     def _construct_output_path(self):
         basename_las = Path(self.config.misc.input_file).stem if self.config.misc.input_file is not None else "3DFin"
         self.output_basepath = Path(self.config.misc.output_dir) / Path(basename_las)
@@ -17,26 +25,89 @@ class StandaloneLASProcessing(FinProcessing):
         """Check for already computed data in target directory."""
         any_of = super().check_already_computed_data()
         # Check existence of las output.
-        any_of |= Path(str(self.output_basepath) + "_dtm_points.las").exists()
-        any_of |= Path(str(self.output_basepath) + "_stripe.las").exists()
-        any_of |= Path(str(self.output_basepath) + "_tree_ID_dist_axes.las").exists()
-        any_of |= Path(str(self.output_basepath) + "_tree_heights.las").exists()
-        any_of |= Path(str(self.output_basepath) + "_circ.las").exists()
-        any_of |= Path(str(self.output_basepath) + "_axes.las").exists()
-        any_of |= Path(str(self.output_basepath) + "_tree_locator.las").exists()
+        for suffix in (
+            "_dtm_points",
+            "_stripe",
+            "_tree_ID_dist_axes",
+            "_tree_heights",
+            "_circ",
+            "_axes",
+            "_tree_locator",
+        ):
+            any_of |= Path(self._get_output_path(suffix)).exists()
+        any_of |= Path(str(self.output_basepath) + "_dtm.npy").exists()
 
         return any_of
 
+    def _get_output_path(self, suffix: str) -> str:
+        """Get the path of a point cloud output, as a LAS or a LAZ file depending on the configuration."""
+        extension = ".laz" if self.config.misc.output_laz else ".las"
+        return str(self.output_basepath) + suffix + extension
+
+    def _get_laz_backend(self) -> Optional[laspy.LazBackend]:
+        """Get the backend used to read and write LAZ files, see three_d_fin.processing.io.select_laz_backend."""
+        return select_laz_backend(self.config.misc.laz_threads)
+
     def _pre_processing_hook(self):
         pass
 
     def _post_processing_hook(self):
         pass
 
+    def _process_tiled(self):
+        """Run the 3DFin algorithm tile by tile, see three_d_fin.processing.tiling for more details."""
+        from three_d_fin.processing.tiling import process_tiled
+
+        process_tiled(self)
+
+    def _is_windowed(self) -> bool:
+        """Whether the cloud is loaded through a WindowedCloud, see three_d_fin.processing.windowed."""
+        return self.config.misc.windowed_loading and self.config.misc.is_normalized
+
+    def _get_window_height(self) -> float:
+        """Get the normalized height below which every point is used by the algorithm.
+
+        It covers the stripe, the stems and their sections, and the ground used to
+        compute the area of the plot.
+        """
+        return max(
+            self.config.basic.upper_limit,
+            self.config.advanced.maximum_height + self.config.advanced.section_wid,
+            0.5,
+        )
+
+    def _get_cloud_summary(self) -> CloudSummary:
+        with laspy.open(self.config.misc.input_file.resolve(), read_evlrs=False) as reader:
+            header = reader.header
+        # Windowed loading does not keep the points, see estimate_memory(...).
+        return CloudSummary(header.point_count, header.mins, header.maxs, header.point_format.size)
+
     def _load_base_cloud(self):
-        self.base_cloud = laspy.read(str(self.config.misc.input_file.resolve()))
+        if self._is_windowed():
+            from three_d_fin.processing.windowed import WindowedCloud
+
+            self.base_cloud = WindowedCloud(
+                self.config.misc.input_file.resolve(),
+                self.config.basic.z0_name,
+                self._get_window_height(),
+                # As in dendromatics.individualize_trees, res_z is the (x, y) resolution of the
+                # individualization voxels and res_xy their (z) resolution, see FinProcessing._process().
+                self.config.expert.res_z,
+                self.config.expert.res_xy,
+                self._get_laz_backend(),
+            )
+            print(
+                "   Windowed loading kept",
+                "{:.2f}".format(self.base_cloud.coords.shape[0] / 1000000),
+                "million points out of",
+                "{:.2f}".format(self.base_cloud.point_count / 1000000),
+            )
+            return
+        self.base_cloud = laspy.read(str(self.config.misc.input_file.resolve()), laz_backend=self._get_laz_backend())
 
     def _get_xyz_z0_from_base(self) -> np.ndarray:
+        if self._is_windowed():
+            return self.base_cloud.coords
         return np.vstack(
             (
                 self.base_cloud.x,
@@ -47,12 +118,40 @@ class StandaloneLASProcessing(FinProcessing):
         ).transpose()
 
     def _get_xyz_from_base(self) -> np.ndarray:
-        return np.vstack((self.base_cloud.x, self.base_cloud.y, self.base_cloud.z)).transpose()
+        xyz = np.zeros((len(self.base_cloud.points), 4))
+        xyz[:, 0] = self.base_cloud.x
+        xyz[:, 1] = self.base_cloud.y
+        xyz[:, 2] = self.base_cloud.z
+        return xyz
+
+    def _compute_input_digest(self, coords: np.ndarray) -> str:
+        # Hashing the file is cheaper than hashing the coordinates as it can be memoized.
+        return self._get_input_digest()
+
+    def _get_input_digest(self) -> Optional[str]:
+        digest = self._stage_cache().file_digest(self.config.misc.input_file)
+        if self._is_windowed():
+            # The thinned cloud depends on the window and on the individualization voxels.
+            return StageCache.key(
+                digest,
+                window_height=self._get_window_height(),
+                voxel_xy=self.config.expert.res_z,
+                voxel_z=self.config.expert.res_xy,
+            )
+        return digest
+
+    def _get_point_count(self, coords: np.ndarray) -> int:
+        if self._is_windowed():
+            return self.base_cloud.point_count
+        return super()._get_point_count(coords)
 
     def _export_dtm(self, dtm: np.ndarray):
         las_dtm_points = laspy.create(point_format=2, file_version="1.4")
         las_dtm_points.xyz = dtm[:, 0:3]
-        las_dtm_points.write(str(self.output_basepath) + "_dtm_points.las")
+        las_dtm_points.write(self._get_output_path("_dtm_points"), laz_backend=self._get_laz_backend())
+
+    def _export_normalization_dtm(self, dtm: np.ndarray):
+        np.save(str(self.output_basepath) + "_dtm.npy", np.asarray(dtm[:, 0:3], dtype=np.float64))
 
     def _export_stripe(self, clust_stripe: np.ndarray):
         las_stripe = laspy.create(point_format=2, file_version="1.4")
@@ -60,40 +159,76 @@ class StandaloneLASProcessing(FinProcessing):
 
         las_stripe.add_extra_dim(laspy.ExtraBytesParams(name="tree_ID", type=np.int32))
         las_stripe.tree_ID = clust_stripe[:, -1]
-        las_stripe.write(str(self.output_basepath) + "_stripe.las")
+        las_stripe.write(self._get_output_path("_stripe"), laz_backend=self._get_laz_backend())
 
-    def _enrich_base_cloud(self, assigned_cloud: np.ndarray):
-        extra_fields = list()
+    def _get_enriched_header(self, header: laspy.LasHeader) -> laspy.LasHeader:
+        """Create the header of the enriched cloud from the header of the base cloud.
 
-        # We have to check extra field existence before. It could be a cloud from a previous run
-        # or user may already have defined these fields for a reason or another.
-        if not hasattr(self.base_cloud, "dist_axes"):
-            extra_fields.append(laspy.ExtraBytesParams(name="dist_axes", type=np.float64))
-        if not hasattr(self.base_cloud, "tree_ID"):
-            extra_fields.append(laspy.ExtraBytesParams(name="tree_ID", type=np.int32))
+        Files older than LAS 1.4 are converted to LAS 1.4, and the dist_axes, tree_ID
+        and Z0 (if the cloud is not normalized) fields are added if missing.
 
-        # Batch addition of extra fields. It minimizes the memory allocation.
-        self.base_cloud.add_extra_dims(extra_fields)
+        Parameters
+        ----------
+        header : laspy.LasHeader
+            The header of the base cloud.
 
-        self.base_cloud.dist_axes = assigned_cloud[:, 5]
-        self.base_cloud.tree_ID = assigned_cloud[:, 4]
+        Returns
+        -------
+        header : laspy.LasHeader
+            The header of the enriched cloud, without any point.
 
-        if self.config.misc is not None and not self.config.misc.is_normalized:
-            # In the case the user still want to use our CSF normalization but already have
-            # a field called Z0, adding the field with the same name will raise an exception.
-            # So we have to check its existence before.
-            # In this case no need to ask if we want to override, since the whole enriched
-            # cloud is saved in another file instance.
-            if not hasattr(self.base_cloud, "Z0"):
-                self.base_cloud.add_extra_dim(laspy.ExtraBytesParams(name="Z0", type=np.float64))
-            self.base_cloud.Z0 = assigned_cloud[:, 3]
-
-        if self.base_cloud.header.version < laspy.header.Version(major=1, minor=4):
+        """
+        header = deepcopy(header)
+        header.point_count = 0
+        if header.version < laspy.header.Version(major=1, minor=4):
             # The base file is maybe not in point_format == 6 but since it's a copy it won't hurt
             # the base file in itself.
-            self.base_cloud = laspy.convert(self.base_cloud, point_format_id=2, file_version="1.4")
+            header = laspy.convert(laspy.LasData(header), point_format_id=2, file_version="1.4").header
 
-        self.base_cloud.write(str(self.output_basepath) + "_tree_ID_dist_axes.las")
+        # We have to check extra field existence before. It could be a cloud from a previous run
+        # or user may already have defined these fields for a reason or another.
+        dimension_names = list(header.point_format.dimension_names)
+        extra_fields = list()
+        if "dist_axes" not in dimension_names:
+            extra_fields.append(laspy.ExtraBytesParams(name="dist_axes", type=np.float64))
+        if "tree_ID" not in dimension_names:
+            extra_fields.append(laspy.ExtraBytesParams(name="tree_ID", type=np.int32))
+        if not self.config.misc.is_normalized and "Z0" not in dimension_names:
+            extra_fields.append(laspy.ExtraBytesParams(name="Z0", type=np.float64))
+        header.add_extra_dims(extra_fields)
+        return header
+
+    def _iter_input_rows(self) -> Iterator[tuple[laspy.ScaleAwarePointRecord, slice]]:
+        """Stream the input file along with the rows of the coordinates matching the points."""
+        offset = 0
+        with laspy.open(
+            self.config.misc.input_file.resolve(), read_evlrs=False, laz_backend=self._get_laz_backend()
+        ) as reader:
+            for points in reader.chunk_iterator(CHUNK_SIZE):
+                yield points, slice(offset, offset + len(points))
+                offset += len(points)
+
+    def _enrich_base_cloud(self, coords: np.ndarray, tree_id: np.ndarray, dist_axes: np.ndarray):
+        # The enriched cloud is streamed from the input file chunk by chunk instead of
+        # extending the loaded cloud, which would copy it (twice if converted to LAS 1.4).
+        chunks = self.base_cloud.iter_rows() if self._is_windowed() else self._iter_input_rows()
+        self.base_cloud = None
+
+        with laspy.open(self.config.misc.input_file.resolve(), read_evlrs=False) as reader:
+            header = self._get_enriched_header(reader.header)
+        write_z0 = not self.config.misc.is_normalized
+        with laspy.open(
+            self._get_output_path("_tree_ID_dist_axes"), mode="w", header=header, laz_backend=self._get_laz_backend()
+        ) as writer:
+            for points, rows in chunks:
+                enriched_points = laspy.ScaleAwarePointRecord.zeros(len(points), header=header)
+                enriched_points.copy_fields_from(points)
+                enriched_points["dist_axes"] = dist_axes[rows]
+                enriched_points["tree_ID"] = tree_id[rows]
+                if write_z0:
+                    # Fields from a previous run or defined by the user are overwritten.
+                    enriched_points["Z0"] = coords[rows, 3]
+                writer.write_points(enriched_points)
 
     def _export_tree_height(self, tree_heights):
         las_tree_heights = laspy.create(point_format=2, file_version="1.4")
@@ -108,7 +243,7 @@ class StandaloneLASProcessing(FinProcessing):
         # Vertical deviation binary indicator.
         las_tree_heights.deviated = tree_heights[:, 4]
 
-        las_tree_heights.write(str(self.output_basepath) + "_tree_heights.las")
+        las_tree_heights.write(self._get_output_path("_tree_heights"), laz_backend=self._get_laz_backend())
 
     def _export_circles(self, circles_coords: np.ndarray):
         # LAS file containing circle coordinates.
@@ -135,7 +270,7 @@ class StandaloneLASProcessing(FinProcessing):
         las_circ.outlier_prob = circles_coords[:, 9]
         las_circ.quality = circles_coords[:, 10]
 
-        las_circ.write(str(self.output_basepath) + "_circ.las")
+        las_circ.write(self._get_output_path("_circ"), laz_backend=self._get_laz_backend())
 
     def _export_axes(self, axes_points: np.ndarray, tilt: np.ndarray):
         las_axes = laspy.create(point_format=2, file_version="1.4")
@@ -143,7 +278,7 @@ class StandaloneLASProcessing(FinProcessing):
         las_axes.add_extra_dim(laspy.ExtraBytesParams(name="tilting_degree", type=np.float64))
         las_axes.tilting_degree = tilt
 
-        las_axes.write(str(self.output_basepath) + "_axes.las")
+        las_axes.write(self._get_output_path("_axes"), laz_backend=self._get_laz_backend())
 
     def _export_tree_locations(self, tree_locations: np.ndarray, dbh_values: np.ndarray):
         las_tree_locations = laspy.create(point_format=2, file_version="1.4")
@@ -151,4 +286,4 @@ class StandaloneLASProcessing(FinProcessing):
         las_tree_locations.add_extra_dim(laspy.ExtraBytesParams(name="diameters", type=np.float64))
         las_tree_locations.diameters = dbh_values[:, 0]
 
-        las_tree_locations.write(str(self.output_basepath) + "_tree_locator.las")
+        las_tree_locations.write(self._get_output_path("_tree_locator"), laz_backend=self._get_laz_backend())
@@ -0,0 +1,688 @@
+import tempfile
+import timeit
+from collections import OrderedDict
+from copy import deepcopy
+from pathlib import Path
+from typing import Optional, Union
+
+import laspy
+import numpy as np
+from laspy.lasappender import LasAppender
+from scipy.spatial import KDTree
+
+from three_d_fin.processing.abstract_processing import NoTreeError
+from three_d_fin.processing.cache import StageCache
+from three_d_fin.processing.io import CHUNK_SIZE
+from three_d_fin.processing.standalone_processing import StandaloneLASProcessing
+
+# Tree ID (and distance to axis) given by dendromatics to the points that do not belong to any tree.
+NO_ID = 100000
+
+# Maximum number of tile files open at once while splitting the cloud, each one holds a
+# file descriptor and a write buffer.
+MAX_OPEN_TILES = 128
+
+
+class TileGrid:
+    """Regular grid of square (x, y) tiles covering a point cloud.
+
+    Each point belongs to exactly one tile "core", tiles are extended by a buffer
+    in order to give the algorithm the context of the neighbouring tiles.
+    """
+
+    def __init__(self, mins: np.ndarray, maxs: np.ndarray, tile_size: float, buffer: float) -> None:
+        """Init the grid from the bounding box of the point cloud.
+
+        Parameters
+        ----------
+        mins : np.ndarray
+            Minimum (x), (y) coordinates of the point cloud.
+        maxs : np.ndarray
+            Maximum (x), (y) coordinates of the point cloud.
+        tile_size : float
+            Size of the tiles.
+        buffer : float
+            Width of the overlap added around each tile.
+
+        """
+        self.origin = np.asarray(mins[0:2], dtype=np.float64)
+        self.tile_size = tile_size
+        self.buffer = buffer
+        self.shape = np.maximum(np.ceil((np.asarray(maxs[0:2]) - self.origin) / tile_size).astype(np.int64), 1)
+
+    def _index(self, x: np.ndarray, y: np.ndarray, offset: float) -> np.ndarray:
+        index = np.floor((np.c_[x, y] - self.origin + offset) / self.tile_size).astype(np.int64)
+        return np.clip(index, 0, self.shape - 1)
+
+    def core_index(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Compute the index of the tile whose core contains each point.
+
+        Parameters
+        ----------
+        x : np.ndarray
+            (x) coordinates of the points.
+        y : np.ndarray
+            (y) coordinates of the points.
+
+        Returns
+        -------
+        index : np.ndarray
+            A numpy array of shape (n, 2) containing the (i, j) index of the tile.
+
+        """
+        return self._index(x, y, 0.0)
+
+    def extended_index_range(self, x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Compute the range of tiles whose extended extent contains each point.
+
+        Parameters
+        ----------
+        x : np.ndarray
+            (x) coordinates of the points.
+        y : np.ndarray
+            (y) coordinates of the points.
+
+        Returns
+        -------
+        lower : np.ndarray
+            A numpy array of shape (n, 2) containing the lowest (i, j) index.
+        upper : np.ndarray
+            A numpy array of shape (n, 2) containing the highest (i, j) index (included).
+
+        """
+        return self._index(x, y, -self.buffer), self._index(x, y, self.buffer)
+
+    def core_depth(self, tile: tuple[int, int], xy: np.ndarray) -> np.ndarray:
+        """Compute the signed distance between points and the edges of a tile core.
+
+        Parameters
+        ----------
+        tile : tuple[int, int]
+            The (i, j) index of the tile.
+        xy : np.ndarray
+            A numpy array of shape (n, 2) containing (x), (y) coordinates.
+
+        Returns
+        -------
+        depth : np.ndarray
+            Distance to the closest core edge, positive inside the core and
+            negative outside. Edges of the grid are considered infinitely far.
+
+        """
+        lower = self.origin + np.asarray(tile) * self.tile_size
+        upper = lower + self.tile_size
+        distances = np.c_[xy - lower, upper - xy]
+        # Tiles on the edges of the grid extend indefinitely outward.
+        is_first = np.asarray(tile) == 0
+        is_last = np.asarray(tile) == self.shape - 1
+        distances[:, 0:2][:, is_first] = np.inf
+        distances[:, 2:4][:, is_last] = np.inf
+        return np.min(distances, axis=1)
+
+
+class _TileProcessing(StandaloneLASProcessing):
+    """Run the 3DFin algorithm on a single tile and keep its results.
+
+    Stitching the results requires the whole set of tiles, so the exports are
+    replaced by the capture of the corresponding arrays. Per-point results are
+    stored next to the tile in order to keep the memory footprint bounded.
+    """
+
+    # Captures are cheap and must be available as soon as the tile is processed.
+    export_workers = 0
+
+    # DTM the heights are normalized with, and the completed one exported for display.
+    dtm: Optional[np.ndarray] = None
+
+    completed_dtm: Optional[np.ndarray] = None
+
+    stripe: np.ndarray
+
+    assigned_path: Path
+
+    results: dict[str, np.ndarray]
+
+    # Key of the tile input in the stage cache, see process_tiled(...).
+    input_digest: str = ""
+
+    def process(self):
+        """Run the 3DFin algorithm on the tile, tiles without any tree are accepted."""
+        try:
+            super().process()
+        except NoTreeError as error:
+            # Expected for some tiles (e.g. clearings). The DTM is needed to normalize such tiles.
+            if not self.config.misc.is_normalized and self.dtm is None:
+                raise
+            print("   No tree found in this tile:", error)
+            self._set_empty_results()
+
+    def _set_empty_results(self):
+        """Set the results of a tile without any tree."""
+        self._load_base_cloud()
+        if self.config.misc.is_normalized:
+            coords = self._get_xyz_z0_from_base()
+        else:
+            coords = self._get_xyz_from_base()
+            self._normalize_heights(coords, self.dtm)
+        self._enrich_base_cloud(
+            coords,
+            np.full(coords.shape[0], NO_ID, dtype=np.int32),
+            np.full(coords.shape[0], NO_ID, dtype=np.float64),
+        )
+        self.stripe = np.empty((0, 4))
+        n_sections = np.arange(
+            self.config.advanced.minimum_height,
+            self.config.advanced.maximum_height,
+            self.config.advanced.section_len,
+        ).shape[0]
+        self.results = {
+            "tree_vector": np.empty((0, 9)),
+            "tree_heights": np.empty((0, 5)),
+            "X_c": np.empty((0, n_sections)),
+            "Y_c": np.empty((0, n_sections)),
+            "R": np.empty((0, n_sections)),
+            "check_circle": np.empty((0, n_sections)),
+            "sector_perct": np.empty((0, n_sections)),
+            "n_points_in": np.empty((0, n_sections)),
+            "outliers": np.empty((0, n_sections)),
+        }
+
+    def _get_input_digest(self) -> Optional[str]:
+        return self.input_digest
+
+    def _export_dtm(self, dtm: np.ndarray):
+        self.completed_dtm = dtm
+
+    def _export_normalization_dtm(self, dtm: np.ndarray):
+        self.dtm = dtm
+
+    def _export_stripe(self, clust_stripe: np.ndarray):
+        self.stripe = clust_stripe
+
+    def _enrich_base_cloud(self, coords: np.ndarray, tree_id: np.ndarray, dist_axes: np.ndarray):
+        # Only z0, tree ID and distance to axis are stored, the points are read again from the tile.
+        self.assigned_path = Path(str(self.output_basepath) + "_assigned.npy")
+        np.save(self.assigned_path, np.column_stack((coords[:, 3], tree_id, dist_axes)).astype(np.float64))
+        self.base_cloud = None
+
+    def _export_tree_height(self, tree_heights: np.ndarray):
+        pass
+
+    def _draw_and_export_results(
+        self,
+        tree_vector,
+        tree_heights,
+        sections,
+        X_c,
+        Y_c,
+        R,
+        check_circle,
+        sector_perct,
+        n_points_in,
+        outliers,
+        cloud_size,
+        cloud_shape,
+    ):
+        self.results = {
+            "tree_vector": tree_vector,
+            "tree_heights": tree_heights,
+            "X_c": X_c,
+            "Y_c": Y_c,
+            "R": R,
+            "check_circle": check_circle,
+            "sector_perct": sector_perct,
+            "n_points_in": n_points_in,
+            "outliers": outliers,
+        }
+
+
+class _TileWriters:
+    """Write points to the tile files, with a bounded number of open files.
+
+    The least recently written tile is closed when a new one must be opened, it
+    is opened again in append mode if more points fall in it.
+    """
+
+    def __init__(self, tile_dir: Path, header: laspy.LasHeader) -> None:
+        self.tile_dir = tile_dir
+        self.header = header
+        self.paths: dict[tuple[int, int], Path] = {}
+        self._open: OrderedDict[tuple[int, int], Union[laspy.LasWriter, LasAppender]] = OrderedDict()
+
+    def write(self, key: tuple[int, int], points: laspy.ScaleAwarePointRecord) -> None:
+        """Write points to the file of a tile, created on first write."""
+        writer = self._open.pop(key, None)
+        if writer is None:
+            if len(self._open) >= MAX_OPEN_TILES:
+                self._open.popitem(last=False)[1].close()
+            if key in self.paths:
+                writer = laspy.open(self.paths[key], mode="a")
+            else:
+                self.paths[key] = self.tile_dir / f"tile_{key[0]}_{key[1]}.las"
+                writer = laspy.open(self.paths[key], mode="w", header=deepcopy(self.header))
+        # Most recently written tiles are last.
+        self._open[key] = writer
+        if isinstance(writer, LasAppender):
+            writer.append_points(points)
+        else:
+            writer.write_points(points)
+
+    def close(self) -> None:
+        """Close every open tile file."""
+        while self._open:
+            self._open.popitem(last=False)[1].close()
+
+
+def split_into_tiles(
+    input_file: Path,
+    grid: TileGrid,
+    tile_dir: Path,
+    z0_name: Optional[str],
+    laz_backend: Optional[laspy.LazBackend] = None,
+) -> tuple[dict[tuple[int, int], Path], int]:
+    """Split a LAS/LAZ file into buffered tiles in a single streaming pass.
+
+    At most MAX_OPEN_TILES tile files are open at once, see _TileWriters.
+
+    Parameters
+    ----------
+    input_file : Path
+        The point cloud to split.
+    grid : TileGrid
+        The tile grid.
+    tile_dir : Path
+        Directory where to write the tiles, as uncompressed LAS files.
+    z0_name : Optional[str]
+        Name of the normalized height field, None if the cloud is not normalized.
+    laz_backend : Optional[laspy.LazBackend]
+        Backend used to decompress LAZ files, None for laspy default selection.
+
+    Returns
+    -------
+    tiles : dict[tuple[int, int], Path]
+        Path to the LAS file of each tile with at least one point in its core.
+    cloud_shape : int
+        Area of the cloud in m^2, computed on a 1 m grid from the ground
+        points (all points if the cloud is not normalized).
+
+    """
+    core_tiles: set[tuple[int, int]] = set()
+    cells = np.empty(0, dtype=np.int64)
+    n_cells_y = int(np.ceil(grid.shape[1] * grid.tile_size)) + 1
+    with laspy.open(input_file, laz_backend=laz_backend) as reader:
+        writers = _TileWriters(tile_dir, reader.header)
+        try:
+            for chunk in reader.chunk_iterator(CHUNK_SIZE):
+                x = np.asarray(chunk.x)
+                y = np.asarray(chunk.y)
+
+                # Area occupied by the plot.
+                ground = np.asarray(chunk[z0_name]) < 0.5 if z0_name is not None else slice(None)
+                cell_index = np.floor(np.c_[x[ground], y[ground]] - grid.origin).astype(np.int64)
+                cells = np.union1d(cells, cell_index[:, 0] * n_cells_y + cell_index[:, 1])
+
+                core_tiles.update(map(tuple, np.unique(grid.core_index(x, y), axis=0).tolist()))
+
+                lower, upper = grid.extended_index_range(x, y)
+                for i in range(lower[:, 0].min(), upper[:, 0].max() + 1):
+                    in_column = (lower[:, 0] <= i) & (upper[:, 0] >= i)
+                    for j in range(lower[:, 1].min(), upper[:, 1].max() + 1):
+                        in_tile = in_column & (lower[:, 1] <= j) & (upper[:, 1] >= j)
+                        if not np.any(in_tile):
+                            continue
+                        writers.write((i, j), chunk[in_tile])
+        finally:
+            writers.close()
+    tiles = writers.paths
+
+    # Tiles without any point in their core do not contribute to the results.
+    for key in set(tiles) - core_tiles:
+        tiles.pop(key).unlink()
+    return tiles, cells.shape[0]
+
+
+def _stitch_trees(
+    grid: TileGrid, tile_results: dict[tuple[int, int], _TileProcessing], radius: float
+) -> dict[tuple[int, int], tuple[np.ndarray, np.ndarray]]:
+    """Choose the tile responsible for each tree and give global IDs to the trees.
+
+    A tree is kept by the tile whose core contains its stem axis location (the
+    stripe centroid). Trees detected by several tiles are deduplicated on their
+    axis location, keeping the detection made the furthest from the core edges.
+
+    Parameters
+    ----------
+    grid : TileGrid
+        The tile grid.
+    tile_results : dict[tuple[int, int], _TileProcessing]
+        The processed tiles.
+    radius : float
+        Two axes closer than radius are considered as the same tree.
+
+    Returns
+    -------
+    tree_ids : dict[tuple[int, int], tuple[np.ndarray, np.ndarray]]
+        For each tile and each of its local trees (rows of its tree_vector): the
+        global ID of the tree, -1 if it is not kept by this tile, and the global
+        ID given to its points, i.e. the ID of the closest kept tree (NO_ID if none).
+        Global IDs are sequential and follow the tile order.
+
+    """
+    keys = list(tile_results.keys())
+    locations = []
+    depths = []
+    owners = []
+    for key_id, key in enumerate(keys):
+        tree_vector = tile_results[key].results["tree_vector"]
+        locations.append(tree_vector[:, 4:6])
+        depths.append(grid.core_depth(key, tree_vector[:, 4:6]))
+        owners.append(np.full(tree_vector.shape[0], key_id))
+    locations = np.vstack(locations)
+    depths = np.concatenate(depths)
+    owners = np.concatenate(owners)
+
+    # Greedy deduplication, the deepest detections first.
+    kept = np.zeros(locations.shape[0], dtype=bool)
+    if locations.shape[0] > 0:
+        neighbours = KDTree(locations).query_ball_point(locations, radius)
+        for tree in np.argsort(-depths, kind="stable"):
+            if depths[tree] < -radius:
+                break
+            kept[tree] = not any(kept[other] and owners[other] != owners[tree] for other in neighbours[tree])
+
+    global_ids = np.full(locations.shape[0], -1, dtype=np.int64)
+    global_ids[kept] = np.arange(np.count_nonzero(kept))
+    # Points of dropped trees are given to the closest kept tree, i.e. the same tree seen from another tile.
+    point_ids = np.where(kept, global_ids, NO_ID)
+    dropped = np.flatnonzero(~kept)
+    if dropped.shape[0] > 0 and np.any(kept):
+        distances, closest = KDTree(locations[kept]).query(locations[dropped], distance_upper_bound=radius)
+        matched = np.isfinite(distances)
+        point_ids[dropped[matched]] = closest[matched]
+
+    return {key: (global_ids[owners == key_id], point_ids[owners == key_id]) for key_id, key in enumerate(keys)}
+
+
+def _remap_tree_ids(tree_ids: np.ndarray, local_ids: np.ndarray, new_ids: np.ndarray) -> np.ndarray:
+    """Translate tree IDs from a tile local numbering to the global one.
+
+    Parameters
+    ----------
+    tree_ids : np.ndarray
+        The local tree IDs to translate.
+    local_ids : np.ndarray
+        The local ID of each tree of the tile (first column of its tree_vector).
+    new_ids : np.ndarray
+        The global ID of each tree of the tile.
+
+    Returns
+    -------
+    remapped_ids : np.ndarray
+        The global tree IDs, NO_ID for IDs that are not in local_ids.
+
+    """
+    remapped_ids = np.full(tree_ids.shape[0], NO_ID, dtype=np.int64)
+    if local_ids.shape[0] == 0:
+        return remapped_ids
+    order = np.argsort(local_ids)
+    position = np.minimum(np.searchsorted(local_ids, tree_ids, sorter=order), local_ids.shape[0] - 1)
+    found = local_ids[order[position]] == tree_ids
+    remapped_ids[found] = new_ids[order[position[found]]]
+    return remapped_ids
+
+
+def _write_enriched_cloud(
+    fin_processing: StandaloneLASProcessing,
+    grid: TileGrid,
+    tiles: dict[tuple[int, int], Path],
+    tile_results: dict[tuple[int, int], _TileProcessing],
+    tree_ids: dict[tuple[int, int], tuple[np.ndarray, np.ndarray]],
+    tile_dir: Path,
+):
+    """Write the enriched cloud from the core points of each tile, in the input order.
+
+    It follows StandaloneLASProcessing._enrich_base_cloud(...) behaviour. The
+    per-point results of the core points of each tile are first gathered tile
+    after tile in a single memory-mapped array. The input is then streamed again:
+    tiles hold their points in the input order, so the points of a chunk lying in
+    the core of a tile are the next ones of the tile.
+    """
+    write_z0 = not fin_processing.config.misc.is_normalized
+    with laspy.open(fin_processing.config.misc.input_file.resolve(), read_evlrs=False) as reader:
+        header = fin_processing._get_enriched_header(reader.header)
+        point_count = reader.header.point_count
+
+    # Tree ID, distance to axis and z0 of the core points, tile after tile.
+    core_results = np.lib.format.open_memmap(tile_dir / "core_results.npy", mode="w+", shape=(point_count, 3))
+    offsets = {}
+    offset = 0
+    for key, tile_path in tiles.items():
+        tile_points = laspy.read(tile_path).points
+        core = np.all(grid.core_index(np.asarray(tile_points.x), np.asarray(tile_points.y)) == key, axis=1)
+        del tile_points
+        assigned = np.load(tile_results[key].assigned_path, mmap_mode="r")[core]
+        points_tree_ids = _remap_tree_ids(
+            assigned[:, 1], tile_results[key].results["tree_vector"][:, 0], tree_ids[key][1]
+        )
+        core_results[offset : offset + assigned.shape[0], 0] = points_tree_ids
+        core_results[offset : offset + assigned.shape[0], 1] = np.where(points_tree_ids != NO_ID, assigned[:, 2], NO_ID)
+        core_results[offset : offset + assigned.shape[0], 2] = assigned[:, 0]
+        offsets[key] = offset
+        offset += assigned.shape[0]
+
+    with laspy.open(
+        fin_processing._get_output_path("_tree_ID_dist_axes"),
+        mode="w",
+        header=header,
+        laz_backend=fin_processing._get_laz_backend(),
+    ) as writer:
+        for points, _ in fin_processing._iter_input_rows():
+            core_index = grid.core_index(np.asarray(points.x), np.asarray(points.y))
+            tile_code = core_index[:, 0] * grid.shape[1] + core_index[:, 1]
+            rows = np.empty(len(points), dtype=np.int64)
+            for code in np.unique(tile_code):
+                key = (int(code // grid.shape[1]), int(code % grid.shape[1]))
+                in_tile = np.flatnonzero(tile_code == code)
+                rows[in_tile] = np.arange(offsets[key], offsets[key] + in_tile.shape[0])
+                offsets[key] += in_tile.shape[0]
+            chunk_results = core_results[rows]
+
+            enriched_points = laspy.ScaleAwarePointRecord.zeros(len(points), header=header)
+            enriched_points.copy_fields_from(points)
+            enriched_points["tree_ID"] = chunk_results[:, 0].astype(np.int64)
+            enriched_points["dist_axes"] = chunk_results[:, 1]
+            if write_z0:
+                enriched_points["Z0"] = chunk_results[:, 2]
+            writer.write_points(enriched_points)
+    del core_results
+
+
+def process_tiled(fin_processing: StandaloneLASProcessing):
+    """Run the 3DFin algorithm tile by tile.
+
+    The input cloud is split into square tiles extended by a buffer in a single
+    streaming pass, tiles are written in a temporary directory inside the output
+    directory. Each tile is then processed with the regular algorithm (see
+    FinProcessing.process(...)) and the per-tree results are stitched together:
+    each tree is kept by the tile whose core contains its stem axis and duplicated
+    detections of the trees that straddle tile edges are removed. The peak memory
+    is thus driven by the size of the extended tiles instead of the size of the
+    whole cloud. Outputs are the same as the ones of the regular algorithm, tree
+    IDs are sequential and match the rows of the tabular data, and the points of
+    the enriched cloud are in the input order.
+
+    Parameters
+    ----------
+    fin_processing : StandaloneLASProcessing
+        The processing object, its configuration must define a tile size.
+
+    """
+    config = fin_processing.config
+
+    t_t = timeit.default_timer()
+
+    input_file = Path(config.misc.input_file).resolve()
+    with laspy.open(input_file, read_evlrs=False) as reader:
+        header = reader.header
+    grid = TileGrid(header.mins, header.maxs, config.misc.tile_size, config.misc.tile_buffer)
+    cloud_size = header.point_count / 1000000
+
+    with tempfile.TemporaryDirectory(prefix=f"{input_file.stem}_tiles_", dir=config.misc.output_dir) as tile_dir:
+        print("---------------------------------------------")
+        print("Splitting the cloud in tiles...")
+        print("---------------------------------------------")
+        t = timeit.default_timer()
+        fin_processing.instrumentation.start("split", points_in=header.point_count)
+        tiles, cloud_shape = split_into_tiles(
+            input_file,
+            grid,
+            Path(tile_dir),
+            config.basic.z0_name if config.misc.is_normalized else None,
+            fin_processing._get_laz_backend(),
+        )
+        print("   This cloud has", "{:.2f}".format(cloud_size), "million points")
+        print("   Its area is ", cloud_shape, "m^2")
+        print("   It is split in", len(tiles), "tiles")
+        fin_processing.instrumentation.end("split", area=cloud_shape, tiles=len(tiles))
+        elapsed = timeit.default_timer() - t
+        print("        ", "%.2f" % elapsed, "s: splitting the cloud")
+
+        # Tiles are written again at each run in a temporary directory, their stages are keyed on
+        # the input file and on the tile extent instead of on the content of the tile files.
+        tile_cache_dir = config.misc.cache_dir or fin_processing._checkpoint_dir()
+        tile_cache = StageCache(tile_cache_dir)
+        input_digest = tile_cache.file_digest(input_file) if tile_cache.enabled else ""
+
+        tile_results: dict[tuple[int, int], _TileProcessing] = {}
+        for tile_id, (key, tile_path) in enumerate(tiles.items()):
+            print("---------------------------------------------")
+            print(f"Processing tile {tile_id + 1}/{len(tiles)}...")
+            print("---------------------------------------------")
+            tile_misc = config.misc.copy(
+                update={
+                    "input_file": tile_path,
+                    "output_dir": Path(tile_dir),
+                    "tile_size": None,
+                    "windowed_loading": False,
+                    "export_timings": False,
+                    # The tile size already accounts for the memory budget.
+                    "memory_strategy": "off",
+                    "cache_dir": tile_cache_dir,
+                }
+            )
+            tile_processing = _TileProcessing(config.copy(update={"misc": tile_misc}))
+            tile_processing.input_digest = StageCache.key(
+                input_digest,
+                tile=[int(index) for index in key],
+                origin=grid.origin.tolist(),
+                shape=grid.shape.tolist(),
+                tile_size=grid.tile_size,
+                buffer=grid.buffer,
+            )
+            tile_processing.set_cancellation_token(fin_processing.cancellation)
+            fin_processing.instrumentation.start(f"tile_{key[0]}_{key[1]}")
+            tile_processing.process()
+            fin_processing.instrumentation.end(
+                f"tile_{key[0]}_{key[1]}", trees=tile_processing.results["tree_vector"].shape[0]
+            )
+            tile_results[key] = tile_processing
+            fin_processing.area_warning |= tile_processing.area_warning
+
+        print("---------------------------------------------")
+        print("Stitching the tiles...")
+        print("---------------------------------------------")
+        t = timeit.default_timer()
+        fin_processing.instrumentation.start("stitching")
+        tree_ids = _stitch_trees(grid, tile_results, config.advanced.maximum_diameter / 2.0)
+
+        # Per-tree results of the kept trees, in global ID order.
+        results: dict[str, np.ndarray] = {}
+        for name in next(iter(tile_results.values())).results:
+            results[name] = np.concatenate(
+                [tile_results[key].results[name][tree_ids[key][0] >= 0] for key in tile_results], axis=0
+            )
+        results["tree_vector"][:, 0] = np.arange(results["tree_vector"].shape[0])
+
+        if not config.misc.is_normalized:
+            for name, export in (
+                ("completed_dtm", fin_processing._export_dtm),
+                ("dtm", fin_processing._export_normalization_dtm),
+            ):
+                tile_dtms = {key: getattr(tile, name) for key, tile in tile_results.items()}
+                dtm = np.vstack(
+                    [
+                        tile_dtm[np.all(grid.core_index(tile_dtm[:, 0], tile_dtm[:, 1]) == key, axis=1)]
+                        for key, tile_dtm in tile_dtms.items()
+                    ]
+                )
+                fin_processing._submit_export(export, dtm)
+
+        stripes = []
+        for key, tile in tile_results.items():
+            stripe_ids = _remap_tree_ids(tile.stripe[:, -1], tile.results["tree_vector"][:, 0], tree_ids[key][0])
+            kept = (stripe_ids != NO_ID) & (stripe_ids >= 0)
+            stripes.append(np.c_[tile.stripe[kept, 0:3], stripe_ids[kept]])
+        fin_processing._submit_export(fin_processing._export_stripe, np.vstack(stripes))
+
+        _write_enriched_cloud(fin_processing, grid, tiles, tile_results, tree_ids, Path(tile_dir))
+        fin_processing.instrumentation.end("stitching", trees=results["tree_vector"].shape[0])
+        elapsed = timeit.default_timer() - t
+        print("        ", "%.2f" % elapsed, "s: stitching the tiles")
+
+    fin_processing._submit_export(fin_processing._export_tree_height, results["tree_heights"])
+
+    sections = np.arange(
+        config.advanced.minimum_height,
+        config.advanced.maximum_height,
+        config.advanced.section_len,
+    )
+    # The per-tree results are kept for a later process_tail(...).
+    cache = StageCache(config.misc.cache_dir)
+    if cache.enabled:
+        cache.save(
+            "results",
+            fin_processing._results_key(fin_processing._get_input_digest()),
+            **results,
+            sections=sections,
+            cloud_size=cloud_size,
+            cloud_shape=cloud_shape,
+            area_warning=fin_processing.area_warning,
+        )
+
+    fin_processing.instrumentation.start("results")
+    fin_processing._draw_and_export_results(
+        results["tree_vector"],
+        results["tree_heights"],
+        sections,
+        results["X_c"],
+        results["Y_c"],
+        results["R"],
+        results["check_circle"],
+        results["sector_perct"],
+        results["n_points_in"],
+        results["outliers"],
+        cloud_size,
+        cloud_shape,
+    )
+    fin_processing.instrumentation.end("results")
+
+    fin_processing.instrumentation.start("wait_for_exports")
+    fin_processing._wait_for_exports()
+    fin_processing.instrumentation.end("wait_for_exports")
+
+    elapsed_t = timeit.default_timer() - t_t
+
+    config.to_config_file(Path(str(fin_processing.output_basepath) + "_config.ini"))
+
+    print("---------------------------------------------")
+    print("End of process!")
+    print("---------------------------------------------")
+    print("Total time:", "   %.2f" % elapsed_t, "s")
+    print("nº of trees:", results["X_c"].shape[0])
+
+    if fin_processing.area_warning:
+        print(
+            "Warning: 3DFin has detected a potential error in the terrain modelling.\n"
+            + 'This usually happens when the "cloth resolution" parameter didn\'t fit well the terrain.\n'
+            + "Learn more about this here https://github.com/3DFin/3DFin_Tutorial"
+        )
@@ -0,0 +1,170 @@
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Optional
+
+import laspy
+import numpy as np
+
+from three_d_fin.processing.io import CHUNK_SIZE
+
+
+class WindowedCloud:
+    """Reduced view of a normalized point cloud, loaded in a streaming pass.
+
+    Steps 1 to 5 of the 3DFin algorithm only use the points whose normalized height
+    lies below a given height (the stripe, the stems and their sections). Points
+    above it (mostly crowns) are only used, voxelated, by the individualization of
+    the trees (see dendromatics.individualize_trees). Such points are thus reduced
+    to one point per voxel of the individualization grid, which gives the same
+    voxelated cloud and hence the same results as the whole cloud.
+
+    Rows of coords are the points below the window height, in the file order,
+    followed by the voxel representatives of the points above it.
+    """
+
+    coords: np.ndarray
+
+    point_count: int
+
+    def __init__(
+        self,
+        input_file: Path,
+        z0_name: str,
+        window_height: float,
+        res_xy: float,
+        res_z: float,
+        laz_backend: Optional[laspy.LazBackend] = None,
+    ) -> None:
+        """Load the reduced cloud from a LAS/LAZ file.
+
+        Parameters
+        ----------
+        input_file : Path
+            The normalized point cloud.
+        z0_name : str
+            Name of the normalized height field.
+        window_height : float
+            Normalized height below which the points are kept at full resolution.
+        res_xy : float
+            (x, y) resolution of the individualization voxels.
+        res_z : float
+            (z) resolution of the individualization voxels.
+        laz_backend : Optional[laspy.LazBackend]
+            Backend used to decompress LAZ files, None for laspy default selection.
+
+        """
+        self.input_file = Path(input_file)
+        self.z0_name = z0_name
+        self.window_height = window_height
+        self.resolution = np.array([res_xy, res_xy, res_z])
+        self.laz_backend = laz_backend
+        with laspy.open(self.input_file, read_evlrs=False) as reader:
+            mins, maxs = reader.header.mins, reader.header.maxs
+            self._selection = self._decompression_selection(reader)
+        # The voxel grid is anchored on the header bounding box, which should be the
+        # cloud one. If it is not, the reduction is done again with the actual one.
+        if not self._load(mins, maxs):
+            self._load(self._cloud_mins, self._cloud_maxs)
+
+    def _decompression_selection(self, reader: laspy.LasReader) -> laspy.DecompressionSelection:
+        """Decompress only the fields that are needed, when the LAZ layout allows it."""
+        selection = laspy.DecompressionSelection.xy_returns_channel() | laspy.DecompressionSelection.Z
+        if self.z0_name in reader.header.point_format.extra_dimension_names:
+            return selection | laspy.DecompressionSelection.ALL_EXTRA_BYTES
+        return laspy.DecompressionSelection.all()
+
+    def _read_chunks(self, **kwargs) -> Iterator[tuple[laspy.ScaleAwarePointRecord, np.ndarray]]:
+        """Stream the points with their (x), (y), (z) and z0 coordinates."""
+        with laspy.open(self.input_file, read_evlrs=False, laz_backend=self.laz_backend, **kwargs) as reader:
+            for points in reader.chunk_iterator(CHUNK_SIZE):
+                yield points, np.c_[points.x, points.y, points.z, points[self.z0_name]]
+
+    def _voxel_codes(self, xyz: np.ndarray) -> Optional[np.ndarray]:
+        """Compute the code of the voxels containing the points, None if outside the grid."""
+        # Same operations as dendromatics.voxelate in order to get the exact same voxels.
+        index = np.floor((xyz - self._origin) / self.resolution).astype(np.int64)
+        if np.any(index < 0) or np.any(index >= self._grid_shape):
+            return None
+        return np.ravel_multi_index(index.T, self._grid_shape)
+
+    def _load(self, mins: np.ndarray, maxs: np.ndarray) -> bool:
+        """Load the reduced cloud with a voxel grid anchored on mins.
+
+        Returns
+        -------
+        is_valid : bool
+            Whether mins and maxs are the actual bounds of the cloud, the reduced cloud
+            is only valid if they are.
+
+        """
+        self._origin = np.asarray(mins, dtype=np.float64)
+        self._grid_shape = np.floor((np.asarray(maxs) - self._origin) / self.resolution).astype(np.int64) + 1
+        self._cloud_mins = np.full(3, np.inf)
+        self._cloud_maxs = np.full(3, -np.inf)
+        # The lowest points of the cloud give the origin of the individualization voxels,
+        # they are kept when they are above the window.
+        extreme_points = np.full((3, 4), np.inf)
+        window_parts = []
+        crown_codes = []
+        crown_parts = []
+        is_valid = True
+        self.point_count = 0
+        for _, xyz_z0 in self._read_chunks(decompression_selection=self._selection):
+            self.point_count += xyz_z0.shape[0]
+            self._cloud_mins = np.minimum(self._cloud_mins, xyz_z0[:, 0:3].min(axis=0))
+            self._cloud_maxs = np.maximum(self._cloud_maxs, xyz_z0[:, 0:3].max(axis=0))
+
+            in_window = xyz_z0[:, 3] <= self.window_height
+            window_parts.append(xyz_z0[in_window])
+            crown = xyz_z0[~in_window]
+            if crown.shape[0] == 0 or not is_valid:
+                continue
+            for axis in range(3):
+                lowest = crown[np.argmin(crown[:, axis])]
+                if lowest[axis] < extreme_points[axis, axis]:
+                    extreme_points[axis] = lowest
+            codes = self._voxel_codes(crown[:, 0:3])
+            if codes is None:
+                is_valid = False
+                continue
+            codes, first_index = np.unique(codes, return_index=True)
+            crown_codes.append(codes)
+            crown_parts.append(crown[first_index])
+
+        is_valid &= np.array_equal(self._cloud_mins, self._origin)
+        if not is_valid:
+            return False
+
+        self._window_size = sum(part.shape[0] for part in window_parts)
+        if crown_codes:
+            self._crown_codes, first_index = np.unique(np.concatenate(crown_codes), return_index=True)
+            crown_parts = [np.concatenate(crown_parts)[first_index]]
+        else:
+            self._crown_codes = np.empty(0, dtype=np.int64)
+        self.coords = np.concatenate(window_parts + crown_parts + [extreme_points[np.isfinite(extreme_points[:, 0])]])
+        return True
+
+    def iter_rows(self) -> Iterator[tuple[laspy.ScaleAwarePointRecord, np.ndarray]]:
+        """Stream the whole cloud again, along with the rows of coords matching the points.
+
+        Points below the window height are matched with their own row, points
+        above it with the row of the representative of their voxel.
+
+        Yields
+        ------
+        points : laspy.ScaleAwarePointRecord
+            A chunk of points of the cloud, with all their fields.
+        rows : np.ndarray
+            The rows of coords matching the points.
+
+        """
+        window_offset = 0
+        for points, xyz_z0 in self._read_chunks():
+            rows = np.empty(xyz_z0.shape[0], dtype=np.int64)
+            in_window = xyz_z0[:, 3] <= self.window_height
+            n_window = np.count_nonzero(in_window)
+            rows[in_window] = np.arange(window_offset, window_offset + n_window)
+            window_offset += n_window
+            codes = self._voxel_codes(xyz_z0[~in_window, 0:3])
+            rows[~in_window] = self._window_size + np.searchsorted(self._crown_codes, codes)
+            yield points, rows
@@ -0,0 +1,65 @@
+from pathlib import Path
+
+import laspy
+import numpy as np
+
+from three_d_fin.processing.batch import collect_input_files, run_batch
+from three_d_fin.processing.configuration import FinConfiguration, MiscParameters
+
+
+def test_collect_input_files(tmp_path: Path):
+    """Test the collection of the plots to process in batch mode.
+
+    A directory, a glob pattern and a manifest listing the same plots
+    should all lead to the same list of files.
+    """
+    plots = [tmp_path / "plot_b.laz", tmp_path / "plot_a.las"]
+    for plot in plots:
+        plot.touch()
+    (tmp_path / "notes.txt").touch()
+
+    expected = sorted(plots)
+    assert collect_input_files(str(tmp_path)) == expected
+    assert collect_input_files(str(tmp_path / "plot_*")) == expected
+    assert collect_input_files(str(plots[0])) == [plots[0]]
+
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text(f"# plots to process\nplot_a.las\n\n{plots[0]}\n")
+    assert collect_input_files(str(manifest)) == expected
+
+
+def _write_plot(input_file: Path, n_stems: int):
+    """Write a normalized 20 m wide plot with n_stems 12 m high stems."""
+    rng = np.random.default_rng(0)
+    clouds = [np.c_[rng.uniform(0.0, 20.0, (20000, 2)), rng.uniform(0.0, 0.3, 20000)]]
+    for x, y in ((5.0, 5.0), (15.0, 6.0), (6.0, 15.0), (14.0, 14.0))[:n_stems]:
+        angle = rng.uniform(0.0, 2 * np.pi, 20000)
+        radius = 0.15 + 0.005 * rng.standard_normal(20000)
+        clouds.append(np.c_[x + radius * np.cos(angle), y + radius * np.sin(angle), rng.uniform(0.0, 12.0, 20000)])
+    xyz = np.vstack(clouds)
+    header = laspy.LasHeader(point_format=2, version="1.2")
+    header.add_extra_dim(laspy.ExtraBytesParams(name="Z0", type=np.float64))
+    las = laspy.LasData(header)
+    las.xyz = xyz
+    las.Z0 = xyz[:, 2]
+    las.write(input_file)
+
+
+def test_run_batch(tmp_path: Path):
+    """Test that a failing plot is reported without stopping the batch, and that each plot gets its log."""
+    _write_plot(tmp_path / "forest.las", 4)
+    _write_plot(tmp_path / "clearing.las", 0)
+    configs = [
+        FinConfiguration(misc=MiscParameters(input_file=tmp_path / name, output_dir=tmp_path, is_normalized=True))
+        for name in ("clearing.las", "forest.las")
+    ]
+
+    errors = run_batch(configs, n_workers=1)
+
+    assert errors[tmp_path / "forest.las"] is None
+    assert errors[tmp_path / "clearing.las"] is not None
+    assert (tmp_path / "forest_tree_locator.las").exists()
+    forest_log = (tmp_path / "forest_log.txt").read_text()
+    assert "End of process!" in forest_log
+    assert "Progress" in forest_log
+    assert errors[tmp_path / "clearing.las"] in (tmp_path / "clearing_log.txt").read_text()
@@ -0,0 +1,139 @@
+from pathlib import Path
+
+import laspy
+import numpy as np
+import pytest
+
+from three_d_fin.processing.cache import StageCache
+from three_d_fin.processing.configuration import FinConfiguration, MiscParameters
+from three_d_fin.processing.standalone_processing import StandaloneLASProcessing
+
+
+def test_stage_cache(tmp_path: Path):
+    """Test stage cache keys and entries round trip.
+
+    Keys must only change with the parent key and the stage parameters, and
+    a disabled cache must never return anything.
+    """
+    cache = StageCache(tmp_path / "cache")
+    key = cache.key("parent", res_z=0.1, res_xy=0.2)
+    assert key == cache.key("parent", res_xy=0.2, res_z=0.1)
+    assert key != cache.key("parent", res_xy=0.2, res_z=0.15)
+    assert key != cache.key("other_parent", res_xy=0.2, res_z=0.1)
+
+    assert cache.load("stage", key) is None
+    tree_vector = np.arange(18.0).reshape(2, 9)
+    cache.save("stage", key, tree_vector=tree_vector, cloud_shape=42)
+    entry = cache.load("stage", key)
+    assert np.array_equal(entry["tree_vector"], tree_vector)
+    assert int(entry["cloud_shape"]) == 42
+
+    assert StageCache(None).load("stage", key) is None
+
+
+def test_file_digest(tmp_path: Path):
+    """Test that the file digest follows the file content."""
+    cache = StageCache(tmp_path / "cache")
+    input_file = tmp_path / "plot.las"
+    input_file.write_bytes(b"first content")
+    digest = cache.file_digest(input_file)
+    assert digest == cache.file_digest(input_file)
+
+    input_file.write_bytes(b"second content")
+    assert digest != cache.file_digest(input_file)
+
+
+def test_process_tail(tmp_path: Path):
+    """Test that the results of a previous run are only found if the algorithm parameters did not change."""
+    input_file = tmp_path / "plot.las"
+    las = laspy.create(point_format=2, file_version="1.2")
+    las.xyz = np.arange(30.0).reshape(10, 3)
+    las.write(input_file)
+    misc = MiscParameters(
+        input_file=input_file, output_dir=tmp_path, cache_dir=tmp_path / "cache", memory_strategy="off"
+    )
+    config = FinConfiguration(misc=misc)
+    processing = StandaloneLASProcessing(config)
+    assert not processing.process_tail()
+
+    tree_vector = np.arange(18.0).reshape(2, 9)
+    StageCache(misc.cache_dir).save(
+        "results",
+        processing._results_key(processing._get_input_digest()),
+        tree_vector=tree_vector,
+        X_c=np.zeros((2, 3)),
+        cloud_size=0.5,
+        cloud_shape=42,
+        area_warning=True,
+    )
+    exported = []
+
+    def draw_and_export_results(**results):
+        exported.append(results)
+
+    # Changing the drawing or the export of the results does not change the results.
+    tail_config = config.copy(deep=True)
+    tail_config.expert.circa = 50
+    tail_config.misc.export_txt = not config.misc.export_txt
+    tail_config.misc.output_dir = tmp_path / "tail"
+    tail_config.misc.output_dir.mkdir()
+    processing = StandaloneLASProcessing(tail_config)
+    processing._draw_and_export_results = draw_and_export_results
+    assert processing.process_tail()
+    assert np.array_equal(exported[0]["tree_vector"], tree_vector)
+    assert exported[0]["cloud_shape"] == 42
+    assert processing.area_warning
+    assert (tmp_path / "tail" / "plot_config.ini").exists()
+
+    # Changing the algorithm does.
+    config.basic.upper_limit += 0.5
+    assert not StandaloneLASProcessing(config).process_tail()
+    config.basic.upper_limit -= 0.5
+    config.misc.cache_dir = None
+    assert not StandaloneLASProcessing(config).process_tail()
+
+
+def test_checkpoints(tmp_path: Path):
+    """Test that checkpoints are only reused when resuming, and removed once the run completes."""
+    input_file = tmp_path / "plot.las"
+    las = laspy.create(point_format=2, file_version="1.2")
+    las.xyz = np.arange(30.0).reshape(10, 3)
+    las.write(input_file)
+    misc = MiscParameters(input_file=input_file, output_dir=tmp_path, checkpoints="resume")
+    processing = StandaloneLASProcessing(FinConfiguration(misc=misc))
+    checkpoint_dir = tmp_path / "plot_checkpoints"
+    assert processing._checkpoint_dir() == checkpoint_dir
+    assert processing._stage_cache().cache_dir == checkpoint_dir
+
+    loaded = []
+
+    def interrupted_process():
+        processing._stage_cache().save("stripe", "key", clust_stripe=np.zeros((4, 4)))
+        raise MemoryError
+
+    def resumed_process():
+        loaded.append(processing._stage_cache().load("stripe", "key"))
+
+    processing._process = interrupted_process
+    with pytest.raises(MemoryError):
+        processing.process()
+    assert (checkpoint_dir / "stripe_key.npz").exists()
+
+    processing._process = resumed_process
+    processing.process()
+    assert loaded[0] is not None
+    assert not checkpoint_dir.exists()
+
+    # A new run starts from scratch.
+    processing._process = interrupted_process
+    with pytest.raises(MemoryError):
+        processing.process()
+    processing.config.misc.checkpoints = "on"
+    processing._process = resumed_process
+    processing.process()
+    assert loaded[1] is None
+
+    # The stage cache holds the checkpoints when it is set.
+    processing.config.misc.cache_dir = tmp_path / "cache"
+    assert processing._checkpoint_dir() is None
+    assert processing._stage_cache().cache_dir == tmp_path / "cache"
@@ -0,0 +1,69 @@
+import laspy
+import numpy as np
+import pytest
+
+from three_d_fin.processing.cancellation import CancellationToken, ProcessingCancelled
+from three_d_fin.processing.configuration import FinConfiguration, MiscParameters
+from three_d_fin.processing.instrumentation import StageSink
+from three_d_fin.processing.standalone_processing import StandaloneLASProcessing
+
+
+class _CancelAfter(StageSink):
+    """Cancel the processing at the end of a given stage."""
+
+    def __init__(self, processing: StandaloneLASProcessing, stage: str) -> None:
+        self.processing = processing
+        self.stage = stage
+        self.started: list[str] = []
+
+    def emit(self, event):
+        if event["event"] == "start":
+            self.started.append(event["stage"])
+        elif event["stage"] == self.stage:
+            self.processing.cancel()
+
+
+def test_cancellation_token():
+    """Test that the token only raises once cancelled, and until it is reset."""
+    token = CancellationToken()
+    token.check()
+    token.emit({"event": "start", "stage": "load"})
+    token.cancel()
+    assert token.cancelled
+    # Ends of stages are not interrupted.
+    token.emit({"event": "end", "stage": "load"})
+    with pytest.raises(ProcessingCancelled):
+        token.emit({"event": "start", "stage": "stripe"})
+    with pytest.raises(ProcessingCancelled):
+        token.check()
+    token.reset()
+    token.check()
+
+
+def test_cancel_processing(tmp_path):
+    """Test that a cancelled processing stops before its next stage and its progress updates."""
+    header = laspy.LasHeader(point_format=2, version="1.2")
+    header.add_extra_dim(laspy.ExtraBytesParams(name="Z0", type=np.float64))
+    las = laspy.LasData(header)
+    las.x = np.arange(1000) / 100.0
+    las.y = np.arange(1000) / 100.0
+    las.z = np.arange(1000) / 50.0
+    las["Z0"] = np.arange(1000) / 50.0
+    las.write(tmp_path / "cloud.las")
+    misc = MiscParameters(
+        is_normalized=True, input_file=tmp_path / "cloud.las", output_dir=tmp_path, memory_strategy="off"
+    )
+    processing = StandaloneLASProcessing(FinConfiguration(misc=misc))
+    processing.export_workers = 2
+    sink = _CancelAfter(processing, "load")
+    processing.instrumentation.add_sink(sink)
+    with pytest.raises(ProcessingCancelled):
+        processing.process()
+    assert sink.started == ["process", "load"]
+    assert processing._export_executor is None
+    assert not (tmp_path / "cloud_config.ini").exists()
+
+    with pytest.raises(ProcessingCancelled):
+        processing._progress_hook(1, 10)
+    processing.cancellation.reset()
+    processing._progress_hook(0, 10)
@@ -0,0 +1,47 @@
+import numpy as np
+from scipy.interpolate import griddata
+
+import dendromatics as dm
+from three_d_fin.processing.ground import lowest_points
+
+
+def _plot(n_points: int) -> tuple[np.ndarray, np.ndarray]:
+    """Get a 30 m wide plot on a sloped and rolling terrain, half of its points above the ground, and its ground height."""
+    rng = np.random.default_rng(0)
+    xy = rng.uniform(0.0, 30.0, (n_points, 2))
+    ground = 0.2 * xy[:, 0] + 0.5 * np.sin(xy[:, 1] / 5.0)
+    above = np.where(rng.uniform(0.0, 1.0, n_points) < 0.5, rng.uniform(0.0, 15.0, n_points), 0.0)
+    z = ground + above + rng.normal(0.0, 0.01, n_points)
+    return np.column_stack((xy, z + 100.0, rng.uniform(0.0, 1.0, n_points))), ground + 100.0
+
+
+def test_lowest_points(monkeypatch):
+    """Test that the lowest point of each cell is kept, the first one of ties."""
+    monkeypatch.setattr("three_d_fin.processing.ground.CHUNK_SIZE", 1000)
+    rng = np.random.default_rng(0)
+    coords = np.column_stack((rng.uniform(0.0, 10.0, (5500, 2)), rng.integers(0, 5, 5500))).astype(np.float32)
+    cell = np.floor((coords[:, 0:2] - coords[:, 0:2].min(axis=0)) / 0.7).astype(np.int64)
+    expected = []
+    for i in np.unique(cell[:, 0] * 100 + cell[:, 1]):
+        in_cell = np.flatnonzero(cell[:, 0] * 100 + cell[:, 1] == i)
+        expected.append(in_cell[np.argmin(coords[in_cell, 2])])
+    lowest = lowest_points(coords, 0.7)
+    assert lowest.dtype == np.float64
+    np.testing.assert_array_equal(lowest, coords[np.sort(expected)])
+
+    # Only the occupied cells are stored, even if the grid of tiny cells is huge.
+    coords = np.c_[rng.uniform(0.0, 1000.0, (5500, 2)), rng.uniform(0.0, 1.0, 5500)]
+    np.testing.assert_array_equal(lowest_points(coords, 1e-5), coords)
+
+
+def test_lowest_points_dtm():
+    """Test that the DTM of the lowest points is as close to the ground as the DTM of the whole cloud."""
+    coords, ground = _plot(300000)
+    dtm = dm.clean_cloth(dm.generate_dtm(coords[:, 0:3], cloth_resolution=0.5))
+    reduced = lowest_points(coords, 0.25 * 0.5)
+    assert reduced.shape[0] < coords.shape[0] / 4
+    reduced_dtm = dm.clean_cloth(dm.generate_dtm(reduced, cloth_resolution=0.5))
+    error = griddata(dtm[:, 0:2], dtm[:, 2], coords[:, 0:2]) - ground
+    reduced_error = griddata(reduced_dtm[:, 0:2], reduced_dtm[:, 2], coords[:, 0:2]) - ground
+    assert np.nanmean(np.abs(reduced_error)) < max(np.nanmean(np.abs(error)), 0.03)
+    assert np.nanmean(np.abs(reduced_error - error)) < 0.1
@@ -0,0 +1,49 @@
+import numpy as np
+
+import dendromatics as dm
+from three_d_fin.processing.individualization import block_grid, compute_axes
+
+# Stripe lower limit, stripe upper limit, h_range, min_points and d_max.
+PARAMETERS = (0.7, 3.5, 0.7, 20, 3.0)
+
+
+def _plot(n_stems: int, n_voxels: int) -> tuple[np.ndarray, np.ndarray]:
+    """Get the voxels of a 40 m wide plot and the stripe of its stems, some of them tilted."""
+    rng = np.random.default_rng(0)
+    stripe = []
+    for i in range(n_stems):
+        center = rng.uniform(0.0, 40.0, 2)
+        tilt = rng.uniform(-0.3, 0.3, 2)
+        z0 = rng.uniform(0.7, 3.5, 200)
+        angle = rng.uniform(0.0, 2 * np.pi, 200)
+        x = center[0] + tilt[0] * z0 + 0.15 * np.cos(angle)
+        y = center[1] + tilt[1] * z0 + 0.15 * np.sin(angle)
+        # Cluster IDs are not consecutive.
+        stripe.append(np.column_stack((x, y, z0 + 100.0, z0, np.full(200, 2.0 * i + 1.0))))
+    voxels = np.column_stack((rng.uniform(-5.0, 45.0, (n_voxels, 2)), rng.uniform(100.0, 115.0, n_voxels)))
+    return voxels, np.vstack(stripe)
+
+
+def test_block_grid():
+    """Test that every voxel lies in a single block, sorted by block."""
+    voxels, _ = _plot(1, 10000)
+    order, block_bounds = block_grid(voxels, 8)
+    np.testing.assert_array_equal(np.sort(order), np.arange(10000))
+    assert block_bounds[0] == 0 and block_bounds[-1] == 10000
+    assert block_bounds.shape[0] - 1 >= 8
+    # Blocks do not overlap in (x).
+    first_block = voxels[order[block_bounds[0] : block_bounds[1]]]
+    last_block = voxels[order[block_bounds[-2] : block_bounds[-1]]]
+    assert first_block[:, 0].max() < last_block[:, 0].min()
+
+
+def test_compute_axes():
+    """Test that the axes and the assignment are the ones of dendromatics."""
+    voxels, stripe = _plot(30, 50000)
+    expected = dm.compute_axes(voxels, stripe, *PARAMETERS, 0, 1, 2, Z0_field=3, tree_id_field=-1)
+    assert expected[0].shape[0] == 30
+    progress = []
+    results = compute_axes(voxels, stripe, PARAMETERS, 2, progress_hook=lambda count, total: progress.append(count))
+    for i in range(3):
+        np.testing.assert_array_equal(results[i], expected[i])
+    assert progress[0] == 0 and progress[-1] == len(progress) - 1
@@ -0,0 +1,51 @@
+import json
+from pathlib import Path
+
+from three_d_fin.processing.instrumentation import Instrumentation, JSONLinesSink, StageSink
+
+
+class ListSink(StageSink):
+    """Keep the events in memory."""
+
+    def __init__(self):
+        """Init the sink without any event."""
+        self.events = []
+
+    def emit(self, event):
+        """Keep the event."""
+        self.events.append(event)
+
+
+def test_instrumentation(tmp_path: Path):
+    """Test that stage events reach every sink, in the order of their emission."""
+    instrumentation = Instrumentation()
+    sink = ListSink()
+    json_sink = JSONLinesSink(tmp_path / "plot_timings.jsonl")
+    instrumentation.add_sink(sink)
+    instrumentation.add_sink(json_sink)
+
+    instrumentation.start("process")
+    instrumentation.start("stripe", points_in=100)
+    instrumentation.end("stripe", points_out=10, cached=False)
+    instrumentation.end("process", trees=2)
+
+    assert [(event["event"], event["stage"]) for event in sink.events] == [
+        ("start", "process"),
+        ("start", "stripe"),
+        ("end", "stripe"),
+        ("end", "process"),
+    ]
+    stripe = sink.events[2]
+    assert stripe["points_in"] == 100
+    assert stripe["points_out"] == 10
+    assert stripe["cached"] is False
+    assert stripe["wall_time"] >= 0
+    assert sink.events[3]["trees"] == 2
+
+    lines = (tmp_path / "plot_timings.jsonl").read_text().splitlines()
+    assert [json.loads(line) for line in lines] == sink.events
+
+    instrumentation.remove_sink(sink)
+    instrumentation.start("sections")
+    instrumentation.end("sections")
+    assert len(sink.events) == 4
@@ -0,0 +1,140 @@
+import os
+import re
+import zipfile
+from pathlib import Path
+
+import laspy
+import numpy as np
+import pytest
+
+from three_d_fin.processing.configuration import FinConfiguration, MiscParameters
+from three_d_fin.processing.io import (
+    export_results_bundle,
+    export_tabular_data,
+    load_dtm,
+    load_results_bundle,
+    select_laz_backend,
+    write_txt,
+)
+
+
+def test_load_esri_ascii_grid(tmp_path: Path):
+    """Test DTM loading from an ESRI ASCII grid.
+
+    Cells are converted to their centers, the first row being the northernmost
+    one, and no data cells are dropped.
+    """
+    grid_file = tmp_path / "dtm.asc"
+    grid_file.write_text(
+        "ncols 3\nnrows 2\nxllcorner 10.0\nyllcorner 20.0\ncellsize 1.0\nNODATA_value -9999\n"
+        "1.0 2.0 -9999\n4.0 5.0 6.0\n"
+    )
+    dtm = load_dtm(grid_file)
+    expected = np.array(
+        [
+            [10.5, 21.5, 1.0],
+            [11.5, 21.5, 2.0],
+            [10.5, 20.5, 4.0],
+            [11.5, 20.5, 5.0],
+            [12.5, 20.5, 6.0],
+        ]
+    )
+    assert np.allclose(dtm, expected)
+
+
+def test_select_laz_backend(monkeypatch: pytest.MonkeyPatch):
+    """Test that the lazrs parallel backend is only selected for several threads."""
+    monkeypatch.delenv("RAYON_NUM_THREADS", raising=False)
+    assert select_laz_backend(None) is None
+    assert "RAYON_NUM_THREADS" not in os.environ
+    assert select_laz_backend(1) == laspy.LazBackend.Lazrs
+    assert select_laz_backend(4) == laspy.LazBackend.LazrsParallel
+    assert os.environ["RAYON_NUM_THREADS"] == "4"
+
+
+def test_results_bundle(tmp_path: Path):
+    """Test that the results bundle round trips at full precision, in memory or memory-mapped."""
+    rng = np.random.default_rng(0)
+    results = {
+        "X_c": rng.uniform(0.0, 1000.0, (4, 6)),
+        "n_points_in": rng.integers(0, 100, (4, 6)),
+        "sections": np.arange(0.3, 2.1, 0.3),
+        # No tree.
+        "outliers": np.zeros((0, 6)),
+    }
+    config = FinConfiguration(misc=MiscParameters(output_dir=tmp_path, export_npz=True))
+    bundle_path = export_results_bundle(config, tmp_path / "plot", 1.5, 300, **results)
+    assert bundle_path == tmp_path / "plot_results.npz"
+
+    for mmap in (False, True):
+        loaded, metadata = load_results_bundle(bundle_path, mmap=mmap)
+        assert loaded.keys() == results.keys()
+        for name, array in results.items():
+            np.testing.assert_array_equal(loaded[name], array)
+            assert loaded[name].dtype == array.dtype
+        assert isinstance(loaded["X_c"], np.memmap) == mmap
+        assert metadata["cloud_size"] == 1.5
+        assert metadata["cloud_shape"] == 300
+        assert metadata["config"]["misc"]["export_npz"]
+
+
+def test_export_xlsx(tmp_path: Path):
+    """Test the sheets of the XLSX export, written row by row by xlsxwriter."""
+    n_trees, n_sections = 3, 4
+    R = np.full((n_trees, n_sections), 0.1)
+    R[0, 0] = np.nan
+    R[1, 1] = np.inf
+    matrix = np.zeros((n_trees, n_sections))
+    config = FinConfiguration(misc=MiscParameters(output_dir=tmp_path))
+    export_tabular_data(
+        config,
+        tmp_path / "plot",
+        matrix,
+        matrix,
+        R,
+        matrix,
+        matrix,
+        matrix,
+        np.arange(n_sections) * 0.2,
+        matrix,
+        np.ones((n_trees, 1)),
+        np.ones((n_trees, 3)),
+        np.ones((n_trees, 5)),
+        1.5,
+        300,
+    )
+    with zipfile.ZipFile(tmp_path / "plot.xlsx") as xlsx:
+        workbook = xlsx.read("xl/workbook.xml").decode()
+        diameters = xlsx.read("xl/worksheets/sheet2.xml").decode()
+    assert re.findall(r'<sheet name="([^"]+)"', workbook) == [
+        "Plot Metrics",
+        "Diameters",
+        "X",
+        "Y",
+        "Sections",
+        "Q(Overall Quality 0-1)",
+        "Q1(Outlier Probability)",
+        "Q2(Sector Occupancy)",
+        "Q3(Points Inner Circle)",
+    ]
+    # Tree labels, no NaN cell and infinite values as text.
+    assert re.search(r'<c r="B4" t="inlineStr"><is><t>T1</t></is></c><c r="D4"><v>0.2</v>', diameters)
+    assert '<c r="D5" t="inlineStr"><is><t>inf</t></is></c>' in diameters
+
+
+@pytest.mark.parametrize("precision", [0, 3, 6])
+def test_write_txt(tmp_path: Path, precision: int):
+    """Test that the text writer formats values as numpy.savetxt does, rounding ties included."""
+    rng = np.random.default_rng(0)
+    special = [0.0005, -0.0005, 0.0015, 2.5, -0.0, 1e-7, -1e-7, 0.125, 1e20, -1e300, np.nan, np.inf, -np.inf]
+    for data in (
+        rng.uniform(-1000.0, 1000.0, (50, 20)),
+        rng.uniform(4.7e6, 4.8e6, (20, 5)),
+        rng.integers(-(10**6), 10**6, (20, 10)) / 8.0,
+        np.array([special]),
+        np.arange(5) * 0.3,
+        np.zeros((0, 4)),
+    ):
+        write_txt(tmp_path / "values.txt", data, precision)
+        np.savetxt(tmp_path / "expected.txt", data, fmt=f"%.{precision}f")
+        assert (tmp_path / "values.txt").read_bytes() == (tmp_path / "expected.txt").read_bytes()
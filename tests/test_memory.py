@@ -0,0 +1,134 @@
+import laspy
+import numpy as np
+import pytest
+from pydantic.v1 import ValidationError
+
+from three_d_fin.processing import memory
+from three_d_fin.processing.configuration import FinConfiguration, MiscParameters
+from three_d_fin.processing.memory import CloudSummary, MemoryBudgetError, estimate_memory
+from three_d_fin.processing.standalone_processing import StandaloneLASProcessing
+
+MiB = 1024**2
+
+# A 1 ha plot of 100 million points, 30 m high.
+LARGE_CLOUD = CloudSummary(100_000_000, np.array([0.0, 0.0, 0.0]), np.array([100.0, 100.0, 30.0]), 34)
+
+
+def _processing(tmp_path, **misc_parameters) -> StandaloneLASProcessing:
+    """Get a processing of a small normalized cloud."""
+    header = laspy.LasHeader(point_format=2, version="1.2")
+    header.add_extra_dim(laspy.ExtraBytesParams(name="Z0", type=np.float64))
+    las = laspy.LasData(header)
+    las.x = np.arange(1000) / 100.0
+    las.y = np.arange(1000) / 100.0
+    las.z = np.arange(1000) / 50.0
+    las["Z0"] = np.arange(1000) / 50.0
+    las.write(tmp_path / "cloud.las")
+    misc = MiscParameters(is_normalized=True, input_file=tmp_path / "cloud.las", output_dir=tmp_path, **misc_parameters)
+    return StandaloneLASProcessing(FinConfiguration(misc=misc))
+
+
+def test_estimate_memory():
+    """Test that the lower memory executions are estimated to use less memory."""
+    config = FinConfiguration(misc=MiscParameters(is_normalized=True))
+    estimate = estimate_memory(LARGE_CLOUD, config)
+    assert estimate.peak == max(estimate.stages.values())
+    assert estimate.stages["individualization"] > estimate.stages["load"]
+    for update in ({"windowed_loading": True}, {"compact_coordinates": True}, {"tile_size": 20.0}):
+        lower_config = config.copy(update={"misc": config.misc.copy(update=update)})
+        assert estimate_memory(LARGE_CLOUD, lower_config).peak < estimate.peak
+    # The DTM is only estimated if the cloud is not normalized.
+    assert "dtm" not in estimate.stages
+    config = FinConfiguration(misc=MiscParameters(is_normalized=False))
+    assert "dtm" in estimate_memory(LARGE_CLOUD, config).stages
+
+
+def test_preflight(tmp_path, capsys):
+    """Test the refusal and the switch to a lower memory execution."""
+    processing = _processing(tmp_path, memory_budget=1, memory_strategy="refuse")
+    with pytest.raises(MemoryBudgetError):
+        processing.process()
+    # The cloud was not loaded.
+    assert not hasattr(processing, "base_cloud")
+
+    # Nothing changes if the estimate fits in the budget.
+    processing = _processing(tmp_path, memory_budget=100_000)
+    config = processing.config
+    assert processing.preflight().peak < 100_000 * MiB
+    assert processing.config is config
+
+    # Windowed loading first, then compact coordinates, then tiles.
+    processing = _processing(tmp_path)
+    processing._get_cloud_summary = lambda: LARGE_CLOUD
+    estimate = estimate_memory(LARGE_CLOUD, processing.config)
+    processing.config.misc.memory_budget = estimate.peak // MiB - 1
+    processing.preflight()
+    assert processing.config.misc.windowed_loading
+    assert not processing.config.misc.compact_coordinates
+    assert processing.config.misc.tile_size is None
+
+    # Executions changing the results are only run with the approximate strategy.
+    processing = _processing(tmp_path, memory_budget=4096)
+    processing._get_cloud_summary = lambda: LARGE_CLOUD
+    config = processing.config
+    with pytest.raises(MemoryBudgetError, match="approximate"):
+        processing.preflight()
+    assert processing.config is config
+
+    processing = _processing(tmp_path, memory_budget=4096, memory_strategy="approximate")
+    processing._get_cloud_summary = lambda: LARGE_CLOUD
+    estimate = processing.preflight()
+    assert estimate.peak <= 4096 * MiB
+    assert processing.config.misc.compact_coordinates
+    assert processing.config.misc.tile_size is not None
+    assert "Execution: compact coordinates, tiles of" in capsys.readouterr().out
+
+    processing = _processing(tmp_path, memory_budget=1, memory_strategy="approximate")
+    with pytest.raises(MemoryBudgetError, match="lowest memory"):
+        processing.preflight()
+
+    processing = _processing(tmp_path, memory_budget=1, memory_strategy="off")
+    assert processing.preflight() is None
+
+
+def test_preflight_run_scope(tmp_path):
+    """Test that the lower memory execution only applies to the run that switched to it."""
+    processing = _processing(tmp_path, cache_dir=tmp_path / "cache")
+    config = processing.config
+    processing.config.misc.memory_budget = estimate_memory(LARGE_CLOUD, config).peak // MiB - 1
+    processing._get_cloud_summary = lambda: LARGE_CLOUD
+    windowed_runs = []
+
+    def _process():
+        processing.preflight()
+        windowed_runs.append(processing.config.misc.windowed_loading)
+
+    processing._process = _process
+    processing.process()
+    assert windowed_runs == [True]
+    assert processing.config is config
+    assert not processing.config.misc.windowed_loading
+
+    # The next run, on a small cloud, starts from the user settings.
+    del processing._get_cloud_summary
+    processing.process()
+    assert windowed_runs == [True, False]
+
+    processing._get_cloud_summary = lambda: LARGE_CLOUD
+    assert not processing.process_tail()
+    assert processing.config is config
+
+
+def test_available_memory(monkeypatch):
+    """Test that an address space limit is not taken as resident memory available."""
+    if memory.resource is None:
+        pytest.skip("address space limits are not available on this platform")
+    limit = 4096 * MiB
+    monkeypatch.setattr(memory.resource, "getrlimit", lambda _: (limit, memory.resource.RLIM_INFINITY))
+    assert memory.available_memory() <= limit * (1.0 - memory.ADDRESS_SPACE_HEADROOM)
+
+
+def test_memory_strategy_validation():
+    """Test that only the known memory strategies are accepted."""
+    with pytest.raises(ValidationError):
+        MiscParameters(memory_strategy="swap")
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import dendromatics as dm
+from three_d_fin.processing.sections import SECTION_RESULTS, compute_sections, gather_stems, partition_trees
+
+# Section width, times_R, threshold, R_min, R_max, max_dist, n_points_section, n_sectors, min_n_sectors, width.
+PARAMETERS = (0.02, 0.5, 5, 0.03, 0.5, 0.02, 80, 16, 9, 2.0)
+
+
+def _stems(n_trees: int, n_points: int) -> np.ndarray:
+    """Get the points of n_trees noisy cylindrical stems, 1 to 5 m high, shuffled, with non consecutive tree IDs."""
+    rng = np.random.default_rng(0)
+    centers = rng.uniform(0.0, 50.0, (n_trees, 2))
+    radii = rng.uniform(0.05, 0.3, n_trees)
+    heights = rng.uniform(1.0, 5.0, n_trees)
+    tree = rng.integers(0, n_trees, n_points)
+    angle = rng.uniform(0.0, 2 * np.pi, n_points)
+    z0 = rng.uniform(0.0, 1.0, n_points) * heights[tree]
+    x = centers[tree, 0] + radii[tree] * np.cos(angle) + rng.normal(0.0, 0.005, n_points)
+    y = centers[tree, 1] + radii[tree] * np.sin(angle) + rng.normal(0.0, 0.005, n_points)
+    return np.column_stack((x, y, z0 + 100.0, z0, 3.0 * tree + 1.0, rng.uniform(0.0, 1.0, n_points)))
+
+
+def test_partition_trees():
+    """Test that the chunks split the sorted points on tree bounds."""
+    tree_id = np.array([3.0, 1.0, 3.0, 2.0, 1.0, 2.0, 2.0, 5.0])
+    order, tree_bounds, chunk_bounds = partition_trees(tree_id, 3)
+    # The sort is stable.
+    np.testing.assert_array_equal(order, [1, 4, 3, 5, 6, 0, 2, 7])
+    np.testing.assert_array_equal(tree_bounds, [0, 2, 5, 7, 8])
+    assert chunk_bounds[0] == 0 and chunk_bounds[-1] == 4
+    assert np.all(np.diff(chunk_bounds) > 0)
+    # More chunks than trees.
+    _, _, chunk_bounds = partition_trees(tree_id, 10)
+    np.testing.assert_array_equal(chunk_bounds, [0, 1, 2, 3, 4])
+    # Sorted points are not sorted again.
+    order, tree_bounds, _ = partition_trees(np.sort(tree_id), 3)
+    assert order is None
+    np.testing.assert_array_equal(tree_bounds, [0, 2, 5, 7, 8])
+
+
+def test_gather_stems(monkeypatch):
+    """Test that the stems are the selected points, sorted by tree."""
+    monkeypatch.setattr("three_d_fin.processing.sections.SELECTION_CHUNK_SIZE", 1000)
+    rng = np.random.default_rng(0)
+    coords = rng.uniform(0.0, 10.0, (5500, 4)).astype(np.float32)
+    tree_id = rng.integers(1, 20, 5500).astype(np.int32)
+    dist_axes = rng.uniform(0.0, 2.0, 5500).astype(np.float32)
+    selected = (dist_axes < 0.5) & (coords[:, 3] > 0.3) & (coords[:, 3] < 7.0)
+    expected = np.column_stack((coords[selected], tree_id[selected], dist_axes[selected]))
+    expected = expected[np.argsort(expected[:, 4], kind="stable")]
+    stems = gather_stems(coords, tree_id, dist_axes, 0.5, 0.3, 7.0)
+    assert stems.dtype == np.float64
+    np.testing.assert_array_equal(stems, expected)
+
+
+@pytest.mark.parametrize("n_workers, sort", [(1, False), (2, False), (1, True), (2, True)])
+def test_compute_sections(n_workers, sort):
+    """Test that the results are the ones of dendromatics, in the same tree order."""
+    stems = _stems(20, 400000)
+    if sort:
+        stems = stems[np.argsort(stems[:, 4], kind="stable")]
+    sections = np.arange(0.3, 5.0, 0.2)
+    X_c, Y_c, R, check_circle, _, sector_perct, n_points_in = dm.compute_sections(stems, sections, *PARAMETERS)
+    expected = [X_c, Y_c, R, check_circle, sector_perct, n_points_in]
+    progress = []
+    results = compute_sections(
+        stems, sections, PARAMETERS, n_workers, progress_hook=lambda count, total: progress.append((count, total))
+    )
+    assert tuple(results) == SECTION_RESULTS
+    for i, result in enumerate(results.values()):
+        np.testing.assert_array_equal(result, expected[i])
+    assert progress[0] == (0, 20) and progress[-1] == (20, 20)
+    # Some sections are fitted, the ones above the top of the stems are not.
+    assert np.any(expected[3] != 2) and np.any(expected[3] == 2)
@@ -0,0 +1,190 @@
+from pathlib import Path
+
+import laspy
+import numpy as np
+import pytest
+
+import dendromatics as dm
+from three_d_fin.processing.abstract_processing import _voxelate_columns
+from three_d_fin.processing.configuration import FinConfiguration, MiscParameters
+from three_d_fin.processing.standalone_processing import StandaloneLASProcessing
+
+
+def test_enriched_header():
+    """Test the header of the streamed enriched cloud.
+
+    Files older than LAS 1.4 are converted and the missing fields are added,
+    fields already defined by the user are kept as they are.
+    """
+    header = laspy.LasHeader(point_format=2, version="1.2")
+    header.add_extra_dim(laspy.ExtraBytesParams(name="tree_ID", type=np.int32))
+    header.point_count = 10
+
+    processing = StandaloneLASProcessing(FinConfiguration(misc=MiscParameters(is_normalized=False)))
+    enriched_header = processing._get_enriched_header(header)
+    assert enriched_header.version == laspy.header.Version(major=1, minor=4)
+    assert enriched_header.point_count == 0
+    assert list(enriched_header.point_format.extra_dimension_names) == ["tree_ID", "dist_axes", "Z0"]
+    assert header.point_count == 10
+
+    processing = StandaloneLASProcessing(FinConfiguration(misc=MiscParameters(is_normalized=True)))
+    enriched_header = processing._get_enriched_header(header)
+    assert list(enriched_header.point_format.extra_dimension_names) == ["tree_ID", "dist_axes"]
+
+
+def test_exports():
+    """Test that the barrier waits for every export and raises their exceptions."""
+    processing = StandaloneLASProcessing(FinConfiguration())
+    exported = []
+
+    def failing_export():
+        raise OSError("disk full")
+
+    processing._submit_export(exported.append, 1)
+    processing._submit_export(failing_export)
+    processing._submit_export(exported.append, 2)
+    with pytest.raises(OSError, match="disk full"):
+        processing._wait_for_exports()
+    assert sorted(exported) == [1, 2]
+
+    # Nothing is left to wait for.
+    processing._wait_for_exports()
+
+
+def test_compact_coordinates():
+    """Test the conversion to compact coordinates and back, and the voxelation of compact coordinates."""
+    rng = np.random.default_rng(0)
+    offset = np.array([500000.0, 4700000.0, 200.0])
+    coords = np.c_[rng.uniform(0.0, 50.0, (10_000, 3)) + offset, rng.uniform(0.0, 30.0, 10_000)]
+    processing = StandaloneLASProcessing(FinConfiguration())
+    assert processing._to_global(coords) is coords
+
+    compact_coords = processing._to_compact(coords)
+    assert compact_coords.dtype == np.float32
+    np.testing.assert_array_equal(processing.origin, np.floor(coords[:, 0:3].min(axis=0)))
+    # z0 is not translated.
+    np.testing.assert_allclose(compact_coords[:, 3], coords[:, 3], atol=1e-5)
+    np.testing.assert_allclose(processing._to_global(compact_coords[:, 0:3]), coords[:, 0:3], atol=1e-5)
+    tree_vector = np.c_[np.arange(3), np.zeros((3, 3)), compact_coords[:3, 0:3]]
+    np.testing.assert_allclose(processing._to_global(tree_vector, first_column=4)[:, 4:7], coords[:3, 0:3], atol=1e-5)
+
+    # Same voxels as dendromatics, in double or single precision.
+    for cloud in (coords, compact_coords):
+        voxelated_cloud, vox_to_cloud_ind, _ = dm.voxelate(
+            np.asarray(cloud[:, 0:3], dtype=np.float64), 0.15, 0.1, 5, with_n_points=False, silent=True
+        )
+        columns_voxelated_cloud, columns_vox_to_cloud_ind = _voxelate_columns(cloud, 0.15, 0.1, 5)
+        np.testing.assert_array_equal(columns_voxelated_cloud, voxelated_cloud)
+        np.testing.assert_array_equal(columns_vox_to_cloud_ind, vox_to_cloud_ind)
+
+
+def test_normalization_memory(tmp_path, monkeypatch):
+    """Test that the normalized heights are computed in the loaded buffer, without copying the cloud."""
+    import tracemalloc
+
+    from three_d_fin.processing import abstract_processing
+
+    monkeypatch.setattr(abstract_processing, "NORMALIZATION_CHUNK_SIZE", 50_000)
+    rng = np.random.default_rng(0)
+    n_points = 500_000
+    header = laspy.LasHeader(point_format=2, version="1.2")
+    header.scales = np.array([0.001, 0.001, 0.001])
+    las = laspy.LasData(header)
+    x = rng.uniform(0.0, 20.0, n_points)
+    las.x = x
+    las.y = rng.uniform(0.0, 20.0, n_points)
+    las.z = rng.uniform(0.0, 10.0, n_points) + 0.1 * x
+    las.write(tmp_path / "cloud.las")
+    grid = np.mgrid[0:21, 0:21].reshape(2, -1).T.astype(np.float64)
+    dtm = np.c_[grid, 0.1 * grid[:, 0]]
+
+    processing = StandaloneLASProcessing(
+        FinConfiguration(misc=MiscParameters(input_file=tmp_path / "cloud.las", is_normalized=False))
+    )
+    processing._load_base_cloud()
+    tracemalloc.start()
+    coords = processing._get_xyz_from_base()
+    processing._normalize_heights(coords, dtm)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert coords.shape == (n_points, 4)
+    # Same heights as a normalization of the whole cloud at once.
+    np.testing.assert_array_equal(coords[:, 3], dm.normalize_heights(coords[:, 0:3], dtm))
+    # The buffer, one scaled coordinate and the arrays of a chunk.
+    assert peak < 1.5 * coords.nbytes
+
+
+def _write_sloped_plot(input_file: Path, offset: tuple[float, float, float] = (0.0, 0.0, 0.0)):
+    """Write a 20 m wide plot on a 10 % slope, with four 12 m high stems, translated by offset."""
+    rng = np.random.default_rng(0)
+    ground_xy = rng.uniform(0.0, 20.0, (40000, 2))
+    clouds = [np.c_[ground_xy, 0.1 * ground_xy[:, 0] + 0.02 * rng.standard_normal(40000)]]
+    for x, y in ((5.0, 5.0), (15.0, 6.0), (6.0, 15.0), (14.0, 14.0)):
+        angle = rng.uniform(0.0, 2 * np.pi, 20000)
+        radius = 0.15 + 0.005 * rng.standard_normal(20000)
+        height = rng.uniform(0.0, 12.0, 20000)
+        clouds.append(np.c_[x + radius * np.cos(angle), y + radius * np.sin(angle), 0.1 * x + height])
+    header = laspy.LasHeader(point_format=2, version="1.2")
+    header.scales = np.array([0.001, 0.001, 0.001])
+    header.offsets = np.array(offset)
+    las = laspy.LasData(header)
+    las.xyz = np.vstack(clouds) + offset
+    las.write(input_file)
+
+
+def test_dtm_reuse(tmp_path: Path):
+    """Test that a run given the exported DTM of a previous run gives the same heights and trees."""
+    input_file = tmp_path / "plot.las"
+    _write_sloped_plot(input_file)
+    enriched = {}
+    for name, dtm_file in (("generated", None), ("reused", tmp_path / "generated" / "plot_dtm.npy")):
+        output_dir = tmp_path / name
+        output_dir.mkdir()
+        processing = StandaloneLASProcessing(
+            FinConfiguration(
+                misc=MiscParameters(
+                    input_file=input_file, output_dir=output_dir, is_normalized=False, dtm_file=dtm_file
+                )
+            )
+        )
+        processing.process()
+        enriched[name] = laspy.read(output_dir / "plot_tree_ID_dist_axes.las")
+
+    assert np.unique(enriched["generated"].tree_ID).shape[0] == 4
+    np.testing.assert_array_equal(enriched["reused"].Z0, enriched["generated"].Z0)
+    np.testing.assert_array_equal(enriched["reused"].tree_ID, enriched["generated"].tree_ID)
+    np.testing.assert_array_equal(enriched["reused"].dist_axes, enriched["generated"].dist_axes)
+
+
+def test_compact_run(tmp_path: Path):
+    """Test that compact coordinates give the double precision heights, and trees within a few millimeters.
+
+    Only the algorithm after the normalization runs in single precision.
+    """
+    input_file = tmp_path / "plot.las"
+    _write_sloped_plot(input_file, (500000.0, 4700000.0, 200.0))
+    enriched = {}
+    tree_vector = {}
+    for compact_coordinates in (False, True):
+        output_dir = tmp_path / str(compact_coordinates)
+        output_dir.mkdir()
+        processing = StandaloneLASProcessing(
+            FinConfiguration(
+                misc=MiscParameters(
+                    input_file=input_file,
+                    output_dir=output_dir,
+                    is_normalized=False,
+                    compact_coordinates=compact_coordinates,
+                )
+            )
+        )
+        processing.process()
+        enriched[compact_coordinates] = laspy.read(output_dir / "plot_tree_ID_dist_axes.las")
+        tree_vector[compact_coordinates] = laspy.read(output_dir / "plot_tree_locator.las").xyz
+
+    # Z0 is computed in double precision and stored in single precision.
+    np.testing.assert_allclose(enriched[True].Z0, enriched[False].Z0, rtol=0.0, atol=1e-5)
+    assert np.count_nonzero(enriched[True].tree_ID != enriched[False].tree_ID) <= 0.001 * len(enriched[False].points)
+    np.testing.assert_allclose(enriched[True].dist_axes, enriched[False].dist_axes, rtol=0.0, atol=0.1)
+    np.testing.assert_allclose(tree_vector[True], tree_vector[False], rtol=0.0, atol=0.005)
@@ -0,0 +1,40 @@
+import json
+import subprocess
+import sys
+
+# Modules that are slow to import, or that require a Qt install able to open a display.
+HEAVY_MODULES = ("PyQt5", "dendromatics", "pandas", "sklearn")
+
+
+def _imported_heavy_modules(code: str) -> list[str]:
+    """Run code in a fresh interpreter and get the heavy modules it imported."""
+    probe = f"""
+import json, sys
+try:
+{code}
+except SystemExit:
+    pass
+print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))
+"""
+    result = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def test_cli_startup_imports():
+    """Test that the CLI does not import the GUI nor the algorithm libraries before they are used."""
+    assert (
+        _imported_heavy_modules(
+            "    sys.argv = ['3DFin', 'cli', '--help']\n"
+            "    from three_d_fin.processing import launch_application\n"
+            "    launch_application()"
+        )
+        == []
+    )
+    assert (
+        _imported_heavy_modules(
+            "    from three_d_fin.processing.configuration import FinConfiguration\n"
+            "    from three_d_fin.processing.standalone_processing import StandaloneLASProcessing\n"
+            "    StandaloneLASProcessing(FinConfiguration())"
+        )
+        == []
+    )
@@ -0,0 +1,216 @@
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+import laspy
+import numpy as np
+import pytest
+
+from three_d_fin.processing.cache import StageCache
+from three_d_fin.processing.configuration import FinConfiguration, MiscParameters
+from three_d_fin.processing.standalone_processing import StandaloneLASProcessing
+from three_d_fin.processing.tiling import (
+    NO_ID,
+    TileGrid,
+    _remap_tree_ids,
+    _stitch_trees,
+    _TileProcessing,
+    _TileWriters,
+    _write_enriched_cloud,
+    split_into_tiles,
+)
+
+
+def test_tile_grid():
+    """Test that each point belongs to a single core and to the tiles whose buffer contains it."""
+    grid = TileGrid(np.array([0.0, 0.0]), np.array([20.0, 10.0]), 10.0, 1.0)
+    assert grid.shape.tolist() == [2, 1]
+
+    x = np.array([0.0, 9.5, 10.0, 20.0])
+    y = np.array([0.0, 5.0, 5.0, 10.0])
+    assert grid.core_index(x, y).tolist() == [[0, 0], [0, 0], [1, 0], [1, 0]]
+    lower, upper = grid.extended_index_range(x, y)
+    assert lower[:, 0].tolist() == [0, 0, 0, 1]
+    assert upper[:, 0].tolist() == [0, 1, 1, 1]
+
+
+def test_split_into_tiles(tmp_path: Path, monkeypatch):
+    """Test that the tiles are the same when fewer files than tiles can be open at once."""
+    rng = np.random.default_rng(0)
+    header = laspy.LasHeader(point_format=2, version="1.2")
+    header.add_extra_dim(laspy.ExtraBytesParams(name="Z0", type=np.float64))
+    las = laspy.LasData(header)
+    las.xyz = rng.uniform(0.0, [40.0, 40.0, 10.0], (20000, 3))
+    las.Z0 = las.z
+    las.write(tmp_path / "cloud.las")
+    header = laspy.read(tmp_path / "cloud.las").header
+    grid = TileGrid(header.mins, header.maxs, 10.0, 1.0)
+    # Small chunks spread the points of each tile over many writes.
+    monkeypatch.setattr("three_d_fin.processing.tiling.CHUNK_SIZE", 1000)
+    open_tiles = []
+    write = _TileWriters.write
+
+    def counting_write(writers, key, points):
+        write(writers, key, points)
+        open_tiles.append(len(writers._open))
+
+    monkeypatch.setattr(_TileWriters, "write", counting_write)
+
+    tiles = {}
+    for max_open_tiles in (100, 3):
+        monkeypatch.setattr("three_d_fin.processing.tiling.MAX_OPEN_TILES", max_open_tiles)
+        tile_dir = tmp_path / str(max_open_tiles)
+        tile_dir.mkdir()
+        tiles[max_open_tiles], cloud_shape = split_into_tiles(tmp_path / "cloud.las", grid, tile_dir, "Z0")
+        assert len(tiles[max_open_tiles]) == 16
+        assert cloud_shape > 0
+        assert max(open_tiles) == min(max_open_tiles, 16)
+        open_tiles.clear()
+    for key, tile_path in tiles[100].items():
+        expected = laspy.read(tile_path)
+        tile = laspy.read(tiles[3][key])
+        assert tile.header.point_count == expected.header.point_count
+        np.testing.assert_array_equal(tile.points.array, expected.points.array)
+
+
+def test_write_enriched_cloud(tmp_path: Path, monkeypatch):
+    """Test that the enriched cloud holds the results of the core tile of each point, in the input order."""
+    monkeypatch.setattr("three_d_fin.processing.tiling.CHUNK_SIZE", 1000)
+    monkeypatch.setattr("three_d_fin.processing.standalone_processing.CHUNK_SIZE", 1000)
+    rng = np.random.default_rng(0)
+    header = laspy.LasHeader(point_format=2, version="1.2")
+    header.add_extra_dim(laspy.ExtraBytesParams(name="Z0", type=np.float64))
+    las = laspy.LasData(header)
+    las.xyz = rng.uniform(0.0, [40.0, 40.0, 10.0], (20000, 3))
+    las.Z0 = las.z
+    las.write(tmp_path / "cloud.las")
+    las = laspy.read(tmp_path / "cloud.las")
+    grid = TileGrid(las.header.mins, las.header.maxs, 10.0, 1.0)
+    tile_dir = tmp_path / "tiles"
+    tile_dir.mkdir()
+    tiles, _ = split_into_tiles(tmp_path / "cloud.las", grid, tile_dir, "Z0")
+
+    # Each tile assigns its points to its single tree, at their (x) distance.
+    tile_results = {}
+    tree_ids = {}
+    for tile_id, (key, tile_path) in enumerate(tiles.items()):
+        tile = laspy.read(tile_path)
+        assigned_path = tile_dir / f"assigned_{tile_id}.npy"
+        np.save(assigned_path, np.c_[tile.Z0, np.full(len(tile.points), 7.0), tile.x])
+        tile_results[key] = SimpleNamespace(assigned_path=assigned_path, results={"tree_vector": np.full((1, 9), 7.0)})
+        tree_ids[key] = (np.array([tile_id]), np.array([tile_id]))
+
+    misc = MiscParameters(input_file=tmp_path / "cloud.las", output_dir=tmp_path, is_normalized=True)
+    fin_processing = StandaloneLASProcessing(FinConfiguration(misc=misc))
+    _write_enriched_cloud(fin_processing, grid, tiles, tile_results, tree_ids, tile_dir)
+
+    enriched = laspy.read(fin_processing._get_output_path("_tree_ID_dist_axes"))
+    np.testing.assert_array_equal(enriched.xyz, las.xyz)
+    core_index = grid.core_index(las.x, las.y)
+    expected_ids = [list(tiles).index(tuple(key)) for key in core_index.tolist()]
+    np.testing.assert_array_equal(enriched.tree_ID, expected_ids)
+    np.testing.assert_array_equal(enriched.dist_axes, las.x)
+
+
+def test_stitch_trees():
+    """Test the deduplication of a tree straddling two tiles.
+
+    The tree close to the tile edge is detected by both tiles, only the detection
+    made from the tile whose core contains it is kept, the other one is mapped to it.
+    """
+    grid = TileGrid(np.array([0.0, 0.0]), np.array([20.0, 10.0]), 10.0, 5.0)
+
+    def tile(*locations):
+        tree_vector = np.zeros((len(locations), 9))
+        tree_vector[:, 0] = np.arange(len(locations)) * 10
+        tree_vector[:, 4:6] = locations
+        return SimpleNamespace(results={"tree_vector": tree_vector})
+
+    tile_results = {(0, 0): tile([5.0, 5.0], [9.8, 5.0]), (1, 0): tile([9.9, 5.1], [15.0, 5.0])}
+    tree_ids = _stitch_trees(grid, tile_results, 0.5)
+
+    assert tree_ids[(0, 0)][0].tolist() == [0, 1]
+    assert tree_ids[(1, 0)][0].tolist() == [-1, 2]
+    assert tree_ids[(1, 0)][1].tolist() == [1, 2]
+
+    point_ids = _remap_tree_ids(np.array([0.0, 10.0, 5.0, NO_ID]), np.array([0.0, 10.0]), tree_ids[(1, 0)][1])
+    assert point_ids.tolist() == [1, 2, NO_ID, NO_ID]
+
+
+@pytest.mark.parametrize("n_stripe_points", [0, 50])
+def test_tile_without_tree(tmp_path: Path, n_stripe_points: int):
+    """Test that a tile without any stem gets empty results, and that other errors are raised."""
+    rng = np.random.default_rng(0)
+    xyz = np.c_[rng.uniform(0.0, 20.0, (20000, 2)), rng.uniform(0.0, 0.3, 20000)]
+    # A few scattered points in the stripe, none of them vertical.
+    xyz = np.r_[xyz, np.c_[rng.uniform(0.0, 20.0, (n_stripe_points, 2)), rng.uniform(0.5, 3.0, n_stripe_points)]]
+    header = laspy.LasHeader(point_format=2, version="1.2")
+    header.add_extra_dim(laspy.ExtraBytesParams(name="Z0", type=np.float64))
+    las = laspy.LasData(header)
+    las.xyz = xyz
+    las.Z0 = xyz[:, 2]
+    las.write(tmp_path / "tile.las")
+    misc = MiscParameters(input_file=tmp_path / "tile.las", output_dir=tmp_path, is_normalized=True)
+
+    tile_processing = _TileProcessing(FinConfiguration(misc=misc))
+    tile_processing.process()
+    assert tile_processing.results["tree_vector"].shape[0] == 0
+    assert np.all(np.load(tile_processing.assigned_path)[:, 1] == NO_ID)
+
+    def failing_process():
+        raise ValueError("operands could not be broadcast together")
+
+    tile_processing._process = failing_process
+    with pytest.raises(ValueError, match="broadcast"):
+        tile_processing.process()
+
+
+def test_tile_cache_keys(tmp_path: Path, monkeypatch):
+    """Test that the tile stages are keyed on the input file, and that the tile files are never hashed."""
+    rng = np.random.default_rng(0)
+    clouds = [np.c_[rng.uniform(0.0, 20.0, (20000, 2)), rng.uniform(0.0, 0.3, 20000)]]
+    for x, y in ((5.0, 5.0), (15.0, 6.0), (6.0, 15.0), (14.0, 14.0)):
+        angle = rng.uniform(0.0, 2 * np.pi, 20000)
+        radius = 0.15 + 0.005 * rng.standard_normal(20000)
+        clouds.append(np.c_[x + radius * np.cos(angle), y + radius * np.sin(angle), rng.uniform(0.0, 12.0, 20000)])
+    xyz = np.vstack(clouds)
+    header = laspy.LasHeader(point_format=2, version="1.2")
+    header.add_extra_dim(laspy.ExtraBytesParams(name="Z0", type=np.float64))
+    las = laspy.LasData(header)
+    las.xyz = xyz
+    las.Z0 = xyz[:, 2]
+    las.write(tmp_path / "plot.las")
+    hashed = []
+    file_digest = StageCache.file_digest
+
+    def recording_file_digest(cache, path):
+        hashed.append(Path(path).resolve())
+        return file_digest(cache, path)
+
+    monkeypatch.setattr(StageCache, "file_digest", recording_file_digest)
+
+    cache_dir = tmp_path / "cache"
+    tree_locators = []
+    for run in range(2):
+        output_dir = tmp_path / str(run)
+        output_dir.mkdir()
+        misc = MiscParameters(
+            input_file=tmp_path / "plot.las",
+            output_dir=output_dir,
+            is_normalized=True,
+            tile_size=10.0,
+            tile_buffer=2.0,
+            cache_dir=cache_dir,
+        )
+        StandaloneLASProcessing(FinConfiguration(misc=misc)).process()
+        tree_locators.append(laspy.read(output_dir / "plot_tree_locator.las").xyz)
+        entries = set(cache_dir.glob("*.npz"))
+        if run == 0:
+            first_entries = entries
+
+    assert set(hashed) == {(tmp_path / "plot.las").resolve()}
+    assert list(json.loads((cache_dir / "digests.json").read_text())) == [str((tmp_path / "plot.las").resolve())]
+    # The second run found the stages of the tiles.
+    assert entries == first_entries
+    assert tree_locators[0].shape[0] == 4
+    np.testing.assert_array_equal(tree_locators[1], tree_locators[0])
@@ -0,0 +1,84 @@
+from pathlib import Path
+
+import laspy
+import numpy as np
+
+import dendromatics as dm
+from three_d_fin.processing.abstract_processing import _voxelate_columns
+from three_d_fin.processing.configuration import (
+    AdvancedParameters,
+    ExpertParameters,
+    FinConfiguration,
+    MiscParameters,
+)
+from three_d_fin.processing.standalone_processing import StandaloneLASProcessing
+from three_d_fin.processing.windowed import WindowedCloud
+
+
+def _write_plot(input_file: Path) -> np.ndarray:
+    """Write a normalized 10 m wide plot, 20 m high, and get its (x), (y), (z) and z0 coordinates."""
+    rng = np.random.default_rng(0)
+    xyz = rng.uniform([0.0, 0.0, 0.0], [10.0, 10.0, 20.0], (20000, 3))
+    header = laspy.LasHeader(point_format=2, version="1.2")
+    header.add_extra_dim(laspy.ExtraBytesParams(name="Z0", type=np.float64))
+    header.scales = [0.001, 0.001, 0.001]
+    las = laspy.LasData(header)
+    las.xyz = xyz
+    las.Z0 = xyz[:, 2]
+    las.write(input_file)
+    las = laspy.read(input_file)
+    return np.c_[las.x, las.y, las.z, las.Z0]
+
+
+def test_windowed_cloud(tmp_path: Path):
+    """Test that the thinned cloud gives the same individualization voxels as the whole cloud.
+
+    Points below the window height are kept as they are, and every point is
+    matched with a row of the thinned cloud lying in the same voxel.
+    """
+    input_file = tmp_path / "plot.las"
+    coords = _write_plot(input_file)
+
+    windowed_cloud = WindowedCloud(input_file, "Z0", 5.0, 0.5, 0.5)
+    assert windowed_cloud.point_count == coords.shape[0]
+    assert windowed_cloud.coords.shape[0] < coords.shape[0]
+    in_window = coords[:, 3] <= 5.0
+    assert np.array_equal(windowed_cloud.coords[: np.count_nonzero(in_window)], coords[in_window])
+
+    voxels = dm.voxelate(coords.copy(), 0.5, 0.5, 5, with_n_points=False, silent=True)[0]
+    thinned_voxels = dm.voxelate(windowed_cloud.coords.copy(), 0.5, 0.5, 5, with_n_points=False, silent=True)[0]
+    assert np.array_equal(voxels, thinned_voxels)
+
+    rows = np.concatenate([rows for _, rows in windowed_cloud.iter_rows()])
+    mins = coords[:, 0:3].min(axis=0)
+    assert np.array_equal(
+        np.floor((windowed_cloud.coords[rows, 0:3] - mins) / 0.5), np.floor((coords[:, 0:3] - mins) / 0.5)
+    )
+
+
+def test_windowed_loading_voxels(tmp_path: Path):
+    """Test that the windowed loading gives the individualization voxels of the whole cloud.
+
+    The (x, y) and (z) resolutions of the voxels differ, res_z being their (x, y)
+    resolution as in dendromatics.individualize_trees.
+    """
+    input_file = tmp_path / "plot.las"
+    coords = _write_plot(input_file)
+    expert = ExpertParameters(res_xy=1.0, res_z=0.5)
+    processing = StandaloneLASProcessing(
+        FinConfiguration(
+            advanced=AdvancedParameters(maximum_height=5.0),
+            expert=expert,
+            misc=MiscParameters(input_file=input_file, is_normalized=True, windowed_loading=True),
+        )
+    )
+    processing._load_base_cloud()
+    windowed_coords = processing._get_xyz_z0_from_base()
+    assert windowed_coords.shape[0] < coords.shape[0]
+
+    voxels, vox_to_cloud_ind = _voxelate_columns(coords, expert.res_z, expert.res_xy, 5)
+    windowed_voxels, windowed_vox_to_cloud_ind = _voxelate_columns(windowed_coords, expert.res_z, expert.res_xy, 5)
+    np.testing.assert_array_equal(windowed_voxels, voxels)
+    # Every point is matched with a row of the thinned cloud in the same voxel.
+    rows = np.concatenate([rows for _, rows in processing.base_cloud.iter_rows()])
+    np.testing.assert_array_equal(windowed_vox_to_cloud_ind[rows], vox_to_cloud_ind)